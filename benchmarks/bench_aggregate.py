@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+分布统计耗时对比
+
+比较客户端统计（每次100个号码调用 batch_detect_carriers，逐条结果序列化后解析再计数）
+与服务端一次遍历统计（aggregate_carriers 只返回汇总）的耗时与响应字节数。
+
+用法:
+    python benchmarks/bench_aggregate.py
+    python benchmarks/bench_aggregate.py --backend dict --size 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mcp_server
+from phone_index import CompiledPhoneDatabase, DirectIndexDatabase, encode_database
+
+from bench_batch import generate_database, generate_numbers
+
+
+def client_side(phone_numbers: list) -> int:
+    """原有做法：按每批100个取回逐条结果后在客户端计数，返回响应字节数"""
+    renderer = mcp_server.RESPONSE_RENDERERS["compact"]
+    counts = {}
+    size = 0
+    for chunk in mcp_server.iter_chunks(phone_numbers, 100):
+        text = renderer.render(mcp_server.batch_detect_carriers(chunk))
+        size += len(text.encode())
+        for result in json.loads(text)["results"]:
+            if result["success"]:
+                for key in (result["carrier"], result["province"], result["city"]):
+                    counts[key] = counts.get(key, 0) + 1
+    return size
+
+
+def server_side(phone_numbers: list) -> int:
+    """服务端一次遍历统计，返回响应字节数"""
+    text = mcp_server.RESPONSE_RENDERERS["compact"].render(
+        mcp_server.aggregate_carriers(phone_numbers)
+    )
+    return len(text.encode())
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="分布统计耗时对比")
+    parser.add_argument(
+        "--backend", choices=["dict", "direct", "compiled"], default="direct"
+    )
+    parser.add_argument("--records", type=int, default=492088)
+    parser.add_argument("--size", type=int, default=100000)
+    args = parser.parse_args()
+
+    database = generate_database(args.records)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.backend == "direct":
+            database = DirectIndexDatabase.from_mapping(database)
+        elif args.backend == "compiled":
+            filename = os.path.join(tmpdir, "phone_intervals.bin")
+            with open(filename, "wb") as f:
+                f.write(encode_database(database, intervals=True))
+            database = CompiledPhoneDatabase(filename)
+
+        numbers = generate_numbers(args.size)
+        print(f"后端: {args.backend}，号码数: {args.size}")
+        print(f"{'方式':<16}{'耗时(ms)':>12}{'响应字节数':>14}")
+        with patch.object(mcp_server, "get_phone_database", return_value=database):
+            for label, func in (
+                ("客户端统计", client_side),
+                ("服务端统计", server_side),
+            ):
+                start = time.perf_counter()
+                size = func(numbers)
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"{label:<16}{elapsed:>12.1f}{size:>14}")
+        del database
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+批量查询吞吐量对比
+
+比较逐个调用 detect_carrier 与向量化批量查询（校验 + 前缀转换 + 集中查询）
+在 100、1万、100万个号码时的吞吐量。
+
+用法:
+    python benchmarks/bench_batch.py
+    python benchmarks/bench_batch.py --backend compiled --sizes 100 10000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import phone_index
+from mcp_server import detect_carrier, lookup_phone_numbers
+from phone_index import (
+    CompiledPhoneDatabase,
+    DirectIndexDatabase,
+    RecordInterner,
+    encode_database,
+    lookup_prefixes,
+    prefixes_of,
+)
+
+CARRIERS = [
+    ("China Mobile", "移动"),
+    ("China Unicom", "联通"),
+    ("China Telecom", "电信"),
+]
+
+
+def generate_database(count: int) -> dict:
+    """生成按万号段连续分配的模拟数据库"""
+    rng = random.Random(0)
+    interner = RecordInterner()
+    database = {}
+    prefix = 1300000
+    while len(database) < count:
+        province = f"省份{rng.randrange(31)}"
+        city = f"城市{rng.randrange(340)}"
+        record = interner.record(province, city, *rng.choice(CARRIERS))
+        for _ in range(10):
+            database[str(prefix)] = record
+            prefix += 1
+    return database
+
+
+def generate_numbers(count: int) -> list:
+    """生成号码：大部分为标准格式，少量带分隔符需要规范化"""
+    rng = random.Random(1)
+    numbers = [
+        f"1{rng.randrange(3, 8)}{rng.randrange(10 ** 9):09d}" for _ in range(count)
+    ]
+    for i in range(0, count, 50):
+        numbers[i] = "138-1234-5678"
+    return numbers
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="批量查询吞吐量对比")
+    parser.add_argument(
+        "--backend", choices=["dict", "direct", "compiled"], default="direct"
+    )
+    parser.add_argument("--records", type=int, default=492088)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 1000000])
+    args = parser.parse_args()
+
+    database = generate_database(args.records)
+    tmpdir = tempfile.TemporaryDirectory()
+    if args.backend == "direct":
+        database = DirectIndexDatabase.from_mapping(database)
+    elif args.backend == "compiled":
+        filename = os.path.join(tmpdir.name, "phone_intervals.bin")
+        with open(filename, "wb") as f:
+            f.write(encode_database(database, intervals=True))
+        database = CompiledPhoneDatabase(filename)
+
+    print(
+        f"后端: {args.backend}，numpy: {'是' if phone_index.np is not None else '否'}"
+    )
+    print(f"{'号码数':>10}{'逐个(号/秒)':>16}{'批量(号/秒)':>16}{'仅查询(号/秒)':>18}")
+    for size in args.sizes:
+        numbers = generate_numbers(size)
+        single = timed(lambda: [detect_carrier(phone, database) for phone in numbers])
+        batch = timed(lookup_phone_numbers, numbers, database)
+        engine = timed(lambda: lookup_prefixes(database, prefixes_of(numbers)))
+        print(
+            f"{size:>10}{size / single:>16,.0f}{size / batch:>16,.0f}"
+            f"{size / engine:>18,.0f}"
+        )
+
+    del database
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+单号码查询的微基准
+
+比较原实现（正则校验 + 字符串切片 + 每次重新构建结果字典）与快速路径
+（一次遍历校验得到整数前缀 + 按整数查找 + 复制共享结果模板）每次调用的耗时。
+
+用法:
+    python benchmarks/bench_detect.py
+    python benchmarks/bench_detect.py --backend compiled --calls 200000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp_server import detect_carrier
+from phone_index import CompiledPhoneDatabase, DirectIndexDatabase, encode_database
+
+from bench_batch import generate_database
+
+
+def legacy_detect_carrier(phone_number, database):
+    """优化前的 detect_carrier，用作对照"""
+    if not re.match(r"^1[3-9]\d{9}$", phone_number):
+        return {
+            "success": False,
+            "error": "Invalid phone number format. Must be 11 digits starting with 1.",
+        }
+    prefix = phone_number[:7]
+    if prefix in database:
+        info = database[prefix]
+        return {
+            "success": True,
+            "phone_number": phone_number,
+            "carrier": info["carrier"],
+            "carrier_cn": info["carrier_cn"],
+            "province": info["province"],
+            "city": info["city"],
+            "prefix": prefix,
+        }
+    return {
+        "success": False,
+        "error": f"Phone number prefix {prefix} not found in database",
+    }
+
+
+def ns_per_call(func, numbers, database, repeat: int) -> float:
+    """取多轮中最快一轮的平均单次耗时（纳秒）"""
+    timer = timeit.Timer(lambda: [func(phone, database) for phone in numbers])
+    return min(timer.repeat(repeat=repeat, number=1)) / len(numbers) * 1e9
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="单号码查询微基准")
+    parser.add_argument(
+        "--backend",
+        choices=["dict", "direct", "compiled", "all"],
+        default="all",
+    )
+    parser.add_argument("--records", type=int, default=492088)
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    mapping = generate_database(args.records)
+    prefixes = list(mapping)
+    rng = random.Random(1)
+    numbers = [
+        f"{rng.choice(prefixes)}{rng.randrange(10000):04d}" for _ in range(args.calls)
+    ]
+    invalid = ["138-1234-567x", "12345", "23812345678"] * (args.calls // 3)
+
+    backends = [args.backend]
+    if args.backend == "all":
+        backends = ["dict", "direct", "compiled"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(
+            f"{'后端':<10}{'输入':<8}{'原实现(ns)':>14}{'快速路径(ns)':>16}{'加速比':>10}"
+        )
+        for backend in backends:
+            database = mapping
+            if backend == "direct":
+                database = DirectIndexDatabase.from_mapping(mapping)
+            elif backend == "compiled":
+                filename = os.path.join(tmpdir, "phone_intervals.bin")
+                with open(filename, "wb") as f:
+                    f.write(encode_database(mapping, intervals=True))
+                database = CompiledPhoneDatabase(filename)
+
+            for label, inputs in (("有效", numbers), ("无效", invalid)):
+                before = ns_per_call(
+                    legacy_detect_carrier, inputs, database, args.repeat
+                )
+                after = ns_per_call(detect_carrier, inputs, database, args.repeat)
+                print(
+                    f"{backend:<10}{label:<8}{before:>14.0f}{after:>16.0f}"
+                    f"{before / after:>10.2f}x"
+                )
+            del database
+
+
+if __name__ == "__main__":
+    main()
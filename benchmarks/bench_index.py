@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+前缀索引的构建与查询耗时
+
+比较按运营商 + 城市查询前缀、按号段列出前缀时，全量扫描数据库与通过索引
+查询第一页的耗时，并报告各后端构建索引的耗时。
+
+用法:
+    python benchmarks/bench_index.py
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import patch
+
+import mcp_server
+from phone_index import (
+    CompiledPhoneDatabase,
+    DirectIndexDatabase,
+    PrefixIndex,
+    encode_database,
+)
+
+from bench_batch import generate_database
+
+
+def scan_ranges(database, carrier: str, city: str) -> list:
+    """原有离线脚本的做法：遍历全部前缀后筛选"""
+    return sorted(
+        int(prefix)
+        for prefix, info in database.items()
+        if info["city"] == city and carrier in (info["carrier"], info["carrier_cn"])
+    )
+
+
+def scan_segment(database, segment: str) -> list:
+    """遍历全部前缀后筛选号段"""
+    return sorted(
+        (prefix, info)
+        for prefix, info in database.items()
+        if prefix.startswith(segment)
+    )
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="前缀索引构建与查询耗时")
+    parser.add_argument("--records", type=int, default=492088)
+    args = parser.parse_args()
+
+    mapping = generate_database(args.records)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backends = {
+            "dict": mapping,
+            "direct": DirectIndexDatabase.from_mapping(mapping),
+        }
+        for intervals in (False, True):
+            filename = os.path.join(tmpdir, f"db{intervals}.bin")
+            with open(filename, "wb") as f:
+                f.write(encode_database(mapping, intervals=intervals))
+            backends["interval" if intervals else "compiled"] = CompiledPhoneDatabase(
+                filename
+            )
+
+        print(f"{'后端':<10}{'构建索引(s)':>14}")
+        for name, database in backends.items():
+            _, seconds = timed(PrefixIndex.from_database, database)
+            print(f"{name:<10}{seconds:>14.3f}")
+
+        info = next(iter(mapping.values()))
+        carrier, city = info["carrier_cn"], info["city"]
+        matched, scan_seconds = timed(scan_ranges, mapping, carrier, city)
+        with patch.object(mcp_server, "get_phone_database", return_value=mapping):
+            mcp_server.get_prefix_index()
+            page, query_seconds = timed(mcp_server.find_prefixes, carrier, None, city)
+            listed, list_seconds = timed(mcp_server.list_prefixes, "138")
+        print(f"\n查询 {carrier} {city}: {len(matched)} 个前缀")
+        print(f"全量扫描: {scan_seconds * 1000:.2f} ms")
+        print(
+            f"倒排表首页: {query_seconds * 1000:.2f} ms "
+            f"({len(page['ranges'])}/{page['total_ranges']} 个区间)"
+        )
+        matched, scan_seconds = timed(scan_segment, mapping, "138")
+        print(f"\n列出号段 138: {len(matched)} 个前缀")
+        print(f"全量扫描: {scan_seconds * 1000:.2f} ms")
+        print(
+            f"有序数组首页: {list_seconds * 1000:.2f} ms "
+            f"({len(listed['prefixes'])}/{listed['total']} 个前缀)"
+        )
+        del backends, database
+
+
+if __name__ == "__main__":
+    main()
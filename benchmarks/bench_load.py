@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+数据库加载的内存与耗时对比
+
+比较原始 json.load（每个前缀一个字典）与字符串驻留 + PhoneRecord 共享记录两种方式。
+每种方式在独立子进程中运行，以便分别测量常驻内存峰值 (ru_maxrss)。
+
+用法:
+    python benchmarks/bench_load.py                     # 使用 data/phone_database.json
+    python benchmarks/bench_load.py --synthetic 492088  # 使用生成的模拟数据
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phone_index import RecordInterner
+
+CARRIERS = [
+    ("China Mobile", "移动"),
+    ("China Unicom", "联通"),
+    ("China Telecom", "电信"),
+    ("China Broadcasting", "广电"),
+    ("China Tietong", "铁通"),
+]
+
+
+def generate_database(count: int, filename: str):
+    """生成与真实数据规模相近的模拟数据库（按万号段连续分配）"""
+    rng = random.Random(0)
+    cities = [(f"省份{i // 12}", f"城市{i}") for i in range(340)]
+    database = {}
+    prefix = 1300000
+    while len(database) < count:
+        province, city = rng.choice(cities)
+        carrier, carrier_cn = rng.choice(CARRIERS)
+        for _ in range(min(10, count - len(database))):
+            database[str(prefix)] = {
+                "province": province,
+                "city": city,
+                "carrier": carrier,
+                "carrier_cn": carrier_cn,
+            }
+            prefix += 1
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(database, f, ensure_ascii=False, indent=2)
+
+
+def load(filename: str, mode: str) -> dict:
+    """按指定方式加载数据库"""
+    with open(filename, "r", encoding="utf-8") as f:
+        if mode == "interned":
+            return json.load(f, object_hook=RecordInterner().object_hook)
+        return json.load(f)
+
+
+def measure(filename: str, mode: str):
+    """在当前进程中加载数据库并输出测量结果（JSON）"""
+    # 第一次加载只计时，tracemalloc 会显著拖慢分配
+    start = time.perf_counter()
+    database = load(filename, mode)
+    elapsed = time.perf_counter() - start
+    del database
+
+    tracemalloc.start()
+    database = load(filename, mode)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    try:
+        import resource
+
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        maxrss_mb = maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        maxrss_mb = None
+
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "records": len(database),
+                "load_seconds": elapsed,
+                "heap_mb": current / 1024 / 1024,
+                "maxrss_mb": maxrss_mb,
+            }
+        )
+    )
+
+
+def run_child(filename: str, mode: str) -> dict:
+    """在子进程中测量，避免两种方式互相影响内存峰值"""
+    output = subprocess.check_output(
+        [sys.executable, __file__, "--measure", mode, "--database", filename]
+    )
+    return json.loads(output)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="数据库加载内存与耗时对比")
+    parser.add_argument("--database", default="data/phone_database.json")
+    parser.add_argument("--synthetic", type=int, help="生成指定条数的模拟数据")
+    parser.add_argument(
+        "--measure", choices=["plain", "interned"], help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.database, args.measure)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = args.database
+        if args.synthetic:
+            filename = os.path.join(tmpdir, "phone_database.json")
+            generate_database(args.synthetic, filename)
+        elif not os.path.exists(filename):
+            print(f"{filename} 不存在，可使用 --synthetic 492088 生成模拟数据")
+            sys.exit(1)
+
+        results = [run_child(filename, mode) for mode in ("plain", "interned")]
+
+    print(f"数据库: {filename} ({results[0]['records']} 条记录)")
+    print(f"{'方式':<10}{'加载耗时(s)':>14}{'堆内存(MB)':>14}{'RSS峰值(MB)':>14}")
+    for result in results:
+        maxrss = result["maxrss_mb"]
+        print(
+            f"{result['mode']:<10}{result['load_seconds']:>14.3f}"
+            f"{result['heap_mb']:>14.1f}"
+            f"{maxrss if maxrss is None else format(maxrss, '.1f'):>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
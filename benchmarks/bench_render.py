@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+工具响应序列化耗时对比
+
+比较原实现（json.dumps(indent=2) 渲染结果文本，再 json.dumps 整个响应）
+与片段拼接渲染（pretty 与 compact 两种格式）生成单号码、100个号码批量（逐条与列式布局）
+响应行的耗时与字节数。
+
+用法:
+    python benchmarks/bench_render.py
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp_server import (
+    RESPONSE_RENDERERS,
+    columnar_results,
+    encode_message,
+    lookup_phone_numbers,
+)
+
+from bench_batch import generate_database
+
+
+def envelope(text: str) -> dict:
+    """构建 JSON-RPC 工具响应"""
+    return {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": {"content": [{"type": "text", "text": text}]},
+    }
+
+
+def legacy_response(value) -> bytes:
+    """优化前的两次序列化：带缩进渲染结果文本，再以默认参数编码整个响应"""
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    return (json.dumps(envelope(text)) + "\n").encode()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="工具响应序列化耗时对比")
+    parser.add_argument("--records", type=int, default=492088)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    database = generate_database(args.records)
+    prefixes = list(database)
+    rng = random.Random(1)
+    # 批量号码集中在少数号段，与实际业务中的批量数据分布相近
+    clustered = rng.sample(prefixes, 10)
+    numbers = [f"{rng.choice(clustered)}{rng.randrange(10000):04d}" for _ in range(100)]
+    results = lookup_phone_numbers(numbers, database)
+    payloads = {
+        "单号码": results[0],
+        "批量100": {"success": True, "results": results, "total": len(results)},
+        "批量100列式": columnar_results(numbers, results),
+    }
+
+    candidates = {"原实现": legacy_response}
+    for name, renderer in RESPONSE_RENDERERS.items():
+        candidates[name] = lambda value, renderer=renderer: encode_message(
+            envelope(renderer.render(value))
+        )
+
+    print(f"{'响应':<10}{'方式':<24}{'耗时(us)':>12}{'字节数':>10}")
+    for label, payload in payloads.items():
+        for name, func in candidates.items():
+            seconds = min(
+                timeit.repeat(lambda: func(payload), number=args.number, repeat=5)
+            )
+            size = len(func(payload))
+            micros = seconds / args.number * 1e6
+            print(f"{label:<10}{name:<24}{micros:>12.1f}{size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+数据库分布统计耗时对比
+
+比较原 analyze_database 的做法（遍历全部记录构建三个计数字典并排序）、
+从编译后数据库保存的归属地计数汇总，以及增量构建时按变更前缀更新分布的耗时。
+
+用法:
+    python benchmarks/bench_stats.py
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parse_phone_data import diff_databases
+from phone_index import (
+    CompiledPhoneDatabase,
+    DatabaseStats,
+    database_stats,
+    encode_database,
+)
+
+from bench_batch import generate_database
+
+
+def legacy_analyze(phone_database) -> tuple:
+    """原 analyze_database 的统计部分"""
+    carriers, provinces, cities = {}, {}, {}
+    for info in phone_database.values():
+        carriers[info["carrier"]] = carriers.get(info["carrier"], 0) + 1
+        provinces[info["province"]] = provinces.get(info["province"], 0) + 1
+        cities[info["city"]] = cities.get(info["city"], 0) + 1
+    return (
+        sorted(carriers.items()),
+        sorted(provinces.items(), key=lambda x: x[1], reverse=True)[:10],
+        sorted(cities.items(), key=lambda x: x[1], reverse=True)[:10],
+    )
+
+
+def summarize(stats: DatabaseStats) -> tuple:
+    """在归属地计数上汇总三种分布"""
+    return tuple(
+        sorted(stats.totals(fields).items(), key=lambda x: x[1], reverse=True)
+        for fields in (["carrier"], ["province"], ["province", "city"])
+    )
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="数据库分布统计耗时对比")
+    parser.add_argument("--records", type=int, default=492088)
+    parser.add_argument("--changes", type=int, default=1000)
+    args = parser.parse_args()
+
+    database = generate_database(args.records)
+    updated = dict(database)
+    donor = database["1300000"]
+    for prefix in list(database)[-args.changes :]:
+        updated[prefix] = donor
+    delta = diff_databases(database, updated)
+    previous = DatabaseStats.from_mapping(database)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "phone_database.bin")
+        with open(filename, "wb") as f:
+            f.write(encode_database(database))
+        compiled = CompiledPhoneDatabase(filename)
+
+        candidates = {
+            "原实现（遍历全部记录）": lambda: legacy_analyze(database),
+            "完整统计 + 汇总": lambda: summarize(DatabaseStats.from_mapping(database)),
+            "读取编译文件计数 + 汇总": lambda: summarize(database_stats(compiled)),
+            f"增量更新 {args.changes} 个前缀": lambda: DatabaseStats(
+                dict(previous.counts)
+            ).apply_delta(database, updated, delta),
+        }
+        print(f"{'方式':<28}{'耗时(ms)':>12}")
+        for label, func in candidates.items():
+            print(f"{label:<28}{timed(func) * 1000:>12.2f}")
+        del compiled
+
+
+if __name__ == "__main__":
+    main()
@@ -4,59 +4,405 @@
 """
 
 import asyncio
+import csv
+import itertools
 import json
+import os
 import re
 import sys
-from typing import Any, Dict
+import threading
+import time
+import unicodedata
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from json.encoder import encode_basestring
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from phone_index import (
+    SHARD_MANIFEST,
+    CompiledPhoneDatabase,
+    DatabaseStats,
+    DirectIndexDatabase,
+    PhoneRecord,
+    PrefixIndex,
+    RecordInterner,
+    ShardedPhoneDatabase,
+    database_stats,
+    group_prefixes,
+    lookup_prefixes,
+    lookup_record,
+    prefix_of,
+    prefixes_of,
+    rejected_positions,
+    result_template,
+    tally_codes,
+)
+
+DATABASE_FILE = "data/phone_database.json"
+COMPILED_DATABASE_FILE = "data/phone_database.bin"
+INTERVAL_DATABASE_FILE = "data/phone_intervals.bin"
+SHARD_DIRECTORY = "data/shards"
+
+# 查询后端: auto（二进制 mmap 或 JSON 字典）/ direct（直接寻址前缀表）
+# / interval（区间压缩表，二分查找）/ sharded（按号段按需加载分片）
+DATABASE_BACKEND = os.environ.get("PHONE_DB_BACKEND", "auto")
+# sharded 后端常驻内存的分片数上限，0 表示不限制
+MAX_RESIDENT_SHARDS = int(os.environ.get("PHONE_DB_MAX_SHARDS", "0"))
 
 
 # 加载手机号数据库
-def load_phone_database():
-    """加载手机号数据库"""
+def load_phone_database() -> Mapping:
+    """加载手机号数据库，并按 PHONE_DB_BACKEND 构建查询后端"""
+    if DATABASE_BACKEND == "interval":
+        return load_database_source([INTERVAL_DATABASE_FILE])
+    if DATABASE_BACKEND == "sharded":
+        try:
+            return ShardedPhoneDatabase(SHARD_DIRECTORY, MAX_RESIDENT_SHARDS)
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法加载分片数据库 {SHARD_DIRECTORY} ({e})", file=sys.stderr)
+
+    database = load_database_source([COMPILED_DATABASE_FILE, INTERVAL_DATABASE_FILE])
+    if DATABASE_BACKEND == "direct":
+        return DirectIndexDatabase.from_mapping(database)
+    return database
+
+
+def load_database_source(compiled_files: Sequence[str]) -> Mapping:
+    """加载手机号数据库，优先通过 mmap 加载编译后的二进制数据库"""
+    for filename in compiled_files:
+        if not os.path.exists(filename):
+            continue
+        try:
+            return CompiledPhoneDatabase(filename)
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法加载 {filename} ({e})", file=sys.stderr)
+
     try:
-        with open("data/phone_database.json", "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(DATABASE_FILE, "r", encoding="utf-8") as f:
+            database: Dict[str, PhoneRecord] = json.load(
+                f, object_hook=RecordInterner().object_hook
+            )
+            return database
     except FileNotFoundError:
-        print("警告: phone_database.json 文件不存在，使用默认数据库")
+        print("警告: phone_database.json 文件不存在，使用默认数据库", file=sys.stderr)
         return {}
 
 
-# 手机号数据库
-PHONE_DATABASE = load_phone_database()
+# 手机号数据库，由后台线程加载，加载完成后设置 DATABASE_READY
+PHONE_DATABASE: Mapping = {}
+DATABASE_READY = threading.Event()
+DATABASE_STATUS: Dict[str, Any] = {
+    "ready": False,
+    "backend": DATABASE_BACKEND,
+    "records": 0,
+    "load_seconds": None,
+    "loaded_at": None,
+    "reloads": 0,
+    "last_reload_error": None,
+    "index_seconds": None,
+}
+_loader_lock = threading.Lock()
+_loader_thread: Optional[threading.Thread] = None
+_watcher_thread: Optional[threading.Thread] = None
+_loaded_signature: Optional[Tuple] = None
 
+# 热加载检查间隔（秒），0 表示关闭
+RELOAD_INTERVAL = float(os.environ.get("PHONE_DB_RELOAD_INTERVAL", "30"))
 
-def detect_carrier(phone_number: str) -> Dict[str, Any]:
-    """检测手机号运营商和归属地"""
-    # 验证手机号格式
-    if not re.match(r"^1[3-9]\d{9}$", phone_number):
-        return {
-            "success": False,
-            "error": "Invalid phone number format. Must be 11 digits starting with 1.",
-        }
 
-    # 提取前缀（前7位）
-    prefix = phone_number[:7]
+def database_signature() -> Tuple:
+    """数据库文件的 (路径, inode, 修改时间, 大小)，用于发现新的数据版本"""
+    signature: List[Tuple[str, Optional[int], Optional[int], Optional[int]]] = []
+    for filename in (
+        COMPILED_DATABASE_FILE,
+        INTERVAL_DATABASE_FILE,
+        os.path.join(SHARD_DIRECTORY, SHARD_MANIFEST),
+        DATABASE_FILE,
+    ):
+        try:
+            stat = os.stat(filename)
+            signature.append((filename, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((filename, None, None, None))
+    return tuple(signature)
 
-    # 查找数据库
-    if prefix in PHONE_DATABASE:
-        info = PHONE_DATABASE[prefix]
-        return {
-            "success": True,
-            "phone_number": phone_number,
-            "carrier": info["carrier"],
-            "carrier_cn": info["carrier_cn"],
-            "province": info["province"],
-            "city": info["city"],
-            "prefix": prefix,
+
+def _install_database(database: Mapping, load_seconds: float) -> None:
+    """原子替换全局数据库，已在处理中的请求继续使用各自持有的旧快照"""
+    global PHONE_DATABASE
+    PHONE_DATABASE = database
+    DATABASE_STATUS.update(
+        {
+            "ready": True,
+            "records": len(database),
+            "load_seconds": round(load_seconds, 3),
+            "loaded_at": datetime.now(timezone.utc).isoformat(),
         }
+    )
+
+
+def _load_database_in_background() -> None:
+    """后台加载数据库并记录加载耗时"""
+    global _loaded_signature
+    _loaded_signature = database_signature()
+    start = time.perf_counter()
+    try:
+        database = load_phone_database()
+    except Exception as e:
+        print(f"错误: 加载手机号数据库失败: {e}", file=sys.stderr)
+        database = {}
+
+    _install_database(database, time.perf_counter() - start)
+    DATABASE_READY.set()
+    if DATABASE_BACKEND != "sharded":
+        # 就绪后继续在本线程中统计分布并构建前缀索引，
+        # 分片后端在首次使用时再处理，旧版 manifest 没有计数时不会在启动时加载全部分片
+        get_database_stats(database)
+        get_prefix_index(database)
+
+
+def start_database_loading() -> None:
+    """启动后台数据库加载（重复调用只会加载一次）"""
+    global _loader_thread
+    with _loader_lock:
+        if _loader_thread is None:
+            _loader_thread = threading.Thread(
+                target=_load_database_in_background, name="phone-db-loader", daemon=True
+            )
+            _loader_thread.start()
+
+
+def reload_phone_database() -> bool:
+    """重新加载数据库并原子替换，失败时保留当前数据库"""
+    global _loaded_signature
+    signature = database_signature()
+    start = time.perf_counter()
+    try:
+        database = load_phone_database()
+    except Exception as e:
+        # 记录失败的版本，避免同一份损坏文件被反复加载
+        _loaded_signature = signature
+        DATABASE_STATUS["last_reload_error"] = str(e)
+        print(f"错误: 重新加载手机号数据库失败: {e}", file=sys.stderr)
+        return False
+
+    _loaded_signature = signature
+    if not len(database):
+        # 数据库文件缺失或为空时 load_phone_database 返回空数据库，不替换当前版本
+        DATABASE_STATUS["last_reload_error"] = "reloaded database is empty"
+        print("错误: 重新加载的手机号数据库为空，保留当前数据库", file=sys.stderr)
+        return False
+
+    # 先读取新版本的前缀分布并构建前缀索引，替换后的查询不会等待
+    if DATABASE_BACKEND != "sharded":
+        get_database_stats(database)
+        get_prefix_index(database)
+    elapsed = time.perf_counter() - start
+    _install_database(database, elapsed)
+    DATABASE_STATUS["reloads"] += 1
+    DATABASE_STATUS["last_reload_error"] = None
+    print(
+        f"数据库已重新加载: {len(database)} 条记录，耗时 {elapsed:.3f} 秒",
+        file=sys.stderr,
+    )
+    return True
+
+
+def _watch_database(interval: float) -> None:
+    """定期检查数据库文件，发现新版本时在本线程中重建索引并替换"""
+    while True:
+        time.sleep(interval)
+        if DATABASE_READY.is_set() and database_signature() != _loaded_signature:
+            reload_phone_database()
+
+
+def start_database_watcher(interval: float = RELOAD_INTERVAL) -> None:
+    """启动数据库热加载检查线程"""
+    global _watcher_thread
+    with _loader_lock:
+        if _watcher_thread is None and interval > 0:
+            _watcher_thread = threading.Thread(
+                target=_watch_database,
+                args=(interval,),
+                name="phone-db-watcher",
+                daemon=True,
+            )
+            _watcher_thread.start()
+
+
+def get_phone_database() -> Mapping:
+    """返回已加载的数据库，必要时等待后台加载完成"""
+    if not DATABASE_READY.is_set():
+        start_database_loading()
+        DATABASE_READY.wait()
+    return PHONE_DATABASE
+
+
+# 前缀索引及其所属的数据库，数据库替换后按需为新版本重建
+_prefix_index: Optional[Tuple[Mapping, PrefixIndex]] = None
+_index_lock = threading.Lock()
+
+
+def get_prefix_index(database: Optional[Mapping] = None) -> PrefixIndex:
+    """返回数据库的前缀索引（有序前缀数组与按字段的倒排表），首次使用时构建"""
+    global _prefix_index
+    if database is None:
+        database = get_phone_database()
+    current = _prefix_index
+    if current is not None and current[0] is database:
+        return current[1]
+
+    with _index_lock:
+        current = _prefix_index
+        if current is None or current[0] is not database:
+            start = time.perf_counter()
+            current = (database, PrefixIndex.from_database(database))
+            _prefix_index = current
+            DATABASE_STATUS["index_seconds"] = round(time.perf_counter() - start, 3)
+    return current[1]
+
+
+# 前缀分布统计及其所属的数据库
+_database_stats: Optional[Tuple[Mapping, DatabaseStats]] = None
+
+
+def get_database_stats(database: Optional[Mapping] = None) -> DatabaseStats:
+    """返回数据库的前缀分布统计
+
+    编译后的数据库与分片 manifest 中保存了构建时统计的计数，只需按归属地汇总；
+    JSON 字典后端在首次使用时遍历一次。结果按数据库缓存，热加载后随新版本更新。
+    """
+    global _database_stats
+    if database is None:
+        database = get_phone_database()
+    current = _database_stats
+    if current is not None and current[0] is database:
+        return current[1]
+
+    with _index_lock:
+        current = _database_stats
+        if current is None or current[0] is not database:
+            current = _database_stats = (database, database_stats(database))
+    return current[1]
+
+
+# 兼容路径使用的号码格式，与快速路径未覆盖的输入保持历史行为一致
+PHONE_NUMBER_PATTERN = re.compile(r"^1[3-9]\d{9}$")
+
+# 号码中常见的分隔符：空白、连字符、点、括号、斜杠
+PHONE_SEPARATORS = re.compile(r"[\s\-.()/]")
+# 国家码前缀，仅当去掉后恰好剩下11位时才视为国家码
+COUNTRY_CODES = ("+86", "0086", "86")
+
+
+def normalize_phone_number(phone_number: str) -> Tuple[str, List[str]]:
+    """规范化号码格式，返回规范化后的号码以及依次应用的规范化步骤
+
+    步骤名称：fullwidth（全角字符转半角）、separators（去除分隔符）、
+    country_code（去除 +86/0086/86 国家码）。
+    """
+    applied = []
+    number = phone_number
+    if not number.isascii():
+        folded = unicodedata.normalize("NFKC", number)
+        if folded != number:
+            applied.append("fullwidth")
+            number = folded
+    stripped = PHONE_SEPARATORS.sub("", number)
+    if stripped != number:
+        applied.append("separators")
+        number = stripped
+    for code in COUNTRY_CODES:
+        if len(number) == len(code) + 11 and number.startswith(code):
+            applied.append("country_code")
+            number = number[len(code) :]
+            break
+    return number, applied
+
+
+def build_result(info: Mapping, phone_number: str) -> Dict[str, Any]:
+    """由归属地记录的共享模板生成检测结果"""
+    if isinstance(info, PhoneRecord):
+        result = info.result_template().copy()
+    else:
+        result = result_template(info)
+    result["phone_number"] = phone_number
+    result["prefix"] = phone_number[:7]
+    return result
+
+
+def detect_carrier(
+    phone_number: str, database: Optional[Mapping] = None
+) -> Dict[str, Any]:
+    """检测手机号运营商和归属地
+
+    标准的11位 ASCII 数字号码直接查找；其余输入先规范化，
+    结果中的 input 与 normalization 字段记录原始输入和应用的规范化步骤。
+    """
+    if database is None:
+        database = get_phone_database()
+
+    # 快速路径：一次遍历完成校验并得到整数前缀，按整数查找共享记录
+    prefix = prefix_of(phone_number)
+    if prefix >= 0:
+        info = lookup_record(database, prefix)
+        if info is None:
+            return {
+                "success": False,
+                "error": f"Phone number prefix {phone_number[:7]} "
+                "not found in database",
+            }
+        return build_result(info, phone_number)
+
+    # 慢路径：仅在含有非数字字符或长度不符时规范化后重新校验
+    number, applied = normalize_phone_number(phone_number)
+    prefix = prefix_of(number)
+    if prefix >= 0:
+        info = lookup_record(database, prefix)
+    elif PHONE_NUMBER_PATTERN.match(number):
+        # 非 ASCII 数字等罕见输入沿用字符串前缀查找
+        info = database.get(number[:7])
     else:
         return {
             "success": False,
-            "error": f"Phone number prefix {prefix} not found in database",
+            "error": "Invalid phone number format. Must be 11 digits starting with 1.",
+        }
+
+    if info is None:
+        result = {
+            "success": False,
+            "error": f"Phone number prefix {number[:7]} not found in database",
         }
+    else:
+        result = build_result(info, number)
+    if applied:
+        result["input"] = phone_number
+        result["normalization"] = applied
+    return result
+
 
+# 批量检测结果的布局：rows 为逐条结果对象，columnar 为并列数组 + 去重的归属地表
+BATCH_LAYOUTS = ("rows", "columnar")
+# 检测结果中归属地字段的顺序，也是列式布局中归属地表每一项的字段顺序
+RESULT_REGION_FIELDS = ["carrier", "carrier_cn", "province", "city"]
 
-def batch_detect_carriers(phone_numbers: list) -> Dict[str, Any]:
+
+def batch_detect_carriers(phone_numbers: list, layout: str = "rows") -> Dict[str, Any]:
     """批量检测手机号运营商和归属地"""
     if not isinstance(phone_numbers, list):
         return {"success": False, "error": "Input must be a list of phone numbers"}
@@ -67,29 +413,788 @@ def batch_detect_carriers(phone_numbers: list) -> Dict[str, Any]:
             "error": "Maximum 100 phone numbers allowed per batch",
         }
 
+    if layout not in BATCH_LAYOUTS:
+        return {
+            "success": False,
+            "error": f"Invalid layout: {layout}. "
+            f"Must be one of {', '.join(BATCH_LAYOUTS)}",
+        }
+
+    summary: Dict[str, int] = {}
+    results = lookup_phone_numbers(phone_numbers, get_phone_database(), summary)
+    if layout == "columnar":
+        columnar = columnar_results(phone_numbers, results)
+        columnar["summary"] = summary
+        return columnar
+    return {
+        "success": True,
+        "results": results,
+        "total": len(results),
+        "summary": summary,
+    }
+
+
+def columnar_results(
+    phone_numbers: list, results: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """把逐条检测结果转换为列式布局
+
+    第 i 个号码的结果由各列第 i 项组成：region[i] 为 regions 表下标（失败时为 null），
+    error[i] 为 errors 表下标（成功时为 null）。归属地与错误信息均去重后按首次出现顺序排列，
+    normalization 列仅在有号码经过规范化时出现。
+    """
+    region_index: Dict[Tuple[Any, ...], int] = {}
+    error_index: Dict[str, int] = {}
+    numbers: List[Any] = []
+    prefixes: List[Optional[str]] = []
+    regions: List[Optional[int]] = []
+    errors: List[Optional[int]] = []
+    normalization: Optional[List[Any]] = None
+
+    for position, (phone, result) in enumerate(zip(phone_numbers, results)):
+        numbers.append(result.get("phone_number", phone))
+        if result["success"]:
+            key = tuple(result[field] for field in RESULT_REGION_FIELDS)
+            regions.append(region_index.setdefault(key, len(region_index)))
+            prefixes.append(result["prefix"])
+            errors.append(None)
+        else:
+            message = result["error"]
+            errors.append(error_index.setdefault(message, len(error_index)))
+            prefixes.append(None)
+            regions.append(None)
+        if "normalization" in result:
+            if normalization is None:
+                normalization = [None] * position
+            normalization.append(result["normalization"])
+        elif normalization is not None:
+            normalization.append(None)
+
+    columnar = {
+        "success": True,
+        "layout": "columnar",
+        "total": len(results),
+        "region_fields": RESULT_REGION_FIELDS,
+        "regions": [list(key) for key in region_index],
+        "errors": list(error_index),
+        "phone_number": numbers,
+        "prefix": prefixes,
+        "region": regions,
+        "error": errors,
+    }
+    if normalization is not None:
+        columnar["normalization"] = normalization
+    return columnar
+
+
+# 分页查询每页的默认与最大条目数
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page(cursor: Any, limit: Any) -> Tuple[int, int, Optional[str]]:
+    """校验分页参数，返回 (起始前缀, 每页条目数, 错误信息)，出错时前两项为 0"""
+    if cursor is None:
+        cursor = 0
+    elif isinstance(cursor, str) and cursor.isascii() and cursor.isdigit():
+        cursor = int(cursor)
+    else:
+        return 0, 0, f"Invalid cursor: {cursor}"
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 0 < limit:
+        return 0, 0, f"Invalid limit: {limit}"
+    return cursor, min(limit, MAX_PAGE_SIZE), None
+
+
+def find_prefixes(
+    carrier: Optional[str] = None,
+    province: Optional[str] = None,
+    city: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """按运营商、省份、城市查询前缀区间，分页返回
+
+    carrier 可以是英文或中文运营商名称。区间按起始前缀排序，
+    first/last 为区间内的首尾前缀（含），next_cursor 为下一页的起始前缀。
+    """
+    filters = {"carrier": carrier, "province": province, "city": city}
+    if all(value is None for value in filters.values()):
+        return {
+            "success": False,
+            "error": "At least one of carrier, province or city is required",
+        }
+    start, limit, error = parse_page(cursor, limit)
+    if error:
+        return {"success": False, "error": error}
+
+    index = get_prefix_index()
+    codes = index.match_regions(**filters)
+    total_ranges, total_prefixes = index.range_totals(codes)
+    page = list(itertools.islice(index.iter_ranges(codes, start), limit + 1))
+
+    ranges = []
+    for first, end, code in page[:limit]:
+        info = index.regions[code]
+        entry = {"first": str(first), "last": str(end - 1), "count": end - first}
+        entry.update((field, info[field]) for field in RESULT_REGION_FIELDS)
+        ranges.append(entry)
+    return {
+        "success": True,
+        "query": {
+            field: value for field, value in filters.items() if value is not None
+        },
+        "total_ranges": total_ranges,
+        "total_prefixes": total_prefixes,
+        "ranges": ranges,
+        "next_cursor": str(page[limit][0]) if len(page) > limit else None,
+    }
+
+
+def prefix_bounds(
+    segment: Any = None, start: Any = None, end: Any = None
+) -> Tuple[int, int, Optional[str]]:
+    """把号段或起止前缀转换为闭区间 [low, high]，返回 (low, high, 错误信息)，出错时前两项为 0
+
+    号段为1-7位数字（如 192 表示 1920000-1929999）；未给出 end 时只查询 start 本身。
+    """
+
+    def digits(value: Any, lengths: range) -> bool:
+        return (
+            isinstance(value, str)
+            and len(value) in lengths
+            and value.isascii()
+            and value.isdigit()
+        )
+
+    if segment is not None:
+        if not digits(segment, range(1, 8)):
+            return 0, 0, f"Invalid segment: {segment}"
+        scale = 10 ** (7 - len(segment))
+        return int(segment) * scale, int(segment) * scale + scale - 1, None
+
+    if start is None:
+        return 0, 0, "Either segment or start is required"
+    if end is None:
+        end = start
+    for value in (start, end):
+        if not digits(value, range(7, 8)):
+            return 0, 0, f"Invalid prefix: {value}. Must be 7 digits"
+    if int(start) > int(end):
+        return 0, 0, f"Invalid range: {start} > {end}"
+    return int(start), int(end), None
+
+
+def list_prefixes(
+    segment: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Dict[str, Any]:
+    """列出号段或前缀范围内已分配的前缀及其归属地，分页返回
+
+    在有序前缀数组上二分定位后切片，每页耗时与页大小有关，与范围大小无关。
+    """
+    low, high, error = prefix_bounds(segment, start, end)
+    if error:
+        return {"success": False, "error": error}
+    position, limit, error = parse_page(cursor, limit)
+    if error:
+        return {"success": False, "error": error}
+
+    index = get_prefix_index()
+    first, last = index.span(low, high)
+    begin = index.span(max(low, position), high)[0]
+    stop = min(last, begin + limit)
+
+    prefixes = []
+    for prefix, code in zip(index.prefixes[begin:stop], index.codes[begin:stop]):
+        info = index.regions[code]
+        entry = {"prefix": str(prefix)}
+        entry.update((field, info[field]) for field in RESULT_REGION_FIELDS)
+        prefixes.append(entry)
+    return {
+        "success": True,
+        "first": f"{low:07d}",
+        "last": f"{high:07d}",
+        "total": last - first,
+        "prefixes": prefixes,
+        "next_cursor": str(index.prefixes[stop]) if stop < last else None,
+    }
+
+
+def lookup_phone_numbers(
+    phone_numbers: list,
+    database: Mapping,
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, Any]]:
+    """批量检测手机号，结果与逐个调用 detect_carrier 完全一致
+
+    先在一次向量化运算中完成格式校验与前缀转换，未通过的号码规范化后再转换；
+    然后按前缀分组，每个不同前缀只查询一次，再按输入顺序生成结果。
+    完全相同的号码只生成一次结果，重复位置以及同一不存在前缀的号码共享同一个结果对象。
+    传入 stats 时写入 unique_prefixes、duplicates 与 invalid 计数。
+    """
+    texts = [phone if isinstance(phone, str) else "" for phone in phone_numbers]
+    prefixes = prefixes_of(texts)
+
+    # 快速校验未通过的号码先规范化，规范化后有效的号码与其余号码一起分组；
+    # texts 中对应位置替换为规范化后的号码
+    normalizations: Dict[str, List[str]] = {}
+    for position in rejected_positions(prefixes):
+        phone = texts[position]
+        if phone:
+            number, applied = normalize_phone_number(phone)
+            prefix = prefix_of(number)
+            if prefix >= 0:
+                prefixes[position] = prefix
+                texts[position] = number
+                normalizations[phone] = applied
+
+    unique, groups = group_prefixes(prefixes)
+    codes, regions = lookup_prefixes(database, unique)
+
     results = []
-    for phone in phone_numbers:
-        if not isinstance(phone, str):
-            results.append(
-                {"success": False, "error": f"Invalid phone number type: {type(phone)}"}
-            )
+    seen: Dict[str, Dict[str, Any]] = {}
+    # 数据库中不存在的前缀的错误结果，同一前缀的号码共享
+    missing: Dict[int, Dict[str, Any]] = {}
+    duplicates = invalid = 0
+    for phone, number, group in zip(phone_numbers, texts, groups):
+        if group >= 0:
+            result = seen.get(phone)
+            if result is not None:
+                duplicates += 1
+                results.append(result)
+                continue
+            code = codes[group]
+            if number is not phone:
+                if code >= 0:
+                    result = build_result(regions[code], number)
+                else:
+                    result = {
+                        "success": False,
+                        "error": f"Phone number prefix {number[:7]} "
+                        "not found in database",
+                    }
+                result["input"] = phone
+                result["normalization"] = normalizations[phone]
+            elif code >= 0:
+                result = build_result(regions[code], phone)
+            else:
+                result = missing.get(group)
+                if result is None:
+                    result = missing[group] = {
+                        "success": False,
+                        "error": f"Phone number prefix {phone[:7]} "
+                        "not found in database",
+                    }
+            seen[phone] = result
         else:
-            results.append(detect_carrier(phone))
+            invalid += 1
+            if not isinstance(phone, str):
+                result = {
+                    "success": False,
+                    "error": f"Invalid phone number type: {type(phone)}",
+                }
+            elif phone in seen:
+                duplicates += 1
+                result = seen[phone]
+            else:
+                # 规范化后仍无效，由 detect_carrier 生成相同的错误信息
+                result = seen[phone] = detect_carrier(phone, database)
+        results.append(result)
+
+    if stats is not None:
+        stats["unique_prefixes"] = len(unique)
+        stats["duplicates"] = duplicates
+        stats["invalid"] = invalid
+    return results
+
+
+# 流式批量检测每次查询的号码数，内存占用与该值成正比
+BULK_CHUNK_SIZE = 10000
+BULK_OUTPUT_FORMATS = ("jsonl", "csv")
+# input_file/output_file 只能位于该目录下；未设置时不允许读写文件
+BULK_FILE_DIR = os.environ.get("PHONE_BULK_DIR")
+BULK_CSV_FIELDS = [
+    "phone_number",
+    "success",
+    "carrier",
+    "carrier_cn",
+    "province",
+    "city",
+    "prefix",
+    "error",
+]
+
+
+def iter_phone_numbers(
+    phone_numbers: Optional[list] = None, input_file: Optional[str] = None
+) -> Iterator[Any]:
+    """依次产出号码：参数中的号码（可按块嵌套）以及输入文件中每行一个号码"""
+    for item in phone_numbers or ():
+        if isinstance(item, list):
+            yield from item
+        else:
+            yield item
+
+    if input_file:
+        with open(input_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def resolve_bulk_path(path: Any) -> Tuple[str, Optional[str]]:
+    """把 input_file/output_file 解析为 PHONE_BULK_DIR 下的真实路径，返回 (路径, 错误信息)
+
+    相对路径相对于 PHONE_BULK_DIR；解析符号链接与 .. 后位于目录之外的路径被拒绝。
+    """
+    if not BULK_FILE_DIR:
+        return "", "File input/output is disabled: PHONE_BULK_DIR is not set"
+    if not isinstance(path, str) or not path:
+        return "", f"Invalid file path: {path}"
+    root = os.path.realpath(BULK_FILE_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if resolved == root or os.path.commonpath([root, resolved]) != root:
+        return "", f"File path must be inside PHONE_BULK_DIR: {path}"
+    return resolved, None
+
+
+def iter_chunks(items: Iterable[Any], size: int) -> Iterator[list]:
+    """把可迭代对象切分为固定大小的块"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_detect_carriers(
+    phone_numbers: Any = None,
+    input_file: Optional[str] = None,
+    output_file: Optional[str] = None,
+    output_format: str = "jsonl",
+    chunk_size: int = BULK_CHUNK_SIZE,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> Dict[str, Any]:
+    """流式批量检测，不限制号码数量
+
+    号码按块读取与查询，同一时刻只有一个块在内存中；
+    指定 output_file 时结果逐行写入 JSONL/CSV 文件，响应中只返回汇总。
+    从 input_file 读取时必须指定 output_file，格式无效的行不回显原文。
+    """
+    if output_format not in BULK_OUTPUT_FORMATS:
+        return {
+            "success": False,
+            "error": f"Unsupported output format: {output_format}",
+        }
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        return {"success": False, "error": "chunk_size must be a positive integer"}
+    if phone_numbers is not None and not isinstance(phone_numbers, list):
+        return {"success": False, "error": "Input must be a list of phone numbers"}
+    if input_file and not output_file:
+        return {"success": False, "error": "output_file is required with input_file"}
+
+    input_path = output_path = ""
+    if input_file:
+        input_path, error = resolve_bulk_path(input_file)
+        if error:
+            return {"success": False, "error": error}
+    if output_file:
+        output_path, error = resolve_bulk_path(output_file)
+        if error:
+            return {"success": False, "error": error}
+
+    # 参数中的号码数；其后来自输入文件的号码失败时不回显
+    given = 0
+    if phone_numbers is not None:
+        given = sum(
+            len(item) if isinstance(item, list) else 1 for item in phone_numbers
+        )
+    total = None if input_path else given
+
+    database = get_phone_database()
+    summary: Dict[str, Any] = {
+        "success": True,
+        "total": 0,
+        "succeeded": 0,
+        "failed": 0,
+    }
+    inline_results: List[Dict[str, Any]] = []
+
+    output = None
+    try:
+        if output_path:
+            output = open(output_path, "w", encoding="utf-8", newline="")
+    except OSError as e:
+        return {"success": False, "error": f"Cannot write output file: {e}"}
+
+    try:
+        writer = None
+        if output is not None and output_format == "csv":
+            writer = csv.DictWriter(output, BULK_CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+
+        chunks = iter_chunks(iter_phone_numbers(phone_numbers, input_path), chunk_size)
+        for chunk in chunks:
+            results = lookup_phone_numbers(chunk, database)
+            for position, (phone, result) in enumerate(
+                zip(chunk, results), summary["total"]
+            ):
+                if "phone_number" not in result and position < given:
+                    result = {"phone_number": phone, **result}
+                if result["success"]:
+                    summary["succeeded"] += 1
+                else:
+                    summary["failed"] += 1
+
+                if output is None:
+                    inline_results.append(result)
+                elif writer is not None:
+                    writer.writerow(result)
+                else:
+                    output.write(JSONL_RENDERER.render(result) + "\n")
+
+            summary["total"] += len(chunk)
+            if progress is not None:
+                progress(summary["total"], total)
+    except OSError as e:
+        return {"success": False, "error": f"File error: {e}"}
+    finally:
+        if output is not None:
+            output.close()
+
+    if output is None:
+        summary["results"] = inline_results
+    else:
+        summary["output_file"] = output_file
+        summary["output_format"] = output_format
+    return summary
+
+
+# 汇总统计中的无效原因
+INVALID_REASONS = ("invalid_type", "invalid_format", "prefix_not_found")
+
+
+def ranked(counts: Dict[Tuple[str, ...], int], fields: Sequence[str]) -> List[dict]:
+    """把 {字段取值: 次数} 转换为按次数降序、取值升序排列的列表"""
+    return [
+        {**dict(zip(fields, key)), "count": count}
+        for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    ]
+
+
+def aggregate_carriers(
+    phone_numbers: Any = None,
+    input_file: Optional[str] = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    progress: Optional[Callable[[int, Optional[int]], None]] = None,
+) -> Dict[str, Any]:
+    """一次遍历统计号码的运营商、省份、城市分布与无效原因，不返回逐个号码的结果
+
+    号码按块读取，每块一次向量化转换前缀并集中查询归属地编码，
+    用以归属地编码为下标的计数数组累加，不生成逐个号码的结果字典；
+    最后按归属地把计数汇总到运营商、省份与城市。
+    """
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        return {"success": False, "error": "chunk_size must be a positive integer"}
+    if phone_numbers is not None and not isinstance(phone_numbers, list):
+        return {"success": False, "error": "Input must be a list of phone numbers"}
+
+    input_path = ""
+    if input_file:
+        input_path, error = resolve_bulk_path(input_file)
+        if error:
+            return {"success": False, "error": error}
+
+    total = None
+    if phone_numbers is not None and not input_path:
+        total = sum(
+            len(item) if isinstance(item, list) else 1 for item in phone_numbers
+        )
+
+    database = get_phone_database()
+    # 支持 gather 的后端各块共用同一张归属地表，计数直接累加到 shared_counts；
+    # 其余后端各块的归属地按记录对象统一编号，region_counts 以该编号为下标
+    shared_regions: Sequence[Mapping] = getattr(database, "regions", ())
+    shared_counts = None
+    regions: List[Mapping] = []
+    region_ids: Dict[int, int] = {}
+    region_counts = array("q")
+    invalid = dict.fromkeys(INVALID_REASONS, 0)
+    processed = normalized = unmatched = 0
+
+    def add(info: Mapping, count: int) -> None:
+        region_id = region_ids.get(id(info))
+        if region_id is None:
+            region_id = region_ids[id(info)] = len(regions)
+            regions.append(info)
+            region_counts.append(0)
+        region_counts[region_id] += count
+
+    try:
+        chunks = iter_chunks(iter_phone_numbers(phone_numbers, input_path), chunk_size)
+        for chunk in chunks:
+            texts = [phone if isinstance(phone, str) else "" for phone in chunk]
+            prefixes = prefixes_of(texts)
+            rejected = 0
+            for position in rejected_positions(prefixes):
+                phone = chunk[position]
+                if not isinstance(phone, str):
+                    invalid["invalid_type"] += 1
+                    rejected += 1
+                    continue
+                number, _ = normalize_phone_number(phone)
+                prefix = prefix_of(number)
+                if prefix >= 0:
+                    prefixes[position] = prefix
+                    normalized += 1
+                    continue
+                rejected += 1
+                if not PHONE_NUMBER_PATTERN.match(number):
+                    invalid["invalid_format"] += 1
+                    continue
+                # 非 ASCII 数字等罕见输入与 detect_carrier 一致，沿用字符串前缀查找
+                info = database.get(number[:7])
+                if info is None:
+                    invalid["prefix_not_found"] += 1
+                else:
+                    add(info, 1)
+
+            codes, chunk_regions = lookup_prefixes(database, prefixes)
+            unmatched -= rejected
+            if chunk_regions is shared_regions:
+                shared_counts = tally_codes(codes, len(shared_regions), shared_counts)
+            else:
+                counts = tally_codes(codes, len(chunk_regions))
+                unmatched += int(counts[0])
+                for code in itertools.compress(range(len(chunk_regions)), counts[1:]):
+                    add(chunk_regions[code], counts[code + 1])
+
+            processed += len(chunk)
+            if progress is not None:
+                progress(processed, total)
+    except OSError as e:
+        return {"success": False, "error": f"File error: {e}"}
+
+    if shared_counts is not None:
+        unmatched += int(shared_counts[0])
+        for code in itertools.compress(range(len(shared_regions)), shared_counts[1:]):
+            add(shared_regions[code], shared_counts[code + 1])
+    invalid["prefix_not_found"] += unmatched
+
+    carriers: Dict[Tuple[str, ...], int] = {}
+    provinces: Dict[Tuple[str, ...], int] = {}
+    cities: Dict[Tuple[str, ...], int] = {}
+    for info, count in zip(regions, region_counts):
+        for counter, key in (
+            (carriers, (info["carrier"], info["carrier_cn"])),
+            (provinces, (info["province"],)),
+            (cities, (info["province"], info["city"])),
+        ):
+            counter[key] = counter.get(key, 0) + count
+
+    failed = sum(invalid.values())
+    return {
+        "success": True,
+        "total": processed,
+        "succeeded": processed - failed,
+        "failed": failed,
+        "normalized": normalized,
+        "carriers": ranked(carriers, ("carrier", "carrier_cn")),
+        "provinces": ranked(provinces, ("province",)),
+        "cities": ranked(cities, ("province", "city")),
+        "invalid": invalid,
+    }
+
+
+def database_statistics(top: Optional[int] = None) -> Dict[str, Any]:
+    """返回数据库按运营商、省份、城市的前缀分布，top 限制省份与城市的条数"""
+    if top is not None and (
+        not isinstance(top, int) or isinstance(top, bool) or top <= 0
+    ):
+        return {"success": False, "error": f"Invalid top: {top}"}
+
+    stats = get_database_stats()
+    return {
+        "success": True,
+        "records": stats.records,
+        "regions": len(stats.counts),
+        "carriers": ranked(
+            stats.totals(("carrier", "carrier_cn")), ("carrier", "carrier_cn")
+        ),
+        "provinces": ranked(stats.totals(("province",)), ("province",))[:top],
+        "cities": ranked(stats.totals(("province", "city")), ("province", "city"))[
+            :top
+        ],
+    }
 
-    return {"success": True, "results": results, "total": len(results)}
+
+# 检测成功结果的字段顺序，与 result_template 一致
+DETECTION_FIELDS = (
+    "success",
+    "phone_number",
+    "carrier",
+    "carrier_cn",
+    "province",
+    "city",
+    "prefix",
+)
+# 归属地片段缓存的条目上限，超过后整体清空
+MAX_CACHED_FRAGMENTS = 65536
+
+
+class ResultRenderer:
+    """把工具结果渲染为 JSON 文本，输出与 json.dumps 逐字节一致
+
+    检测成功结果中 carrier/carrier_cn/province/city 四个字段按
+    (嵌套层级, 归属地) 缓存为已序列化的片段，渲染时只拼接号码与前缀；
+    对象及对象数组按层级递归渲染，其余值整体交给 json.dumps。
+    """
+
+    def __init__(
+        self,
+        indent: Optional[int] = None,
+        separators: Tuple[str, str] = (", ", ": "),
+    ):
+        self.indent = indent
+        self.item_separator, self.key_separator = separators
+        if indent is not None:
+            self.item_separator = self.item_separator.rstrip()
+        self._fragments: Dict[Tuple[Any, ...], Tuple[str, str, str]] = {}
+
+    def _layout(self, level: int) -> Tuple[str, str, str]:
+        """返回指定层级容器的起始、元素分隔与结束字符串"""
+        if self.indent is None:
+            return "", self.item_separator, ""
+        inner = "\n" + " " * (self.indent * (level + 1))
+        return inner, self.item_separator + inner, "\n" + " " * (self.indent * level)
+
+    def _detection_fragments(
+        self, result: Dict[str, Any], level: int
+    ) -> Tuple[str, str, str]:
+        """获取检测成功结果除号码与前缀外的已序列化片段（开头、中段、结尾）"""
+        key = (
+            level,
+            result["carrier"],
+            result["carrier_cn"],
+            result["province"],
+            result["city"],
+        )
+        fragments = self._fragments.get(key)
+        if fragments is None:
+            start, separator, end = self._layout(level)
+            middle = separator.join(
+                encode_basestring(field) + self.key_separator + self.render(value)
+                for field, value in zip(DETECTION_FIELDS[2:6], key[1:])
+            )
+            success = encode_basestring("success") + self.key_separator + "true"
+            phone_key = encode_basestring("phone_number") + self.key_separator
+            prefix_key = encode_basestring("prefix") + self.key_separator
+            fragments = (
+                "{" + start + success + separator + phone_key,
+                separator + middle + separator + prefix_key,
+                end + "}",
+            )
+            if len(self._fragments) >= MAX_CACHED_FRAGMENTS:
+                self._fragments.clear()
+            self._fragments[key] = fragments
+        return fragments
+
+    def render(self, value: Any, level: int = 0) -> str:
+        """渲染任意 JSON 值"""
+        if isinstance(value, str):
+            return encode_basestring(value)
+        if isinstance(value, dict):
+            if not value:
+                return "{}"
+            if (
+                len(value) == len(DETECTION_FIELDS)
+                and value.get("success") is True
+                and tuple(value) == DETECTION_FIELDS
+                and isinstance(value["phone_number"], str)
+                and isinstance(value["prefix"], str)
+            ):
+                head, middle, tail = self._detection_fragments(value, level)
+                return (
+                    head
+                    + encode_basestring(value["phone_number"])
+                    + middle
+                    + encode_basestring(value["prefix"])
+                    + tail
+                )
+            start, separator, end = self._layout(level)
+            key_separator = self.key_separator
+            items = separator.join(
+                encode_basestring(key) + key_separator + self.render(item, level + 1)
+                for key, item in value.items()
+            )
+            return "{" + start + items + end + "}"
+        if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+            start, separator, end = self._layout(level)
+            items = separator.join(self.render(item, level + 1) for item in value)
+            return "[" + start + items + end + "]"
+        # 标量及不含结果对象的数组（如列式布局的各列）整体交给 json.dumps
+        text = json.dumps(
+            value,
+            ensure_ascii=False,
+            indent=self.indent,
+            separators=(self.item_separator, self.key_separator),
+        )
+        if self.indent is not None and level:
+            text = text.replace("\n", "\n" + " " * (self.indent * level))
+        return text
+
+
+# 工具响应的输出格式：pretty 为带2空格缩进的原有格式，compact 不含缩进与多余空白
+RESPONSE_RENDERERS = {
+    "pretty": ResultRenderer(indent=2),
+    "compact": ResultRenderer(separators=(",", ":")),
+}
+RESPONSE_FORMAT = os.environ.get("PHONE_RESPONSE_FORMAT", "pretty")
+# 流式批量检测 JSONL 输出逐行使用的渲染器
+JSONL_RENDERER = ResultRenderer()
+
+# 各工具共用的 format 参数
+FORMAT_PROPERTY = {
+    "type": "string",
+    "enum": list(RESPONSE_RENDERERS),
+    "description": "Response text format (pretty: indented, compact: no whitespace)",
+}
+# 流式工具的 phone_numbers 参数：扁平列表或按块嵌套的列表
+CHUNKED_PHONE_NUMBERS_PROPERTY = {
+    "type": "array",
+    "items": {
+        "anyOf": [
+            {"type": "string"},
+            {"type": "array", "items": {"type": "string"}},
+        ]
+    },
+    "description": "Phone numbers, flat or in chunks",
+}
 
 
 class MCPServer:
     """MCP Server 实现"""
 
-    def __init__(self):
-        self.request_id = 1
+    def __init__(self, response_format: str = RESPONSE_FORMAT):
+        # 发送通知（如进度）的回调，由 main() 设置
+        self.notify: Optional[Callable[[Dict[str, Any]], None]] = None
+        # 工具调用未指定 format 参数时使用的输出格式
+        self.response_format = (
+            response_format if response_format in RESPONSE_RENDERERS else "pretty"
+        )
 
-    def get_capabilities(self) -> Dict[str, Any]:
+    def get_capabilities(self, request_id: Any = 1) -> Dict[str, Any]:
         """获取服务器能力"""
         return {
             "jsonrpc": "2.0",
-            "id": self.request_id,
+            "id": request_id,
             "result": {
                 "protocolVersion": "2024-11-05",
                 "capabilities": {"tools": {}},
@@ -97,11 +1202,11 @@ class MCPServer:
             },
         }
 
-    def list_tools(self) -> Dict[str, Any]:
+    def list_tools(self, request_id: Any = 1) -> Dict[str, Any]:
         """列出可用工具"""
         return {
             "jsonrpc": "2.0",
-            "id": self.request_id,
+            "id": request_id,
             "result": {
                 "tools": [
                     {
@@ -112,8 +1217,11 @@ class MCPServer:
                             "properties": {
                                 "phone_number": {
                                     "type": "string",
-                                    "description": "Phone number to detect (11 digits)",
-                                }
+                                    "description": "Phone number to detect "
+                                    "(11 digits; +86/0086 prefixes, separators "
+                                    "and full-width digits are normalized)",
+                                },
+                                "format": FORMAT_PROPERTY,
                             },
                             "required": ["phone_number"],
                         },
@@ -128,156 +1236,624 @@ class MCPServer:
                                     "type": "array",
                                     "items": {"type": "string"},
                                     "description": "List of phone numbers to detect (max 100)",
-                                }
+                                },
+                                "layout": {
+                                    "type": "string",
+                                    "enum": list(BATCH_LAYOUTS),
+                                    "description": "rows: one object per number; "
+                                    "columnar: parallel arrays indexing a "
+                                    "deduplicated region table",
+                                },
+                                "format": FORMAT_PROPERTY,
                             },
                             "required": ["phone_numbers"],
                         },
                     },
+                    {
+                        "name": "bulk_detect_carriers",
+                        "description": (
+                            "Stream carrier detection over an unlimited number of "
+                            "phone numbers from arguments or a local file, "
+                            "optionally writing results to a JSONL/CSV file"
+                        ),
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "phone_numbers": CHUNKED_PHONE_NUMBERS_PROPERTY,
+                                "input_file": {
+                                    "type": "string",
+                                    "description": "File under PHONE_BULK_DIR "
+                                    "with one number per line (requires "
+                                    "output_file)",
+                                },
+                                "output_file": {
+                                    "type": "string",
+                                    "description": "File under PHONE_BULK_DIR "
+                                    "to write results to instead of inline",
+                                },
+                                "output_format": {
+                                    "type": "string",
+                                    "enum": list(BULK_OUTPUT_FORMATS),
+                                    "description": "Output file format (default jsonl)",
+                                },
+                                "chunk_size": {
+                                    "type": "integer",
+                                    "description": "Numbers processed per chunk",
+                                },
+                                "format": FORMAT_PROPERTY,
+                            },
+                        },
+                    },
+                    {
+                        "name": "aggregate_carriers",
+                        "description": (
+                            "Count phone numbers by carrier, province, city and "
+                            "invalid reason in one pass, without per-number results"
+                        ),
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "phone_numbers": CHUNKED_PHONE_NUMBERS_PROPERTY,
+                                "input_file": {
+                                    "type": "string",
+                                    "description": "File under PHONE_BULK_DIR "
+                                    "with one number per line",
+                                },
+                                "chunk_size": {
+                                    "type": "integer",
+                                    "description": "Numbers processed per chunk",
+                                },
+                                "format": FORMAT_PROPERTY,
+                            },
+                        },
+                    },
+                    {
+                        "name": "find_prefixes",
+                        "description": (
+                            "Find prefix ranges allocated to a carrier, province "
+                            "and/or city, paginated by cursor"
+                        ),
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "carrier": {
+                                    "type": "string",
+                                    "description": "Carrier name in English "
+                                    "or Chinese (e.g. China Telecom, 电信)",
+                                },
+                                "province": {
+                                    "type": "string",
+                                    "description": "Province (e.g. 四川)",
+                                },
+                                "city": {
+                                    "type": "string",
+                                    "description": "City (e.g. 成都)",
+                                },
+                                "cursor": {
+                                    "type": "string",
+                                    "description": "next_cursor from the previous page",
+                                },
+                                "limit": {
+                                    "type": "integer",
+                                    "description": "Ranges per page "
+                                    f"(default {DEFAULT_PAGE_SIZE}, "
+                                    f"max {MAX_PAGE_SIZE})",
+                                },
+                                "format": FORMAT_PROPERTY,
+                            },
+                        },
+                    },
+                    {
+                        "name": "list_prefixes",
+                        "description": (
+                            "List allocated prefixes with their regions in a "
+                            "segment (e.g. 192) or prefix range, paginated by cursor"
+                        ),
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "segment": {
+                                    "type": "string",
+                                    "description": "Leading digits of the prefixes "
+                                    "(e.g. 192 or 1380)",
+                                },
+                                "start": {
+                                    "type": "string",
+                                    "description": "First 7-digit prefix (inclusive)",
+                                },
+                                "end": {
+                                    "type": "string",
+                                    "description": "Last 7-digit prefix (inclusive)",
+                                },
+                                "cursor": {
+                                    "type": "string",
+                                    "description": "next_cursor from the previous page",
+                                },
+                                "limit": {
+                                    "type": "integer",
+                                    "description": "Prefixes per page "
+                                    f"(default {DEFAULT_PAGE_SIZE}, "
+                                    f"max {MAX_PAGE_SIZE})",
+                                },
+                                "format": FORMAT_PROPERTY,
+                            },
+                        },
+                    },
+                    {
+                        "name": "database_stats",
+                        "description": (
+                            "Prefix counts of the loaded database by carrier, "
+                            "province and city, precomputed at build time"
+                        ),
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "top": {
+                                    "type": "integer",
+                                    "description": "Only return the largest N "
+                                    "provinces and cities",
+                                },
+                                "format": FORMAT_PROPERTY,
+                            },
+                        },
+                    },
                 ]
             },
         }
 
-    def call_tool(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
-        """调用工具"""
+    def send_progress(
+        self, progress_token: Any, progress: int, total: Optional[int] = None
+    ) -> None:
+        """发送 MCP 进度通知"""
+        if progress_token is None or self.notify is None:
+            return
+        params = {"progressToken": progress_token, "progress": progress}
+        if total is not None:
+            params["total"] = total
+        self.notify(
+            {"jsonrpc": "2.0", "method": "notifications/progress", "params": params}
+        )
+
+    def text_response(
+        self, result: Dict[str, Any], arguments: Dict[str, Any], request_id: Any = 1
+    ) -> Dict[str, Any]:
+        """把工具结果按 format 参数渲染为文本内容响应"""
+        output_format = arguments.get("format", self.response_format)
+        renderer = RESPONSE_RENDERERS.get(output_format)
+        if renderer is None:
+            return {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "error": {
+                    "code": -32602,
+                    "message": f"Invalid format: {output_format}. "
+                    f"Must be one of {', '.join(RESPONSE_RENDERERS)}",
+                },
+            }
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": {"content": [{"type": "text", "text": renderer.render(result)}]},
+        }
+
+    def call_tool(
+        self,
+        name: str,
+        arguments: Dict[str, Any],
+        progress_token: Any = None,
+        request_id: Any = 1,
+    ) -> Dict[str, Any]:
+        """调用工具，request_id 为响应中的 JSON-RPC id"""
         try:
             if name == "detect_carrier":
                 phone_number = arguments.get("phone_number")
                 if not phone_number:
                     return {
                         "jsonrpc": "2.0",
-                        "id": self.request_id,
+                        "id": request_id,
                         "error": {
                             "code": -32602,
                             "message": "Missing required parameter: phone_number",
                         },
                     }
-                result = detect_carrier(phone_number)
-                return {
-                    "jsonrpc": "2.0",
-                    "id": self.request_id,
-                    "result": {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": json.dumps(
-                                    result, ensure_ascii=False, indent=2
-                                ),
-                            }
-                        ]
-                    },
-                }
+                return self.text_response(
+                    detect_carrier(phone_number), arguments, request_id
+                )
 
             elif name == "batch_detect_carriers":
                 phone_numbers = arguments.get("phone_numbers")
                 if not phone_numbers:
                     return {
                         "jsonrpc": "2.0",
-                        "id": self.request_id,
+                        "id": request_id,
                         "error": {
                             "code": -32602,
                             "message": "Missing required parameter: phone_numbers",
                         },
                     }
-                result = batch_detect_carriers(phone_numbers)
-                return {
-                    "jsonrpc": "2.0",
-                    "id": self.request_id,
-                    "result": {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": json.dumps(
-                                    result, ensure_ascii=False, indent=2
-                                ),
-                            }
-                        ]
-                    },
-                }
+                result = batch_detect_carriers(
+                    phone_numbers, arguments.get("layout", "rows")
+                )
+                return self.text_response(result, arguments, request_id)
+
+            elif name == "bulk_detect_carriers":
+                phone_numbers = arguments.get("phone_numbers")
+                input_file = arguments.get("input_file")
+                if not phone_numbers and not input_file:
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {
+                            "code": -32602,
+                            "message": "Missing required parameter: "
+                            "phone_numbers or input_file",
+                        },
+                    }
+                result = bulk_detect_carriers(
+                    phone_numbers,
+                    input_file,
+                    arguments.get("output_file"),
+                    arguments.get("output_format", "jsonl"),
+                    arguments.get("chunk_size", BULK_CHUNK_SIZE),
+                    progress=lambda done, total: self.send_progress(
+                        progress_token, done, total
+                    ),
+                )
+                return self.text_response(result, arguments, request_id)
+
+            elif name == "aggregate_carriers":
+                phone_numbers = arguments.get("phone_numbers")
+                input_file = arguments.get("input_file")
+                if not phone_numbers and not input_file:
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request_id,
+                        "error": {
+                            "code": -32602,
+                            "message": "Missing required parameter: "
+                            "phone_numbers or input_file",
+                        },
+                    }
+                result = aggregate_carriers(
+                    phone_numbers,
+                    input_file,
+                    arguments.get("chunk_size", BULK_CHUNK_SIZE),
+                    progress=lambda done, total: self.send_progress(
+                        progress_token, done, total
+                    ),
+                )
+                return self.text_response(result, arguments, request_id)
+
+            elif name == "find_prefixes":
+                result = find_prefixes(
+                    arguments.get("carrier"),
+                    arguments.get("province"),
+                    arguments.get("city"),
+                    arguments.get("cursor"),
+                    arguments.get("limit"),
+                )
+                return self.text_response(result, arguments, request_id)
+
+            elif name == "list_prefixes":
+                result = list_prefixes(
+                    arguments.get("segment"),
+                    arguments.get("start"),
+                    arguments.get("end"),
+                    arguments.get("cursor"),
+                    arguments.get("limit"),
+                )
+                return self.text_response(result, arguments, request_id)
+
+            elif name == "database_stats":
+                result = database_statistics(arguments.get("top"))
+                return self.text_response(result, arguments, request_id)
 
             else:
                 return {
                     "jsonrpc": "2.0",
-                    "id": self.request_id,
+                    "id": request_id,
                     "error": {"code": -32601, "message": f"Method not found: {name}"},
                 }
 
         except Exception as e:
             return {
                 "jsonrpc": "2.0",
-                "id": self.request_id,
+                "id": request_id,
                 "error": {"code": -32603, "message": f"Internal error: {str(e)}"},
             }
 
+    def get_database_status(self, request_id: Any = 1) -> Dict[str, Any]:
+        """获取数据库加载状态"""
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "result": dict(DATABASE_STATUS),
+        }
+
     async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
-        """处理请求"""
-        self.request_id = request.get("id", 1)
+        """处理请求
+
+        请求 id 作为参数沿调用链传递，服务器不保存单个请求的状态，可同时处理多个请求。
+        """
+        request_id = request.get("id", 1)
         method = request.get("method")
         params = request.get("params", {})
 
+        # 握手类请求不依赖数据库，立即响应
         if method == "initialize":
-            return self.get_capabilities()
+            return self.get_capabilities(request_id)
         elif method == "tools/list":
-            return self.list_tools()
+            return self.list_tools(request_id)
+        elif method == "database/status":
+            return self.get_database_status(request_id)
         elif method == "tools/call":
             name = params.get("name")
             arguments = params.get("arguments", {})
-            return self.call_tool(name, arguments)
+            progress_token = params.get("_meta", {}).get("progressToken")
+            # 工具调用（以及必要时等待后台加载完成）在线程池中执行，不阻塞事件循环
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.call_tool, name, arguments, progress_token, request_id
+            )
         else:
             return {
                 "jsonrpc": "2.0",
-                "id": self.request_id,
+                "id": request_id,
                 "error": {"code": -32601, "message": f"Method not found: {method}"},
             }
 
 
-async def main():
-    """主函数"""
-    server = MCPServer()
+# 单个 JSON-RPC 消息或批量响应数组
+JSONRPCMessage = Union[Dict[str, Any], List[Dict[str, Any]]]
 
-    # 使用标准输入输出
-    reader = asyncio.StreamReader()
-    protocol = asyncio.StreamReaderProtocol(reader)
-    await asyncio.get_event_loop().connect_read_pipe(lambda: protocol, sys.stdin)
 
+def encode_message(message: JSONRPCMessage) -> bytes:
+    """把 JSON-RPC 消息编码为一行 UTF-8 字节
+
+    工具结果文本已由 ResultRenderer 渲染，这里只对外层信封做一次不转义非 ASCII 字符的
+    紧凑编码，结果文本中的中文不会膨胀为 \\uXXXX 转义。
+    请求中的单独代理字符（如 "\\ud800"）会被回显而无法编码为 UTF-8，
+    此时退回转义全部非 ASCII 字符的编码。
+    """
     try:
-        while True:
-            # 读取一行
-            line = await reader.readline()
-            if not line:
-                break
+        return (
+            json.dumps(message, ensure_ascii=False, separators=(",", ":")) + "\n"
+        ).encode()
+    except UnicodeEncodeError:
+        return (json.dumps(message, separators=(",", ":")) + "\n").encode()
 
-            try:
-                # 解析 JSON
-                request = json.loads(line.decode().strip())
 
-                # 处理请求
-                response = await server.handle_request(request)
+class MessageWriter:
+    """合并写出 JSON-RPC 消息的异步写入器
 
-                # 发送响应
-                response_line = json.dumps(response) + "\n"
-                sys.stdout.buffer.write(response_line.encode())
-                sys.stdout.buffer.flush()
+    同一轮事件循环中就绪的消息先追加到缓冲区，在下一轮合并为一次写入管道传输；
+    write 在传输缓冲超过高水位时通过 drain 等待客户端读取，客户端读取缓慢时
+    只挂起对应的响应任务，不阻塞事件循环。未给出 StreamWriter 时（如标准输出
+    重定向到普通文件）退化为同步写入标准输出。
+    """
 
-            except json.JSONDecodeError as e:
-                error_response = {
-                    "jsonrpc": "2.0",
-                    "id": None,
-                    "error": {"code": -32700, "message": f"Parse error: {str(e)}"},
-                }
-                error_line = json.dumps(error_response) + "\n"
-                sys.stdout.buffer.write(error_line.encode())
-                sys.stdout.buffer.flush()
+    def __init__(self, writer: Optional[asyncio.StreamWriter] = None):
+        self._writer = writer
+        self._buffer: List[bytes] = []
+        self._flush_scheduled = False
+
+    def send(self, message: JSONRPCMessage) -> None:
+        """把消息加入缓冲区，只能在事件循环线程中调用"""
+        self._buffer.append(encode_message(message))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        """把缓冲区中的消息一次写出"""
+        self._flush_scheduled = False
+        if not self._buffer:
+            return
+        data = b"".join(self._buffer)
+        self._buffer.clear()
+        if self._writer is None:
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            self._writer.write(data)
+
+    async def write(self, message: JSONRPCMessage) -> None:
+        """写出消息，传输缓冲过多时等待客户端读取"""
+        self.send(message)
+        if self._writer is not None:
+            await self._writer.drain()
+
+    async def close(self) -> None:
+        """写出剩余消息并等待传输缓冲清空"""
+        self.flush()
+        if self._writer is not None:
+            await self._writer.drain()
+            self._writer.close()
+
+
+# 同时处理的请求数上限，达到上限后暂停读取新请求
+MAX_CONCURRENT_REQUESTS = max(1, int(os.environ.get("PHONE_MAX_CONCURRENCY", "8")))
+# 单行请求的最大字节数，超过上限的请求被丢弃并返回错误
+MAX_MESSAGE_BYTES = max(
+    1024, int(os.environ.get("PHONE_MAX_MESSAGE_BYTES", str(16 * 1024 * 1024)))
+)
 
+
+def invalid_request(message: str) -> Dict[str, Any]:
+    """无法识别的请求对象对应的错误响应"""
+    return {
+        "jsonrpc": "2.0",
+        "id": None,
+        "error": {"code": -32600, "message": f"Invalid Request: {message}"},
+    }
+
+
+def internal_error(request_id: Any, error: Exception) -> Dict[str, Any]:
+    """处理请求时出现未预期异常对应的错误响应"""
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": -32603, "message": f"Internal error: {str(error)}"},
+    }
+
+
+def write_error(response: JSONRPCMessage, error: Exception) -> JSONRPCMessage:
+    """响应写出失败时代替它的错误响应，批量响应中的每一项保留各自的 id"""
+    if isinstance(response, list):
+        return [internal_error(item.get("id"), error) for item in response]
+    return internal_error(response.get("id"), error)
+
+
+async def process_request(server: MCPServer, request: Any) -> Optional[Dict[str, Any]]:
+    """处理一个请求对象；通知（不含 id 的请求）照常执行，但不返回响应"""
+    if not isinstance(request, dict):
+        return invalid_request("expected an object")
+
+    try:
+        response = await server.handle_request(request)
+    except Exception as e:
+        response = internal_error(request.get("id"), e)
+    return response if "id" in request else None
+
+
+async def process_line(server: MCPServer, line: bytes) -> Optional[JSONRPCMessage]:
+    """解析并处理一行请求，返回响应；没有需要返回的响应时返回 None
+
+    一行可以是单个请求或 JSON-RPC 批量请求数组。批量中的请求并发处理，
+    响应按请求顺序组成一个数组一次写出，其中的通知没有对应的响应。
+    """
+    try:
+        message = json.loads(line.decode().strip())
+    except (ValueError, RecursionError) as e:
+        # 包括 JSON 语法错误、无效的 UTF-8 与嵌套过深的数组
+        return {
+            "jsonrpc": "2.0",
+            "id": None,
+            "error": {"code": -32700, "message": f"Parse error: {str(e)}"},
+        }
+
+    if not isinstance(message, list):
+        return await process_request(server, message)
+    if not message:
+        return invalid_request("empty batch")
+    responses = await asyncio.gather(
+        *(process_request(server, request) for request in message)
+    )
+    return [response for response in responses if response is not None] or None
+
+
+async def skip_line(reader: asyncio.StreamReader) -> None:
+    """丢弃超长请求的剩余部分，直到行尾或输入结束"""
+    while True:
+        try:
+            await reader.readuntil(b"\n")
+            return
+        except asyncio.LimitOverrunError as error:
+            await reader.readexactly(error.consumed)
+        except asyncio.IncompleteReadError:
+            return
+
+
+async def serve(
+    server: MCPServer,
+    reader: asyncio.StreamReader,
+    write: Callable[[JSONRPCMessage], Awaitable[None]],
+    limit: int = MAX_CONCURRENT_REQUESTS,
+) -> None:
+    """逐行读取请求并发处理，每个请求处理完成后立即写出响应
+
+    耗时的批量请求不会阻塞排在后面的小请求；同时处理的请求达到 limit 个时暂停读取，
+    写出响应时等待的背压同样占用名额。超过 MAX_MESSAGE_BYTES 的行被丢弃并返回错误，
+    之后继续读取。输入结束后等待已读取的请求全部处理完毕。
+    """
+    slots = asyncio.Semaphore(limit)
+    pending: Set[asyncio.Task] = set()
+
+    async def respond(line: bytes) -> None:
+        try:
+            try:
+                response = await process_line(server, line)
             except Exception as e:
-                error_response = {
-                    "jsonrpc": "2.0",
-                    "id": None,
-                    "error": {"code": -32603, "message": f"Internal error: {str(e)}"},
-                }
-                error_line = json.dumps(error_response) + "\n"
-                sys.stdout.buffer.write(error_line.encode())
-                sys.stdout.buffer.flush()
+                # 无法识别请求 id 时仍返回错误，请求不会静默丢失
+                response = internal_error(None, e)
+            if response is None:
+                return
+            try:
+                await write(response)
+            except Exception as e:
+                # 响应无法写出（如含有无法编码的值）时改为返回同一 id 的错误
+                await write(write_error(response, e))
+        except Exception as e:
+            print(f"错误: 写出响应失败: {e}", file=sys.stderr)
+        finally:
+            slots.release()
+
+    while True:
+        await slots.acquire()
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as error:
+            # 输入结束，最后一行可能没有换行符
+            line = error.partial
+        except asyncio.LimitOverrunError:
+            await skip_line(reader)
+            slots.release()
+            await write(invalid_request(f"message exceeds {MAX_MESSAGE_BYTES} bytes"))
+            continue
+        if not line:
+            slots.release()
+            break
+        task = asyncio.create_task(respond(line))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.gather(*pending)
+
+
+def loop_notifier(
+    loop: asyncio.AbstractEventLoop, send: Callable[[JSONRPCMessage], None]
+) -> Callable[[Dict[str, Any]], None]:
+    """进度通知由工作线程发出，转交事件循环线程写出，避免与响应交错"""
+
+    def notify(message: Dict[str, Any]) -> None:
+        loop.call_soon_threadsafe(send, message)
+
+    return notify
+
+
+async def connect_stdout() -> MessageWriter:
+    """把标准输出连接为异步管道传输，不支持时（如普通文件）同步写入"""
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, sys.stdout
+        )
+    except (OSError, ValueError):
+        return MessageWriter()
+    return MessageWriter(asyncio.StreamWriter(transport, protocol, None, loop))
 
+
+async def main():
+    """主函数"""
+    start_database_loading()
+    start_database_watcher()
+    loop = asyncio.get_running_loop()
+    # 工具调用在线程池中执行，线程数与并发上限一致
+    loop.set_default_executor(
+        ThreadPoolExecutor(MAX_CONCURRENT_REQUESTS, thread_name_prefix="phone-request")
+    )
+    # 使用标准输入输出
+    reader = asyncio.StreamReader(limit=MAX_MESSAGE_BYTES)
+    protocol = asyncio.StreamReaderProtocol(reader)
+    await loop.connect_read_pipe(lambda: protocol, sys.stdin)
+    writer = await connect_stdout()
+
+    server = MCPServer()
+    server.notify = loop_notifier(loop, writer.send)
+
+    try:
+        await serve(server, reader, writer.write)
+        await writer.close()
     except KeyboardInterrupt:
         # 优雅处理 Ctrl+C
         pass
@@ -285,8 +1861,8 @@ async def main():
         # 优雅处理取消操作
         pass
     except Exception as e:
-        # 其他异常，静默处理
-        pass
+        # 其他异常，输出到标准错误后退出，标准输出只用于协议消息
+        print(f"服务器异常退出: {e}", file=sys.stderr)
 
 
 if __name__ == "__main__":
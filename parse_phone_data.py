@@ -3,115 +3,567 @@
 解析手机号归属地数据文件
 """
 
+import argparse
+import hashlib
 import json
-from typing import Dict, List
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
 
+from phone_index import (
+    FORMAT_VERSION,
+    SHARD_MANIFEST,
+    DatabaseStats,
+    PhoneRecord,
+    RecordInterner,
+    build_region_tables,
+    encode_database,
+    merge_intervals,
+)
 
-def parse_phone_data(filename: str) -> Dict[str, Dict[str, str]]:
-    """解析手机号归属地数据文件"""
+# {前缀: 归属地}，归属地为解析生成的 PhoneRecord 或字段相同的字典
+PhoneDatabase = Mapping[str, Mapping[str, str]]
+
+# 运营商名称标准化
+CARRIER_MAP = {
+    "移动": "China Mobile",
+    "联通": "China Unicom",
+    "电信": "China Telecom",
+    "广电": "China Broadcasting",
+    "铁通": "China Tietong",
+}
+
+# 并行解析时每个任务处理的最大字节数，限制单个进程的内存占用
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def parse_line(line: str) -> Optional[Tuple[str, Tuple[str, str, str, str]]]:
+    """解析一行数据，返回 (前缀, (省份, 城市, 运营商, 运营商中文名))"""
+    line = line.strip()
+    if not line:
+        return None
+
+    # 解析格式：手机号前缀,省份,城市,运营商
+    parts = line.split(",")
+    if len(parts) < 4:
+        return None
+    prefix, province, city, carrier = parts[:4]
+    return prefix, (province, city, CARRIER_MAP.get(carrier, carrier), carrier)
+
+
+def parse_phone_data(
+    filename: str, workers: int = 1, stats: Optional[Dict[str, int]] = None
+) -> Dict[str, PhoneRecord]:
+    """解析手机号归属地数据文件
+
+    城市、运营商等字符串会被驻留，归属地相同的前缀共享同一条 PhoneRecord。
+    workers 大于1时按字节区间拆分文件并使用进程池并行解析。
+    """
+    if workers > 1:
+        return parse_phone_data_parallel(filename, workers, stats)
 
     phone_database = {}
+    interner = RecordInterner()
+    line_num = 0
 
     with open(filename, "r", encoding="utf-8") as f:
         for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-
             try:
-                # 解析格式：手机号前缀,省份,城市,运营商
-                parts = line.split(",")
-                if len(parts) >= 4:
-                    prefix = parts[0]
-                    province = parts[1]
-                    city = parts[2]
-                    carrier = parts[3]
-
-                    # 运营商名称标准化
-                    carrier_map = {
-                        "移动": "China Mobile",
-                        "联通": "China Unicom",
-                        "电信": "China Telecom",
-                        "广电": "China Broadcasting",
-                        "铁通": "China Tietong",
-                    }
-
-                    carrier_en = carrier_map.get(carrier, carrier)
-
-                    phone_database[prefix] = {
-                        "province": province,
-                        "city": city,
-                        "carrier": carrier_en,
-                        "carrier_cn": carrier,
-                    }
+                parsed = parse_line(line)
+                if parsed is not None:
+                    prefix, region = parsed
+                    phone_database[prefix] = interner.record(*region)
 
             except Exception as e:
-                print(f"解析第 {line_num} 行时出错: {line} - {e}")
+                print(f"解析第 {line_num} 行时出错: {line.strip()} - {e}")
                 continue
 
+    if stats is not None:
+        stats["lines"] = line_num
     return phone_database
 
 
-def save_database(phone_database: Dict[str, Dict[str, str]], output_file: str):
-    """保存数据库到JSON文件"""
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(phone_database, f, ensure_ascii=False, indent=2)
+def split_byte_ranges(filename: str, parts: int) -> List[Tuple[int, int]]:
+    """把文件拆分为按行对齐的字节区间"""
+    size = os.path.getsize(filename)
+    parts = max(parts, -(-size // CHUNK_BYTES), 1)
+    boundaries = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts, boundaries[-1]))
+            # 跳到下一行开头，保证每一行只属于一个区间
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+    boundaries.append(size)
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ]
+
+
+def _parse_range(
+    task: Tuple[str, int, int],
+) -> Tuple[List[Tuple[str, int]], List[Tuple[str, ...]], int]:
+    """在子进程中解析一个字节区间，返回 (前缀与归属地编号, 归属地表, 行数)"""
+    filename, start, end = task
+    with open(filename, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+
+    entries = []
+    regions: Dict[Tuple[str, ...], int] = {}
+    lines = text.splitlines()
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is not None:
+            prefix, region = parsed
+            code = regions.setdefault(region, len(regions))
+            entries.append((prefix, code))
+    return entries, list(regions), len(lines)
+
+
+def parse_phone_data_parallel(
+    filename: str, workers: int, stats: Optional[Dict[str, int]] = None
+) -> Dict[str, PhoneRecord]:
+    """使用进程池并行解析，并按区间顺序合并，结果与顺序解析一致"""
+    ranges = split_byte_ranges(filename, workers)
+    tasks = [(filename, start, end) for start, end in ranges]
+    phone_database: Dict[str, PhoneRecord] = {}
+    interner = RecordInterner()
+    lines = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map 按提交顺序返回结果，后出现的前缀覆盖先出现的，与顺序解析相同
+        for entries, regions, line_count in executor.map(_parse_range, tasks):
+            records = [interner.record(*region) for region in regions]
+            phone_database.update((prefix, records[code]) for prefix, code in entries)
+            lines += line_count
+
+    if stats is not None:
+        stats["lines"] = lines
+    return phone_database
+
+
+def save_database(phone_database: PhoneDatabase, output_file: str) -> None:
+    """流式保存数据库到JSON文件（每个前缀一行）
+
+    与 write_file_atomic 一样先写临时文件再原子替换，构建期间启动或热加载的服务器
+    读到的总是完整的上一版文件。
+    """
+    # 共享记录只序列化一次
+    fragments: Dict[int, str] = {}
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write("{")
+        separator = "\n"
+        for prefix, info in phone_database.items():
+            fragment = fragments.get(id(info))
+            if fragment is None:
+                fragment = fragments[id(info)] = json.dumps(
+                    dict(info), ensure_ascii=False
+                )
+            f.write(f"{separator}{json.dumps(prefix)}: {fragment}")
+            separator = ",\n"
+        f.write("\n}\n")
+    os.replace(tmp_file, output_file)
     print(f"数据库已保存到: {output_file}")
 
 
-def analyze_database(phone_database: Dict[str, Dict[str, str]]):
-    """分析数据库统计信息"""
-    print(f"总记录数: {len(phone_database)}")
+def peak_memory_mb() -> Optional[float]:
+    """当前进程及子进程的峰值常驻内存 (MB)，不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def write_file_atomic(output_file: str, data: bytes) -> None:
+    """先写临时文件再原子替换
+
+    正在 mmap 旧文件的服务器进程继续读取旧版本，热加载时再切换到新文件。
+    """
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+    os.replace(tmp_file, output_file)
+
+
+def save_compiled_database(
+    phone_database: PhoneDatabase, output_file: str, intervals: bool = False
+) -> None:
+    """保存编译后的二进制数据库（供 mcp_server 通过 mmap 加载）"""
+    data = encode_database(phone_database, intervals=intervals)
+    write_file_atomic(output_file, data)
+    print(f"二进制数据库已保存到: {output_file} ({len(data)} 字节)")
+
+
+# 带内容哈希的分片文件名；清理旧分片时只删除此类文件，同一目录中的其他输出保持不变
+SHARD_FILE_PATTERN = re.compile(r"^\d{3}-[0-9a-f]{12}\.bin$")
+
+
+def save_sharded_database(
+    phone_database: PhoneDatabase,
+    output_dir: str,
+    changed_segments: Optional[Set[str]] = None,
+    stats: Optional[DatabaseStats] = None,
+) -> None:
+    """按3位号段保存二进制分片与 manifest.json
+
+    分片文件名带内容哈希（如 138-1a2b3c4d5e6f.bin），重写的号段写入新文件而不是覆盖，
+    仍在使用上一版 manifest 的服务器按需加载分片时读到的总是同一版本的数据；
+    上一版 manifest 引用的文件保留到下一次构建，更早的文件在写入 manifest 后删除。
+    changed_segments 不为 None 时只重写其中的号段，其余号段沿用上一版 manifest 中的文件；
+    给出 stats 时把全库前缀分布写入 manifest，服务器无需加载全部分片即可读取。
+    """
+    segments: Dict[str, Dict[str, Mapping[str, str]]] = {}
+    for prefix, info in phone_database.items():
+        segments.setdefault(prefix[:3], {})[prefix] = info
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = os.path.join(output_dir, SHARD_MANIFEST)
+    previous = load_build_meta(manifest_file) or {}
+    previous_segments = previous.get("segments", {})
+
+    manifest: Dict[str, Any] = {"format_version": FORMAT_VERSION, "segments": {}}
+    written = 0
+    for segment in sorted(segments):
+        entry = previous_segments.get(segment)
+        if (
+            changed_segments is None
+            or segment in changed_segments
+            or entry is None
+            or not os.path.exists(os.path.join(output_dir, entry["file"]))
+        ):
+            data = encode_database(segments[segment])
+            filename = f"{segment}-{hashlib.sha256(data).hexdigest()[:12]}.bin"
+            path = os.path.join(output_dir, filename)
+            if not os.path.exists(path):
+                write_file_atomic(path, data)
+            written += 1
+        else:
+            filename = entry["file"]
+        manifest["segments"][segment] = {
+            "file": filename,
+            "records": len(segments[segment]),
+        }
 
-    # 统计运营商分布
-    carriers = {}
-    provinces = {}
-    cities = {}
+    if stats is not None:
+        manifest["region_counts"] = stats.to_json()
 
-    for info in phone_database.values():
-        carrier = info["carrier"]
-        province = info["province"]
-        city = info["city"]
+    # manifest 最后写入，热加载时看到的总是完整的一组分片
+    write_file_atomic(
+        manifest_file,
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"),
+    )
 
-        carriers[carrier] = carriers.get(carrier, 0) + 1
-        provinces[province] = provinces.get(province, 0) + 1
-        cities[city] = cities.get(city, 0) + 1
+    # 删除新旧两版 manifest 都不再引用的分片
+    keep = {entry["file"] for entry in manifest["segments"].values()}
+    keep.update(entry["file"] for entry in previous_segments.values())
+    for filename in os.listdir(output_dir):
+        if SHARD_FILE_PATTERN.match(filename) and filename not in keep:
+            os.remove(os.path.join(output_dir, filename))
+
+    print(
+        f"分片数据库已保存到: {output_dir} ({len(segments)} 个号段，重写 {written} 个)"
+    )
+
+
+def hash_file(filename: str) -> str:
+    """计算源数据文件的 sha256"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_meta_path(output_file: str) -> str:
+    """构建元数据文件路径，与 JSON 数据库放在一起"""
+    return os.path.splitext(output_file)[0] + ".meta.json"
+
+
+def load_build_meta(meta_file: str) -> Optional[Dict[str, Any]]:
+    """读取上一次构建的元数据，不存在或损坏时返回 None"""
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta: Dict[str, Any] = json.load(f)
+            return meta
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(
+    meta: Optional[Dict[str, Any]], source_hash: str, outputs: List[str]
+) -> bool:
+    """源数据哈希与格式版本一致且所有输出都已存在时无需重建"""
+    if not meta:
+        return False
+    return (
+        meta.get("format_version") == FORMAT_VERSION
+        and meta.get("source_sha256") == source_hash
+        and set(outputs) <= set(meta.get("outputs", []))
+        and all(os.path.exists(output) for output in outputs)
+    )
+
+
+def diff_databases(old: PhoneDatabase, new: PhoneDatabase) -> Dict[str, List[str]]:
+    """比较两个版本的数据库，返回新增、删除与修改的前缀"""
+    added = [prefix for prefix in new if prefix not in old]
+    removed = [prefix for prefix in old if prefix not in new]
+    modified = [
+        prefix
+        for prefix, info in new.items()
+        if prefix in old and dict(old[prefix]) != dict(info)
+    ]
+    return {"added": added, "removed": removed, "modified": modified}
+
+
+def print_delta_summary(
+    old: PhoneDatabase,
+    new: PhoneDatabase,
+    delta: Dict[str, List[str]],
+    limit: int = 10,
+) -> None:
+    """打印数据版本之间的变更摘要"""
+    print(
+        f"\n数据变更: 新增 {len(delta['added'])}，删除 {len(delta['removed'])}，"
+        f"修改 {len(delta['modified'])}"
+    )
+    for prefix in delta["added"][:limit]:
+        print(f"  + {prefix}: {dict(new[prefix])}")
+    for prefix in delta["removed"][:limit]:
+        print(f"  - {prefix}: {dict(old[prefix])}")
+    for prefix in delta["modified"][:limit]:
+        print(f"  ~ {prefix}: {dict(old[prefix])} -> {dict(new[prefix])}")
+
+
+def load_previous_database(output_file: str) -> Optional[Dict[str, PhoneRecord]]:
+    """读取上一次构建输出的 JSON 数据库"""
+    try:
+        with open(output_file, "r", encoding="utf-8") as f:
+            database: Dict[str, PhoneRecord] = json.load(
+                f, object_hook=RecordInterner().object_hook
+            )
+            return database
+    except (OSError, ValueError):
+        return None
+
+
+def interval_stats(phone_database: PhoneDatabase) -> Dict[str, float]:
+    """统计区间合并的压缩效果"""
+    prefixes, codes, regions, _ = build_region_tables(phone_database)
+    starts, _, _ = merge_intervals(prefixes, codes)
+    # 记录是 PhoneRecord，按字典序列化
+    json_size = len(
+        json.dumps(phone_database, ensure_ascii=False, indent=2, default=dict).encode(
+            "utf-8"
+        )
+    )
+    prefix_size = len(encode_database(phone_database))
+    interval_size = len(encode_database(phone_database, intervals=True))
+
+    return {
+        "records": len(prefixes),
+        "regions": len(regions),
+        "intervals": len(starts),
+        "ratio": len(prefixes) / len(starts) if starts else 0.0,
+        "json_bytes": json_size,
+        "prefix_bytes": prefix_size,
+        "interval_bytes": interval_size,
+    }
+
+
+def report_interval_stats(phone_database: PhoneDatabase) -> None:
+    """打印区间合并的压缩报告"""
+    stats = interval_stats(phone_database)
+    print("\n区间压缩统计:")
+    print(f"  前缀记录数: {stats['records']}")
+    print(f"  归属地组合数: {stats['regions']}")
+    print(f"  合并后区间数: {stats['intervals']}")
+    print(f"  压缩比 (记录/区间): {stats['ratio']:.2f}x")
+    print(f"  JSON 数据库: {stats['json_bytes']} 字节")
+    print(f"  二进制前缀表: {stats['prefix_bytes']} 字节")
+    print(f"  二进制区间表: {stats['interval_bytes']} 字节")
+    if stats["json_bytes"]:
+        print(f"  区间表/JSON: {stats['interval_bytes'] / stats['json_bytes']:.2%}")
+
+
+def database_stats(
+    phone_database: PhoneDatabase,
+    previous: Optional[PhoneDatabase] = None,
+    delta: Optional[Dict[str, List[str]]] = None,
+    meta: Optional[Dict[str, Any]] = None,
+) -> DatabaseStats:
+    """统计前缀分布
+
+    上一次构建的元数据中保存了分布且与上一版数据库一致时，只按变更的前缀增量更新，
+    否则完整统计一次。
+    """
+    rows = (meta or {}).get("region_counts")
+    if previous is not None and delta is not None and rows is not None:
+        stats = DatabaseStats.from_json(rows)
+        if stats.records == len(previous):
+            return stats.apply_delta(previous, phone_database, delta)
+    return DatabaseStats.from_mapping(phone_database)
+
+
+def analyze_database(
+    phone_database: PhoneDatabase, stats: Optional[DatabaseStats] = None
+) -> None:
+    """打印数据库统计信息，分布从按归属地的计数汇总"""
+    if stats is None:
+        stats = DatabaseStats.from_mapping(phone_database)
+    print(f"总记录数: {stats.records}")
+
+    def ranked(fields: List[str]) -> List[Tuple[str, int]]:
+        return sorted(
+            ((key[-1], count) for key, count in stats.totals(fields).items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
 
     print(f"\n运营商分布:")
-    for carrier, count in sorted(carriers.items()):
+    for carrier, count in sorted(ranked(["carrier"])):
         print(f"  {carrier}: {count}")
 
     print(f"\n省份分布 (前10):")
-    for province, count in sorted(provinces.items(), key=lambda x: x[1], reverse=True)[
-        :10
-    ]:
+    for province, count in ranked(["province"])[:10]:
         print(f"  {province}: {count}")
 
     print(f"\n城市分布 (前10):")
-    for city, count in sorted(cities.items(), key=lambda x: x[1], reverse=True)[:10]:
+    for city, count in ranked(["province", "city"])[:10]:
         print(f"  {city}: {count}")
 
 
+def shards_reusable(meta: Optional[Dict[str, Any]], shard_dir: Optional[str]) -> bool:
+    """上一次构建是否写出了该分片目录，否则已有分片可能早于上一版数据库"""
+    return (
+        meta is not None
+        and shard_dir is not None
+        and shard_dir in meta.get("outputs", [])
+        and os.path.exists(os.path.join(shard_dir, SHARD_MANIFEST))
+    )
+
+
 def main():
     """主函数"""
-    input_file = "data/手机号归属地1219.txt"
-    output_file = "data/phone_database.json"
+    parser = argparse.ArgumentParser(description="解析手机号归属地数据")
+    parser.add_argument(
+        "--input", default="data/手机号归属地1219.txt", help="原始数据文件"
+    )
+    parser.add_argument(
+        "--output", default="data/phone_database.json", help="JSON 数据库输出路径"
+    )
+    parser.add_argument(
+        "--binary",
+        nargs="?",
+        const="data/phone_database.bin",
+        help="同时输出编译后的二进制数据库 (默认 data/phone_database.bin)",
+    )
+    parser.add_argument(
+        "--intervals",
+        nargs="?",
+        const="data/phone_intervals.bin",
+        help="同时输出区间压缩的二进制数据库 (默认 data/phone_intervals.bin)",
+    )
+    parser.add_argument(
+        "--shards",
+        nargs="?",
+        const="data/shards",
+        help="同时按3位号段输出二进制分片 (默认 data/shards)",
+    )
+    parser.add_argument("--stats", action="store_true", help="打印区间压缩统计")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="并行解析的进程数 (默认 1，顺序解析)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="忽略源数据哈希，强制完整重建"
+    )
+    args = parser.parse_args()
+
+    outputs = [args.output] + [
+        path for path in (args.binary, args.intervals, args.shards) if path
+    ]
+    meta_file = build_meta_path(args.output)
+    meta = load_build_meta(meta_file)
+    source_hash = hash_file(args.input)
+    if not args.force and is_up_to_date(meta, source_hash, outputs):
+        print(f"源数据未变化 (sha256 {source_hash[:12]})，跳过构建")
+        return
 
     print("开始解析手机号归属地数据...")
-    phone_database = parse_phone_data(input_file)
+    parse_stats: Dict[str, int] = {}
+    start = time.perf_counter()
+    phone_database = parse_phone_data(args.input, args.workers, parse_stats)
+    elapsed = time.perf_counter() - start
 
     print(f"解析完成，共 {len(phone_database)} 条记录")
+    lines_per_second = parse_stats["lines"] / elapsed if elapsed else 0.0
+    print(
+        f"解析 {parse_stats['lines']} 行，耗时 {elapsed:.2f} 秒 "
+        f"({lines_per_second:,.0f} 行/秒)"
+    )
 
     # 显示前几条记录
     print("\n前5条记录:")
     for i, (prefix, info) in enumerate(list(phone_database.items())[:5]):
         print(f"{prefix}: {info}")
 
-    # 分析数据库
-    analyze_database(phone_database)
+    # 与上一次构建结果比较，只重写受影响的分片
+    changed_segments = None
+    previous = None
+    delta = None
+    if not args.force and meta is not None:
+        previous = load_previous_database(args.output)
+    if previous is not None:
+        delta = diff_databases(previous, phone_database)
+        print_delta_summary(previous, phone_database, delta)
+        # 上一次构建写出了同一分片目录时，未变化的号段才能沿用已有分片
+        if shards_reusable(meta, args.shards):
+            changed_segments = {
+                prefix[:3] for prefixes in delta.values() for prefix in prefixes
+            }
+
+    # 分析数据库：分布在上一次构建的基础上按变更增量更新
+    stats = database_stats(phone_database, previous, delta, meta)
+    analyze_database(phone_database, stats)
+    if args.stats:
+        report_interval_stats(phone_database)
 
     # 保存数据库
-    save_database(phone_database, output_file)
+    save_database(phone_database, args.output)
+    if args.binary:
+        save_compiled_database(phone_database, args.binary)
+    if args.intervals:
+        save_compiled_database(phone_database, args.intervals, intervals=True)
+    if args.shards:
+        save_sharded_database(phone_database, args.shards, changed_segments, stats)
+
+    # 记录源数据哈希与格式版本，源数据未变化时下次构建直接跳过
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "source": args.input,
+        "source_sha256": source_hash,
+        "records": len(phone_database),
+        "outputs": outputs,
+        "region_counts": stats.to_json(),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    write_file_atomic(
+        meta_file, json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8")
+    )
+
+    peak = peak_memory_mb()
+    if peak is not None:
+        print(f"峰值内存: {peak:.1f} MB")
 
 
 if __name__ == "__main__":
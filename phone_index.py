@@ -0,0 +1,906 @@
+#!/usr/bin/env python3
+"""
+手机号数据库的二进制格式与查询索引
+"""
+
+import bisect
+import heapq
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from numpy import ndarray
+
+np: Optional[ModuleType]
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy 为可选依赖
+    np = None
+
+# 整数前缀序列；安装了 numpy 时批量接口返回并接受 numpy 数组
+Prefixes = Union[Sequence[int], "ndarray"]
+# prefixes_of 的结果，可按位置改写
+PrefixArray = Union["array[int]", "ndarray"]
+# tally_codes 的计数数组
+Counts = Union[List[int], "ndarray"]
+
+# 文件头: 魔数, 格式版本, 索引类型, 记录数, 归属地数, 字符串数
+# 文件末尾可以附加每个归属地的前缀数（uint32 × 归属地数），不含该段的文件仍可读取
+MAGIC = b"PCDB"
+FORMAT_VERSION = 1
+KIND_PREFIX = 0
+KIND_INTERVAL = 1
+HEADER = struct.Struct("<4sHHIII")
+
+# 从文件映射的定长整数数组：小端主机上为 memoryview，否则为字节序转换后的 array
+IntArray = Union["memoryview", "array[int]"]
+
+# 归属地元组中字符串的顺序
+REGION_FIELDS = ("province", "city", "carrier", "carrier_cn")
+
+
+class PhoneRecord(Mapping):
+    """紧凑的归属地记录
+
+    使用 __slots__ 存储四个字段，同时保持与原先字典记录相同的只读访问方式
+    (record["carrier"]、"city" in record、dict(record))。
+    """
+
+    __slots__ = REGION_FIELDS + ("_result",)
+
+    def __init__(self, province: str, city: str, carrier: str, carrier_cn: str):
+        self.province = province
+        self.city = city
+        self.carrier = carrier
+        self.carrier_cn = carrier_cn
+        self._result: Optional[Dict[str, Any]] = None
+
+    def result_template(self) -> Dict[str, Any]:
+        """该归属地共享的检测结果模板，首次使用时构建"""
+        if self._result is None:
+            self._result = result_template(self)
+        return self._result
+
+    def __getitem__(self, key: str) -> str:
+        if key not in REGION_FIELDS:
+            raise KeyError(key)
+        value: str = getattr(self, key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(REGION_FIELDS)
+
+    def __len__(self) -> int:
+        return len(REGION_FIELDS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+def result_template(info: Mapping) -> Dict[str, Any]:
+    """构建检测结果模板，phone_number 与 prefix 由调用方填充
+
+    调用方应复制模板后再填充，模板本身在同一归属地的所有前缀间共享。
+    """
+    return {
+        "success": True,
+        "phone_number": None,
+        "carrier": info["carrier"],
+        "carrier_cn": info["carrier_cn"],
+        "province": info["province"],
+        "city": info["city"],
+        "prefix": None,
+    }
+
+
+class RecordInterner:
+    """字符串驻留与记录去重
+
+    相同的城市、运营商字符串只保留一个对象，归属地完全相同的前缀共享同一条记录。
+    """
+
+    def __init__(self) -> None:
+        self._records: Dict[Tuple[str, ...], PhoneRecord] = {}
+
+    def record(
+        self, province: str, city: str, carrier: str, carrier_cn: str
+    ) -> PhoneRecord:
+        """返回驻留后的归属地记录"""
+        key = (province, city, carrier, carrier_cn)
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = PhoneRecord(
+                *(sys.intern(value) for value in key)
+            )
+        return record
+
+    def object_hook(self, obj: Dict[str, Any]) -> Any:
+        """json.load 的 object_hook，把归属地对象转换为驻留记录"""
+        if len(obj) != 4 or "carrier_cn" not in obj:
+            return obj
+        key = (obj["province"], obj["city"], obj["carrier"], obj["carrier_cn"])
+        return self._records.get(key) or self.record(*key)
+
+
+def _pad(data: bytes) -> bytes:
+    """按4字节对齐，保证各数组段可以直接 cast"""
+    return data + b"\0" * (-len(data) % 4)
+
+
+def _le_bytes(values: array) -> bytes:
+    """以小端字节序导出数组"""
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def build_region_tables(
+    phone_database: Mapping,
+) -> Tuple[array, array, List[Tuple[int, ...]], List[str]]:
+    """按前缀排序并去重归属地，返回 (前缀数组, 归属地编码数组, 归属地表, 字符串表)"""
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+    regions: List[Tuple[int, ...]] = []
+    region_ids: Dict[Tuple[int, ...], int] = {}
+
+    def string_id(value: str) -> int:
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    prefixes = array("I")
+    codes = array("H")
+    for prefix in sorted(phone_database, key=int):
+        info = phone_database[prefix]
+        region = tuple(string_id(info[field]) for field in REGION_FIELDS)
+        if region not in region_ids:
+            region_ids[region] = len(regions)
+            regions.append(region)
+        prefixes.append(int(prefix))
+        codes.append(region_ids[region])
+
+    if len(strings) > 0xFFFF or len(regions) > 0xFFFF:
+        raise ValueError("Too many distinct regions for the compiled format")
+
+    return prefixes, codes, regions, strings
+
+
+def merge_intervals(prefixes: array, codes: array) -> Tuple[array, array, array]:
+    """把归属地相同的连续前缀合并为 [start, end) 区间"""
+    starts = array("I")
+    ends = array("I")
+    interval_codes = array("H")
+    for prefix, code in zip(prefixes, codes):
+        if ends and ends[-1] == prefix and interval_codes[-1] == code:
+            ends[-1] = prefix + 1
+        else:
+            starts.append(prefix)
+            ends.append(prefix + 1)
+            interval_codes.append(code)
+    return starts, ends, interval_codes
+
+
+def encode_database(phone_database: Mapping, intervals: bool = False) -> bytes:
+    """把 {前缀: 归属地} 编码为紧凑的二进制格式
+
+    intervals 为 True 时把连续且归属地相同的前缀合并为区间存储。
+    """
+    prefixes, codes, regions, strings = build_region_tables(phone_database)
+
+    blobs = [value.encode("utf-8") for value in strings]
+    offsets = array("I", [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+
+    region_table = array("H", [sid for region in regions for sid in region])
+    region_counts = array("I", bytes(4 * len(regions)))
+    for code in codes:
+        region_counts[code] += 1
+
+    if intervals:
+        starts, ends, codes = merge_intervals(prefixes, codes)
+        sections = [_le_bytes(starts), _le_bytes(ends)]
+    else:
+        sections = [_le_bytes(prefixes)]
+
+    return b"".join(
+        [
+            HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                KIND_INTERVAL if intervals else KIND_PREFIX,
+                len(codes),
+                len(regions),
+                len(strings),
+            ),
+            _le_bytes(offsets),
+            _pad(b"".join(blobs)),
+            _pad(_le_bytes(region_table)),
+            *sections,
+            _pad(_le_bytes(codes)),
+            _le_bytes(region_counts),
+        ]
+    )
+
+
+class CompiledPhoneDatabase(Mapping):
+    """通过 mmap 只读访问编译后的数据库
+
+    前缀与归属地编码数组直接映射自文件，不复制到进程内存，
+    同一主机上的多个进程共享操作系统的页缓存。
+    区间格式的文件按起始前缀二分查找所在区间。
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buf = memoryview(self._mmap)
+        if len(buf) < HEADER.size:
+            raise ValueError(f"{filename} is not a compiled phone database")
+        magic, version, kind, count, region_count, string_count = HEADER.unpack_from(
+            buf
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a compiled phone database")
+        if version != FORMAT_VERSION or kind not in (KIND_PREFIX, KIND_INTERVAL):
+            raise ValueError(f"Unsupported compiled database format: {version}/{kind}")
+
+        pos = HEADER.size
+        offsets, pos = self._section(buf, pos, "I", string_count + 1)
+        blob_end = pos + offsets[-1]
+        if blob_end > len(buf):
+            raise ValueError("Compiled database is truncated")
+        strings = [
+            bytes(buf[pos + offsets[i] : pos + offsets[i + 1]]).decode("utf-8")
+            for i in range(string_count)
+        ]
+        pos = blob_end + (-blob_end % 4)
+        region_table, pos = self._section(buf, pos, "H", region_count * 4)
+        self._starts, pos = self._section(buf, pos, "I", count)
+        self._ends: Optional[IntArray] = None
+        self._count: int = count
+        if kind == KIND_INTERVAL:
+            self._ends, pos = self._section(buf, pos, "I", count)
+            self._count = sum(self._ends) - sum(self._starts)
+        self._codes, pos = self._section(buf, pos, "H", count)
+        # 早期生成的文件没有归属地计数段
+        self._region_counts: Optional[IntArray] = None
+        if len(buf) > pos:
+            self._region_counts, pos = self._section(buf, pos, "I", region_count)
+
+        # 归属地表很小，解码后常驻内存，所有前缀共享同一份记录
+        self.regions = [
+            PhoneRecord(*(strings[sid] for sid in region_table[i : i + 4]))
+            for i in range(0, region_count * 4, 4)
+        ]
+
+    @staticmethod
+    def _section(
+        buf: memoryview, pos: int, typecode: Literal["H", "I"], count: int
+    ) -> Tuple[IntArray, int]:
+        """读取一个定长数组段，返回 (数组, 对齐后的下一段位置)"""
+        size = array(typecode).itemsize * count
+        end = pos + size
+        if end > len(buf):
+            raise ValueError("Compiled database is truncated")
+        if sys.byteorder == "little":
+            return buf[pos:end].cast(typecode), end + (-end % 4)
+        values = array(typecode, bytes(buf[pos:end]))
+        values.byteswap()
+        return values, end + (-end % 4)
+
+    def code_of(self, prefix: int) -> int:
+        """返回前缀对应的归属地编码，不存在时返回 -1"""
+        if self._ends is not None:
+            i = bisect.bisect_right(self._starts, prefix) - 1
+            if i >= 0 and prefix < self._ends[i]:
+                return self._codes[i]
+            return -1
+
+        i = bisect.bisect_left(self._starts, prefix)
+        if i < len(self._starts) and self._starts[i] == prefix:
+            return self._codes[i]
+        return -1
+
+    def __getitem__(self, prefix: str) -> PhoneRecord:
+        if not isinstance(prefix, str) or not (prefix.isascii() and prefix.isdigit()):
+            raise KeyError(prefix)
+        code = self.code_of(int(prefix))
+        if code < 0:
+            raise KeyError(prefix)
+        return self.regions[code]
+
+    def gather(self, prefixes: Prefixes) -> List[int]:
+        """批量查询归属地编码，不存在的前缀为 -1"""
+        if np is None or not isinstance(prefixes, np.ndarray):
+            return [self.code_of(prefix) for prefix in prefixes]
+
+        starts = np.frombuffer(self._starts, dtype=np.uint32)
+        codes = np.frombuffer(self._codes, dtype=np.uint16).astype(np.int32)
+        if not len(starts):
+            return [-1] * len(prefixes)
+        if self._ends is not None:
+            ends = np.frombuffer(self._ends, dtype=np.uint32)
+            i = np.searchsorted(starts, prefixes, side="right") - 1
+            found = (i >= 0) & (prefixes < ends[i])
+        else:
+            i = np.minimum(np.searchsorted(starts, prefixes), len(starts) - 1)
+            found = starts[i] == prefixes
+        result: List[int] = np.where(found, codes[i], -1).tolist()
+        return result
+
+    def region_counts(self) -> List[int]:
+        """每个归属地的前缀数，优先读取文件末尾构建时统计的计数段"""
+        if self._region_counts is not None:
+            return self._region_counts.tolist()
+        counts = [0] * len(self.regions)
+        if self._ends is None:
+            for code in self._codes:
+                counts[code] += 1
+        else:
+            for start, end, code in zip(self._starts, self._ends, self._codes):
+                counts[code] += end - start
+        return counts
+
+    def prefix_table(self) -> Tuple[array, array]:
+        """返回按前缀排序的 (前缀数组, 归属地编码数组)，区间格式展开为逐个前缀"""
+        if self._ends is None:
+            return array("I", self._starts), array("H", self._codes)
+        prefixes = array("I")
+        codes = array("H")
+        for start, end, code in zip(self._starts, self._ends, self._codes):
+            prefixes.extend(range(start, end))
+            codes.extend(array("H", [code]) * (end - start))
+        return prefixes, codes
+
+    def __iter__(self) -> Iterator[str]:
+        if self._ends is None:
+            return (str(prefix) for prefix in self._starts)
+        return (
+            str(prefix)
+            for start, end in zip(self._starts, self._ends)
+            for prefix in range(start, end)
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+
+# 直接寻址表覆盖的前缀空间: 1300000-1999999
+PREFIX_BASE = 1300000
+PREFIX_LIMIT = 2000000
+
+
+class DirectIndexDatabase(Mapping):
+    """直接寻址的 O(1) 前缀表
+
+    每个7位前缀对应一个 uint16 槽位，存放去重后的归属地编码加1（0 表示不存在），
+    查询只需一次数组下标访问，不涉及字符串哈希。
+    """
+
+    def __init__(self, slots: "array[int]", regions: List[PhoneRecord], count: int):
+        self._slots = slots
+        self.regions = regions
+        self._count = count
+
+    @classmethod
+    def from_mapping(cls, phone_database: Mapping) -> "DirectIndexDatabase":
+        """从 {前缀: 归属地} 映射构建直接寻址表"""
+        slots = array("H", bytes(2 * (PREFIX_LIMIT - PREFIX_BASE)))
+        regions: List[PhoneRecord] = []
+        region_ids: Dict[Tuple[str, ...], int] = {}
+        count = 0
+
+        for prefix, info in phone_database.items():
+            value = int(prefix)
+            if not PREFIX_BASE <= value < PREFIX_LIMIT:
+                continue
+            region = tuple(info[field] for field in REGION_FIELDS)
+            code = region_ids.get(region)
+            if code is None:
+                if len(regions) >= 0xFFFF:
+                    raise ValueError("Too many distinct regions for the direct index")
+                code = region_ids[region] = len(regions)
+                regions.append(PhoneRecord(*region))
+            if not slots[value - PREFIX_BASE]:
+                count += 1
+            slots[value - PREFIX_BASE] = code + 1
+
+        return cls(slots, regions, count)
+
+    def code_of(self, prefix: int) -> int:
+        """返回前缀对应的归属地编码，不存在时返回 -1"""
+        if PREFIX_BASE <= prefix < PREFIX_LIMIT:
+            return self._slots[prefix - PREFIX_BASE] - 1
+        return -1
+
+    def __getitem__(self, prefix: str) -> PhoneRecord:
+        if not isinstance(prefix, str) or not (prefix.isascii() and prefix.isdigit()):
+            raise KeyError(prefix)
+        code = self.code_of(int(prefix))
+        if code < 0:
+            raise KeyError(prefix)
+        return self.regions[code]
+
+    def gather(self, prefixes: Prefixes) -> List[int]:
+        """批量查询归属地编码，不存在的前缀为 -1"""
+        if np is None or not isinstance(prefixes, np.ndarray):
+            return [self.code_of(prefix) for prefix in prefixes]
+
+        slots = np.frombuffer(self._slots, dtype=np.uint16)
+        offsets = prefixes - PREFIX_BASE
+        in_range = (offsets >= 0) & (offsets < len(slots))
+        codes = np.full(len(prefixes), -1, dtype=np.int32)
+        codes[in_range] = slots[offsets[in_range]].astype(np.int32) - 1
+        result: List[int] = codes.tolist()
+        return result
+
+    def region_counts(self) -> List[int]:
+        """每个归属地的前缀数"""
+        if np is not None:
+            slots = np.frombuffer(self._slots, dtype=np.uint16)
+            tally = np.bincount(slots, minlength=len(self.regions) + 1)
+            counts: List[int] = tally[1:].tolist()
+            return counts
+        counts = [0] * (len(self.regions) + 1)
+        for slot in self._slots:
+            counts[slot] += 1
+        return counts[1:]
+
+    def prefix_table(self) -> Tuple[array, array]:
+        """返回按前缀排序的 (前缀数组, 归属地编码数组)"""
+        prefixes = array("I")
+        codes = array("H")
+        if np is not None:
+            slots = np.frombuffer(self._slots, dtype=np.uint16)
+            offsets = np.flatnonzero(slots)
+            prefixes.frombytes((offsets + PREFIX_BASE).astype(np.uint32).tobytes())
+            codes.frombytes((slots[offsets] - 1).astype(np.uint16).tobytes())
+            return prefixes, codes
+        for offset, slot in enumerate(self._slots):
+            if slot:
+                prefixes.append(PREFIX_BASE + offset)
+                codes.append(slot - 1)
+        return prefixes, codes
+
+    def __iter__(self) -> Iterator[str]:
+        slots = self._slots
+        return (str(PREFIX_BASE + i) for i in range(len(slots)) if slots[i])
+
+    def __len__(self) -> int:
+        return self._count
+
+
+SHARD_MANIFEST = "manifest.json"
+
+
+class ShardedPhoneDatabase(Mapping):
+    """按3位号段分片、首次命中时加载的数据库
+
+    每个号段对应一个编译后的二进制分片，manifest.json 记录分片文件与记录数。
+    max_shards 大于0时只保留最近使用的若干分片，其余按 LRU 淘汰。
+    """
+
+    def __init__(self, directory: str, max_shards: int = 0):
+        self.directory = directory
+        self.max_shards = max_shards
+        manifest_file = os.path.join(directory, SHARD_MANIFEST)
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard manifest in {directory}")
+        self.segments: Dict[str, Dict[str, Any]] = manifest["segments"]
+        # 构建时保存的全库前缀分布，旧版 manifest 中不存在
+        self.stats: Optional[DatabaseStats] = None
+        if "region_counts" in manifest:
+            self.stats = DatabaseStats.from_json(manifest["region_counts"])
+        self._shards: "OrderedDict[str, CompiledPhoneDatabase]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def shard(self, segment: str) -> Optional[CompiledPhoneDatabase]:
+        """返回号段对应的分片，必要时加载并淘汰最久未使用的分片"""
+        with self._lock:
+            shard = self._shards.get(segment)
+            if shard is not None:
+                self._shards.move_to_end(segment)
+                return shard
+
+        entry = self.segments.get(segment)
+        if entry is None:
+            return None
+        shard = CompiledPhoneDatabase(os.path.join(self.directory, entry["file"]))
+
+        with self._lock:
+            shard = self._shards.setdefault(segment, shard)
+            self._shards.move_to_end(segment)
+            while self.max_shards > 0 and len(self._shards) > self.max_shards:
+                self._shards.popitem(last=False)
+        return shard
+
+    def loaded_segments(self) -> List[str]:
+        """当前常驻内存的号段（按最近使用排序）"""
+        with self._lock:
+            return list(self._shards)
+
+    def __getitem__(self, prefix: str) -> PhoneRecord:
+        if not isinstance(prefix, str) or len(prefix) < 3:
+            raise KeyError(prefix)
+        shard = self.shard(prefix[:3])
+        if shard is None:
+            raise KeyError(prefix)
+        return shard[prefix]
+
+    def __iter__(self) -> Iterator[str]:
+        for segment in sorted(self.segments):
+            shard = self.shard(segment)
+            if shard is not None:
+                yield from shard
+
+    def __len__(self) -> int:
+        return sum(entry["records"] for entry in self.segments.values())
+
+
+class DatabaseStats:
+    """按归属地计数的前缀分布统计
+
+    以归属地 (province, city, carrier, carrier_cn) 为键保存前缀数，
+    运营商、省份、城市分布在归属地计数上汇总，耗时只与归属地数量有关；
+    数据变更时按新增、删除与修改的前缀增量更新。
+    """
+
+    def __init__(self, counts: Optional[Dict[Tuple[str, ...], int]] = None):
+        self.counts: Dict[Tuple[str, ...], int] = counts or {}
+
+    @staticmethod
+    def key(info: Mapping) -> Tuple[str, ...]:
+        """归属地记录的计数键，缺少的字段记为空字符串"""
+        return tuple(info.get(field, "") for field in REGION_FIELDS)
+
+    @classmethod
+    def from_regions(
+        cls, regions: Sequence[Mapping], counts: Sequence[int]
+    ) -> "DatabaseStats":
+        """从归属地表与每个归属地的前缀数构建"""
+        totals: Dict[Tuple[str, ...], int] = {}
+        for info, count in zip(regions, counts):
+            if count:
+                key = cls.key(info)
+                totals[key] = totals.get(key, 0) + count
+        return cls(totals)
+
+    @classmethod
+    def from_mapping(cls, phone_database: Mapping) -> "DatabaseStats":
+        """遍历 {前缀: 归属地} 映射统计，共享的记录对象只计算一次键"""
+        counts: Dict[int, int] = {}
+        records: Dict[int, Mapping] = {}
+        for info in phone_database.values():
+            counts[id(info)] = counts.get(id(info), 0) + 1
+            records[id(info)] = info
+        return cls.from_regions(list(records.values()), list(counts.values()))
+
+    @classmethod
+    def from_json(cls, rows: List[List[Any]]) -> "DatabaseStats":
+        """从 to_json 的输出恢复"""
+        return cls({tuple(row[:-1]): row[-1] for row in rows})
+
+    def to_json(self) -> List[List[Any]]:
+        """序列化为 [province, city, carrier, carrier_cn, 前缀数] 列表"""
+        return [[*key, count] for key, count in sorted(self.counts.items())]
+
+    def add(self, info: Mapping, count: int = 1) -> None:
+        """为归属地增加（count 为负时减少）前缀数"""
+        key = self.key(info)
+        total = self.counts.get(key, 0) + count
+        if total:
+            self.counts[key] = total
+        else:
+            self.counts.pop(key, None)
+
+    def apply_delta(
+        self, old: Mapping, new: Mapping, delta: Mapping[str, Sequence[str]]
+    ) -> "DatabaseStats":
+        """按 diff 得到的新增、删除与修改的前缀增量更新"""
+        for prefix in delta["removed"]:
+            self.add(old[prefix], -1)
+        for prefix in delta["modified"]:
+            self.add(old[prefix], -1)
+            self.add(new[prefix])
+        for prefix in delta["added"]:
+            self.add(new[prefix])
+        return self
+
+    @property
+    def records(self) -> int:
+        """前缀总数"""
+        return sum(self.counts.values())
+
+    def totals(self, fields: Sequence[str]) -> Dict[Tuple[str, ...], int]:
+        """按字段组合汇总前缀数"""
+        positions = [REGION_FIELDS.index(field) for field in fields]
+        totals: Dict[Tuple[str, ...], int] = {}
+        for key, count in self.counts.items():
+            group = tuple(key[position] for position in positions)
+            totals[group] = totals.get(group, 0) + count
+        return totals
+
+
+def database_stats(database: Mapping) -> DatabaseStats:
+    """返回数据库的前缀分布，优先使用构建时保存的计数，否则遍历一次"""
+    stats = getattr(database, "stats", None)
+    if isinstance(stats, DatabaseStats):
+        return stats
+    region_counts = getattr(database, "region_counts", None)
+    if region_counts is not None:
+        return DatabaseStats.from_regions(getattr(database, "regions"), region_counts())
+    return DatabaseStats.from_mapping(database)
+
+
+# 反向索引可按其查询的归属地字段；carrier 同时匹配英文与中文运营商名称
+INDEXED_FIELDS = ("carrier", "province", "city")
+
+
+class PrefixIndex:
+    """按前缀排序的只读索引
+
+    prefixes 与 codes 为按前缀排序的并列数组，范围查询只需两次二分查找加一次切片。
+    每个归属地的前缀合并为有序的 [start, end) 区间，并按运营商、省份、城市建立
+    到归属地编码的倒排表，按字段查询的耗时只与命中的归属地和区间数量有关。
+    """
+
+    def __init__(self, prefixes: array, codes: array, regions: Sequence[Mapping]):
+        self.prefixes = prefixes
+        self.codes = codes
+        self.regions = regions
+
+        # 每个归属地的区间 (起始数组, 结束数组) 与前缀数
+        self._ranges = [(array("I"), array("I")) for _ in regions]
+        self._counts = [0] * len(regions)
+        starts, ends, interval_codes = merge_intervals(prefixes, codes)
+        for start, end, code in zip(starts, ends, interval_codes):
+            region_starts, region_ends = self._ranges[code]
+            region_starts.append(start)
+            region_ends.append(end)
+            self._counts[code] += end - start
+
+        self._postings: Dict[str, Dict[str, List[int]]] = {
+            field: {} for field in INDEXED_FIELDS
+        }
+        for code, info in enumerate(regions):
+            if not self._counts[code]:
+                continue
+            for field in INDEXED_FIELDS:
+                values = {info[field]}
+                if field == "carrier":
+                    values.add(info["carrier_cn"])
+                for value in values:
+                    self._postings[field].setdefault(value, []).append(code)
+
+    @classmethod
+    def from_database(cls, database: Mapping) -> "PrefixIndex":
+        """从任意查询后端构建索引，编译后端直接复用其前缀与编码数组"""
+        prefix_table = getattr(database, "prefix_table", None)
+        if prefix_table is not None:
+            prefixes, codes = prefix_table()
+            return cls(prefixes, codes, getattr(database, "regions"))
+
+        regions: List[Mapping] = []
+        region_ids: Dict[Tuple[str, ...], int] = {}
+        prefixes = array("I")
+        codes = array("H")
+        for prefix in sorted(database, key=int):
+            info = database[prefix]
+            region = tuple(info[field] for field in REGION_FIELDS)
+            code = region_ids.get(region)
+            if code is None:
+                code = region_ids[region] = len(regions)
+                regions.append(info)
+            prefixes.append(int(prefix))
+            codes.append(code)
+        return cls(prefixes, codes, regions)
+
+    def values(self, field: str) -> List[str]:
+        """返回字段的所有取值"""
+        return sorted(self._postings[field])
+
+    def match_regions(self, **filters: Optional[str]) -> List[int]:
+        """返回同时满足各字段取值的归属地编码，未给出的字段不限制"""
+        matched: Optional[set] = None
+        for field in INDEXED_FIELDS:
+            value = filters.get(field)
+            if value is None:
+                continue
+            codes = set(self._postings[field].get(value, ()))
+            matched = codes if matched is None else matched & codes
+        if matched is None:
+            return [code for code, count in enumerate(self._counts) if count]
+        return sorted(matched)
+
+    def range_totals(self, codes: Sequence[int]) -> Tuple[int, int]:
+        """返回归属地的 (区间数, 前缀数)"""
+        return (
+            sum(len(self._ranges[code][0]) for code in codes),
+            sum(self._counts[code] for code in codes),
+        )
+
+    def iter_ranges(
+        self, codes: Sequence[int], cursor: int = 0
+    ) -> Iterator[Tuple[int, int, int]]:
+        """按起始前缀顺序产出归属地的 (start, end, code) 区间，从 cursor 处开始
+
+        各归属地的区间互不重叠，按 cursor 二分定位后多路归并，
+        取前 n 个区间的耗时与 n 和命中的归属地数量相关，与数据库大小无关。
+        """
+        streams = []
+        for code in codes:
+            starts, ends = self._ranges[code]
+            first = bisect.bisect_left(starts, cursor)
+            streams.append(
+                zip(
+                    itertools.islice(starts, first, None),
+                    itertools.islice(ends, first, None),
+                    itertools.repeat(code),
+                )
+            )
+        return heapq.merge(*streams)
+
+    def span(self, low: int, high: int) -> Tuple[int, int]:
+        """返回 [low, high] 范围内前缀在有序数组中的位置 [i, j)"""
+        return (
+            bisect.bisect_left(self.prefixes, low),
+            bisect.bisect_right(self.prefixes, high),
+        )
+
+    def __len__(self) -> int:
+        return len(self.prefixes)
+
+
+# 批量数量达到该值时才使用 numpy，小批量时纯 Python 更快；
+# batch_detect_carriers 每次最多100个号码，只有 bulk 与 aggregate 工具走向量化路径
+NUMPY_MIN_BATCH = 256
+_PREFIX_WEIGHTS = (1000000, 100000, 10000, 1000, 100, 10, 1)
+
+
+def prefix_of(phone_number: str) -> int:
+    """把有效手机号转换为7位整数前缀，格式无效时返回 -1
+
+    校验只检查长度与字符类别，不经过正则；整个号码一次转换为整数后取前7位。
+    """
+    if (
+        len(phone_number) == 11
+        and phone_number.isascii()
+        and phone_number.isdigit()
+        and phone_number[0] == "1"
+        and phone_number[1] in "3456789"
+    ):
+        return int(phone_number) // 10000
+    return -1
+
+
+def lookup_record(database: Mapping, prefix: int) -> Optional[Mapping]:
+    """按整数前缀查找归属地记录，支持 code_of 的后端不涉及字符串哈希"""
+    code_of = getattr(database, "code_of", None)
+    if code_of is not None:
+        code = code_of(prefix)
+        regions: Sequence[Mapping] = getattr(database, "regions")
+        return regions[code] if code >= 0 else None
+    return database.get(str(prefix))
+
+
+def prefixes_of(phone_numbers: Sequence[str]) -> PrefixArray:
+    """批量把手机号转换为整数前缀，格式无效的号码为 -1
+
+    安装了 numpy 时在一次向量化运算中完成校验与转换，否则返回 array("l")。
+    """
+    if np is None or len(phone_numbers) < NUMPY_MIN_BATCH:
+        return array("l", [prefix_of(phone) for phone in phone_numbers])
+
+    # 定长数组按最长元素分配，长度不是11的号码先替换为空字符串，
+    # 单个超长输入不会把整个数组放大到 n × 最大长度
+    numbers = np.array(
+        [phone if len(phone) == 11 else "" for phone in phone_numbers], dtype="U11"
+    )
+
+    # 按 UTF-32 码位逐字符校验，空字符串以 0 填充，减去 48 后回绕为大数而无效
+    digits = numbers.view(np.uint32).reshape(len(numbers), 11) - 48
+    valid = (digits <= 9).all(axis=1) & (digits[:, 0] == 1) & (digits[:, 1] >= 3)
+    prefixes = digits[:, :7].astype(np.int64) @ np.array(_PREFIX_WEIGHTS)
+    result: "ndarray" = np.where(valid, prefixes, -1)
+    return result
+
+
+def rejected_positions(prefixes: Prefixes) -> List[int]:
+    """返回格式无效（前缀为 -1）的号码位置"""
+    if np is not None and isinstance(prefixes, np.ndarray):
+        positions: List[int] = np.flatnonzero(prefixes < 0).tolist()
+        return positions
+    return [position for position, prefix in enumerate(prefixes) if prefix < 0]
+
+
+def group_prefixes(prefixes: Prefixes) -> Tuple[Prefixes, List[int]]:
+    """对一批前缀去重，返回 (不同的有效前缀, 每个位置在其中的下标)
+
+    无效前缀 (-1) 的下标为 -1。numpy 数组按前缀排序去重，其余按首次出现顺序去重。
+    """
+    if np is not None and isinstance(prefixes, np.ndarray):
+        valid = prefixes >= 0
+        unique, inverse = np.unique(prefixes[valid], return_inverse=True)
+        inverse_of = np.full(len(prefixes), -1, dtype=np.int64)
+        inverse_of[valid] = inverse.reshape(-1)
+        groups: List[int] = inverse_of.tolist()
+        return unique, groups
+
+    index: Dict[int, int] = {}
+    groups = [
+        index.setdefault(prefix, len(index)) if prefix >= 0 else -1
+        for prefix in prefixes
+    ]
+    return array("l", index), groups
+
+
+def tally_codes(
+    codes: Sequence[int], size: int, counts: Optional[Counts] = None
+) -> Counts:
+    """统计每个归属地编码出现的次数，累加到长度为 size + 1 的计数数组 counts 并返回
+
+    下标 code + 1 为编码 code 的次数，下标 0 为 -1（无效或不存在的前缀）的次数；
+    counts 为 None 时新建。安装了 numpy 时返回 numpy 数组。
+    """
+    if np is not None and len(codes) >= NUMPY_MIN_BATCH:
+        tally: "ndarray" = np.bincount(np.asarray(codes) + 1, minlength=size + 1)
+        return tally if counts is None else tally + counts
+    if counts is None:
+        counts = [0] * (size + 1)
+    for code in codes:
+        counts[code + 1] += 1
+    return counts
+
+
+def lookup_prefixes(
+    database: Mapping, prefixes: Prefixes
+) -> Tuple[List[int], List[Mapping]]:
+    """对一批整数前缀做一次集中查询，返回 (归属地编码, 归属地表)
+
+    支持 gather 的后端直接批量查询；普通字典等映射逐个查找并临时编号。
+    """
+    gather = getattr(database, "gather", None)
+    if gather is not None:
+        return gather(prefixes), getattr(database, "regions")
+
+    regions: List[Mapping] = []
+    region_ids: Dict[int, int] = {}
+    codes = []
+    for prefix in prefixes:
+        info = database.get(str(prefix)) if prefix >= 0 else None
+        if info is None:
+            codes.append(-1)
+            continue
+        code = region_ids.get(id(info))
+        if code is None:
+            code = region_ids[id(info)] = len(regions)
+            regions.append(info)
+        codes.append(code)
+    return codes, regions
@@ -6,13 +6,27 @@
 import json
 import sys
 import os
+import tempfile
 import unittest
 from unittest.mock import patch, mock_open
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from parse_phone_data import parse_phone_data, save_database, analyze_database
+import parse_phone_data as parser_module
+from parse_phone_data import (
+    parse_phone_data,
+    split_byte_ranges,
+    diff_databases,
+    hash_file,
+    is_up_to_date,
+    save_sharded_database,
+    save_database,
+    analyze_database,
+    database_stats,
+    interval_stats,
+)
+from phone_index import CompiledPhoneDatabase, PhoneRecord, ShardedPhoneDatabase
 
 
 class TestDataParser(unittest.TestCase):
@@ -45,6 +59,19 @@ class TestDataParser(unittest.TestCase):
         self.assertEqual(result["1300001"]["carrier"], "China Unicom")
         self.assertEqual(result["1300002"]["carrier"], "China Unicom")
 
+    def test_parse_phone_data_shares_records(self):
+        """测试归属地相同的前缀共享同一条记录"""
+        mock_data = """1300000,山东,济南,联通
+1300001,山东,济南,联通
+1300002,山东,青岛,联通"""
+
+        with patch("builtins.open", mock_open(read_data=mock_data)):
+            result = parse_phone_data("fake_file.txt")
+
+        self.assertIs(result["1300000"], result["1300001"])
+        self.assertIsNot(result["1300000"], result["1300002"])
+        self.assertIs(result["1300000"]["province"], result["1300002"]["province"])
+
     def test_parse_phone_data_carrier_mapping(self):
         """测试运营商映射"""
         mock_data = """1300000,山东,济南,移动
@@ -108,11 +135,12 @@ invalid_line
         }
 
         mock_file = mock_open()
-        with patch("builtins.open", mock_file):
+        with patch("builtins.open", mock_file), patch("os.replace") as replace:
             save_database(test_data, "test_output.json")
 
-        # 验证文件写入
-        mock_file.assert_called_once_with("test_output.json", "w", encoding="utf-8")
+        # 验证先写临时文件再替换
+        mock_file.assert_called_once_with("test_output.json.tmp", "w", encoding="utf-8")
+        replace.assert_called_once_with("test_output.json.tmp", "test_output.json")
 
         # 验证写入的内容 - 修复JSON解析问题
         write_calls = mock_file().write.call_args_list
@@ -136,6 +164,38 @@ invalid_line
         # 验证输出调用次数（至少应该有统计信息输出）
         self.assertGreater(mock_print.call_count, 0)
 
+    def test_interval_stats(self):
+        """测试区间压缩统计"""
+        test_data = {
+            f"130{i:04d}": {
+                "province": "山东",
+                "city": "济南" if i < 600 else "青岛",
+                "carrier": "China Unicom",
+                "carrier_cn": "联通",
+            }
+            for i in range(1000)
+        }
+
+        stats = interval_stats(test_data)
+
+        self.assertEqual(stats["records"], 1000)
+        self.assertEqual(stats["regions"], 2)
+        self.assertEqual(stats["intervals"], 2)
+        self.assertEqual(stats["ratio"], 500)
+        self.assertLess(stats["interval_bytes"], stats["prefix_bytes"])
+        self.assertLess(stats["prefix_bytes"], stats["json_bytes"])
+
+    def test_interval_stats_with_records(self):
+        """测试解析生成的 PhoneRecord 记录也能统计"""
+        jinan = PhoneRecord("山东", "济南", "China Unicom", "联通")
+        qingdao = PhoneRecord("山东", "青岛", "China Unicom", "联通")
+        test_data = {f"130{i:04d}": jinan if i < 600 else qingdao for i in range(1000)}
+
+        stats = interval_stats(test_data)
+
+        self.assertEqual(stats["intervals"], 2)
+        self.assertLess(stats["prefix_bytes"], stats["json_bytes"])
+
     def test_analyze_database_empty(self):
         """测试空数据库分析"""
         test_data = {}
@@ -210,5 +270,253 @@ class TestDataParserIntegration(unittest.TestCase):
             self.assertEqual(info["carrier"], "China Unicom")
 
 
+class TestParallelParsing(unittest.TestCase):
+    """并行解析测试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.filename = os.path.join(self.tmpdir.name, "phone.txt")
+        lines = []
+        for i in range(2000):
+            city = ["济南", "青岛", "烟台"][i // 300 % 3]
+            lines.append(f"130{i:04d},山东,{city},{['联通', '移动', '电信'][i % 3]}")
+            if i % 97 == 0:
+                lines.append("")
+                lines.append("invalid_line")
+        # 重复前缀：后出现的记录覆盖先出现的
+        lines.append("1300000,江苏,南京,电信")
+        with open(self.filename, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+    def test_split_byte_ranges(self):
+        """测试字节区间按行对齐且连续覆盖整个文件"""
+        ranges = split_byte_ranges(self.filename, 7)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.filename))
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[start - 1 : start], b"\n")
+
+    def test_parallel_matches_sequential(self):
+        """测试并行解析与顺序解析结果一致"""
+        sequential_stats, parallel_stats = {}, {}
+        sequential = parse_phone_data(self.filename, stats=sequential_stats)
+        with patch.object(parser_module, "CHUNK_BYTES", 4096):
+            parallel = parse_phone_data(self.filename, workers=3, stats=parallel_stats)
+
+        self.assertEqual(list(parallel.items()), list(sequential.items()))
+        self.assertEqual(parallel["1300000"]["city"], "南京")
+        self.assertEqual(parallel_stats["lines"], sequential_stats["lines"])
+
+    def test_streaming_save_round_trip(self):
+        """测试流式保存的 JSON 可以完整读回"""
+        database = parse_phone_data(self.filename)
+        output_file = os.path.join(self.tmpdir.name, "phone_database.json")
+        with patch("builtins.print"):
+            save_database(database, output_file)
+        with open(output_file, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), database)
+        self.assertFalse(os.path.exists(output_file + ".tmp"))
+
+    def test_interrupted_save_keeps_previous_file(self):
+        """测试保存中途失败时原文件保持完整"""
+        output_file = os.path.join(self.tmpdir.name, "phone_database.json")
+        with patch("builtins.print"):
+            save_database({"1300000": {"city": "济南"}}, output_file)
+            with self.assertRaises(TypeError):
+                save_database(
+                    {"1300000": {"city": "青岛"}, "1300001": {"city": object()}},
+                    output_file,
+                )
+        with open(output_file, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"1300000": {"city": "济南"}})
+
+
+class TestIncrementalBuild(unittest.TestCase):
+    """增量构建测试"""
+
+    OLD = {
+        "1300000": {
+            "province": "山东",
+            "city": "济南",
+            "carrier": "China Unicom",
+            "carrier_cn": "联通",
+        },
+        "1300001": {
+            "province": "江苏",
+            "city": "常州",
+            "carrier": "China Unicom",
+            "carrier_cn": "联通",
+        },
+        "1381234": {
+            "province": "江苏",
+            "city": "连云港",
+            "carrier": "China Mobile",
+            "carrier_cn": "移动",
+        },
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_diff_databases(self):
+        """测试新增、删除与修改的前缀"""
+        new = dict(self.OLD)
+        del new["1300001"]
+        new["1381234"] = dict(new["1381234"], city="南京")
+        new["1921000"] = dict(self.OLD["1300000"])
+
+        delta = diff_databases(self.OLD, new)
+
+        self.assertEqual(delta["added"], ["1921000"])
+        self.assertEqual(delta["removed"], ["1300001"])
+        self.assertEqual(delta["modified"], ["1381234"])
+
+    def test_is_up_to_date(self):
+        """测试源数据哈希与格式版本匹配时跳过构建"""
+        source = os.path.join(self.tmpdir.name, "source.txt")
+        output = os.path.join(self.tmpdir.name, "phone_database.json")
+        for filename in (source, output):
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write("1300000,山东,济南,联通\n")
+        source_hash = hash_file(source)
+        meta = {
+            "format_version": parser_module.FORMAT_VERSION,
+            "source_sha256": source_hash,
+            "outputs": [output],
+        }
+
+        self.assertTrue(is_up_to_date(meta, source_hash, [output]))
+        self.assertFalse(is_up_to_date(None, source_hash, [output]))
+        self.assertFalse(is_up_to_date(meta, "0" * 64, [output]))
+        self.assertFalse(is_up_to_date(meta, source_hash, [output, source + ".bin"]))
+        self.assertFalse(
+            is_up_to_date(dict(meta, format_version=0), source_hash, [output])
+        )
+
+    def test_incremental_stats(self):
+        """测试在上一次构建的分布上按变更增量更新"""
+        new = dict(self.OLD)
+        del new["1300001"]
+        new["1381234"] = dict(new["1381234"], city="南京")
+        delta = diff_databases(self.OLD, new)
+        meta = {"region_counts": database_stats(self.OLD).to_json()}
+
+        with patch.object(parser_module.DatabaseStats, "from_mapping") as full_scan:
+            stats = database_stats(new, self.OLD, delta, meta)
+        full_scan.assert_not_called()
+        self.assertEqual(stats.counts, database_stats(new).counts)
+
+        # 元数据与上一版数据库不一致时完整统计
+        stale = {"region_counts": [["江苏", "南京", "China Mobile", "移动", 7]]}
+        self.assertEqual(
+            database_stats(new, self.OLD, delta, stale).counts,
+            database_stats(new).counts,
+        )
+
+    def shard_files(self):
+        """读取 manifest 中每个号段对应的分片文件"""
+        with open(os.path.join(self.tmpdir.name, "manifest.json")) as f:
+            manifest = json.load(f)
+        return {
+            segment: entry["file"] for segment, entry in manifest["segments"].items()
+        }
+
+    def test_only_changed_shards_rewritten(self):
+        """测试增量构建只重写变化的号段分片"""
+        with patch("builtins.print"):
+            save_sharded_database(self.OLD, self.tmpdir.name)
+            old_files = self.shard_files()
+            untouched = os.stat(os.path.join(self.tmpdir.name, old_files["138"]))
+
+            new = dict(self.OLD)
+            new["1300000"] = dict(new["1300000"], city="青岛")
+            save_sharded_database(new, self.tmpdir.name, {"130"})
+
+        files = self.shard_files()
+        self.assertEqual(files["138"], old_files["138"])
+        self.assertNotEqual(files["130"], old_files["130"])
+        self.assertEqual(
+            os.stat(os.path.join(self.tmpdir.name, files["138"])).st_ino,
+            untouched.st_ino,
+        )
+        with open(os.path.join(self.tmpdir.name, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["segments"]["130"]["records"], 2)
+
+    def test_live_snapshot_keeps_its_generation(self):
+        """测试重建后旧快照按需加载的分片仍是旧版本数据"""
+        new = dict(self.OLD)
+        new["1300000"] = dict(new["1300000"], city="青岛")
+        with patch("builtins.print"):
+            save_sharded_database(self.OLD, self.tmpdir.name)
+            old_files = self.shard_files()
+            snapshot = ShardedPhoneDatabase(self.tmpdir.name)
+            save_sharded_database(new, self.tmpdir.name, {"130"})
+
+            self.assertEqual(snapshot["1300000"]["city"], "济南")
+            self.assertEqual(
+                ShardedPhoneDatabase(self.tmpdir.name)["1300000"]["city"], "青岛"
+            )
+
+            # 再构建一次后，只保留新旧两版 manifest 引用的文件
+            middle_files = self.shard_files()
+            latest = dict(new, **{"1300000": dict(new["1300000"], city="烟台")})
+            save_sharded_database(latest, self.tmpdir.name, {"130"})
+        remaining = set(os.listdir(self.tmpdir.name)) - {"manifest.json"}
+        self.assertNotIn(old_files["130"], remaining)
+        self.assertEqual(
+            remaining,
+            set(self.shard_files().values()) | set(middle_files.values()),
+        )
+
+    def test_shards_rebuilt_after_build_without_shards(self):
+        """测试上一次构建未输出分片时，增量构建重写全部分片"""
+        source = os.path.join(self.tmpdir.name, "source.txt")
+        output = os.path.join(self.tmpdir.name, "phone_database.json")
+        shards = os.path.join(self.tmpdir.name, "shards")
+
+        def build(lines, *options):
+            with open(source, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines))
+            argv = ["parse_phone_data.py", "--input", source, "--output", output]
+            with patch.object(sys, "argv", argv + list(options)), patch(
+                "builtins.print"
+            ):
+                parser_module.main()
+
+        build(
+            ["1300000,山东,济南,联通", "1381234,江苏,连云港,移动"], "--shards", shards
+        )
+        # 不输出分片的构建修改了 138 号段，分片目录仍是第一次构建的内容
+        build(["1300000,山东,济南,联通", "1381234,江苏,南京,移动"])
+        build(["1300000,山东,青岛,联通", "1381234,江苏,南京,移动"], "--shards", shards)
+
+        database = ShardedPhoneDatabase(shards)
+        self.assertEqual(database["1300000"]["city"], "青岛")
+        self.assertEqual(database["1381234"]["city"], "南京")
+
+    def test_shard_cleanup_keeps_other_outputs(self):
+        """测试分片目录与其他输出共用时，清理旧分片不删除其他 .bin 文件"""
+        source = os.path.join(self.tmpdir.name, "source.txt")
+        output = os.path.join(self.tmpdir.name, "phone_database.json")
+        binary = os.path.join(self.tmpdir.name, "phone_database.bin")
+        for city in ("济南", "青岛", "烟台"):
+            with open(source, "w", encoding="utf-8") as f:
+                f.write(f"1300000,山东,{city},联通\n1381234,江苏,连云港,移动")
+            argv = ["parse_phone_data.py", "--input", source, "--output", output]
+            argv += ["--binary", binary, "--shards", self.tmpdir.name]
+            with patch.object(sys, "argv", argv), patch("builtins.print"):
+                parser_module.main()
+
+        self.assertEqual(CompiledPhoneDatabase(binary)["1300000"]["city"], "烟台")
+        shards = {name for name in os.listdir(self.tmpdir.name) if name[0].isdigit()}
+        self.assertEqual(len(shards), 3)
+
+
 if __name__ == "__main__":
     unittest.main()
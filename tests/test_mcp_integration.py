@@ -99,12 +99,17 @@ class MCPIntegrationTest(unittest.TestCase):
             tools = response["result"]["tools"]
 
             # 检查工具数量
-            self.assertEqual(len(tools), 2)
+            self.assertEqual(len(tools), 7)
 
             # 检查工具名称
             tool_names = [tool["name"] for tool in tools]
             self.assertIn("detect_carrier", tool_names)
             self.assertIn("batch_detect_carriers", tool_names)
+            self.assertIn("bulk_detect_carriers", tool_names)
+            self.assertIn("find_prefixes", tool_names)
+            self.assertIn("list_prefixes", tool_names)
+            self.assertIn("aggregate_carriers", tool_names)
+            self.assertIn("database_stats", tool_names)
 
             await self.stop_server()
 
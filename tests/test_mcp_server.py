@@ -6,14 +6,27 @@ MCP Server 单元测试
 import json
 import sys
 import os
+import random
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 import asyncio
+import csv
+import tempfile
+import threading
+import time
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import mcp_server
+import phone_index
 from mcp_server import MCPServer, detect_carrier, batch_detect_carriers
+from phone_index import (
+    CompiledPhoneDatabase,
+    DirectIndexDatabase,
+    RecordInterner,
+    encode_database,
+)
 
 
 class TestMCPServer(unittest.TestCase):
@@ -44,12 +57,17 @@ class TestMCPServer(unittest.TestCase):
         tools = response["result"]["tools"]
 
         # 检查工具数量
-        self.assertEqual(len(tools), 2)
+        self.assertEqual(len(tools), 7)
 
         # 检查工具名称
         tool_names = [tool["name"] for tool in tools]
         self.assertIn("detect_carrier", tool_names)
         self.assertIn("batch_detect_carriers", tool_names)
+        self.assertIn("bulk_detect_carriers", tool_names)
+        self.assertIn("find_prefixes", tool_names)
+        self.assertIn("list_prefixes", tool_names)
+        self.assertIn("aggregate_carriers", tool_names)
+        self.assertIn("database_stats", tool_names)
 
         # 检查工具描述
         for tool in tools:
@@ -90,8 +108,8 @@ class TestPhoneDetection(unittest.TestCase):
         self.assertFalse(result["success"])
         self.assertIn("Invalid phone number format", result["error"])
 
-        # 测试包含非数字字符
-        result = detect_carrier("138-1234-5678")
+        # 测试包含无法规范化的非数字字符
+        result = detect_carrier("138-1234-567x")
         self.assertFalse(result["success"])
         self.assertIn("Invalid phone number format", result["error"])
 
@@ -143,6 +161,104 @@ class TestPhoneDetection(unittest.TestCase):
                 self.assertEqual(phone_result["phone_number"], phone_numbers[i])
 
 
+class TestDatabaseBackends(unittest.TestCase):
+    """查询后端一致性测试"""
+
+    SAMPLE_DATABASE = {
+        "1381234": {
+            "province": "江苏",
+            "city": "连云港",
+            "carrier": "China Mobile",
+            "carrier_cn": "移动",
+        },
+        "1331234": {
+            "province": "四川",
+            "city": "成都",
+            "carrier": "China Telecom",
+            "carrier_cn": "电信",
+        },
+    }
+
+    def test_direct_backend_matches_dict(self):
+        """测试直接寻址后端与字典后端结果一致"""
+        phone_numbers = ["13812345678", "13312345678", "18687654321", "123"]
+        backends = [
+            self.SAMPLE_DATABASE,
+            DirectIndexDatabase.from_mapping(self.SAMPLE_DATABASE),
+        ]
+        results = [
+            [detect_carrier(phone, backend) for phone in phone_numbers]
+            for backend in backends
+        ]
+        self.assertEqual(results[0], results[1])
+        self.assertTrue(results[0][0]["success"])
+
+    def test_shared_records_return_independent_results(self):
+        """测试共享结果模板时各次查询结果互不影响"""
+        database = json.loads(
+            json.dumps(self.SAMPLE_DATABASE),
+            object_hook=RecordInterner().object_hook,
+        )
+        first = detect_carrier("13812345678", database)
+        second = detect_carrier("13812340000", database)
+        self.assertEqual(first["phone_number"], "13812345678")
+        self.assertEqual(second["phone_number"], "13812340000")
+        first["city"] = "changed"
+        self.assertEqual(detect_carrier("13812345678", database)["city"], "连云港")
+
+    def test_non_ascii_digits_keep_legacy_behavior(self):
+        """测试规范化后仍非 ASCII 的数字与原正则校验结果一致"""
+        result = detect_carrier("13٨١٢٣٤٥٦٧٨", self.SAMPLE_DATABASE)
+        self.assertFalse(result["success"])
+        self.assertIn("not found", result["error"])
+
+
+class TestNormalization(unittest.TestCase):
+    """号码规范化测试"""
+
+    def test_normalize_phone_number(self):
+        """测试各类常见格式的规范化结果与步骤"""
+        cases = {
+            "+86 138-1234-5678": ("13812345678", ["separators", "country_code"]),
+            "008613812345678": ("13812345678", ["country_code"]),
+            "8613812345678": ("13812345678", ["country_code"]),
+            "１３８１２３４５６７８": ("13812345678", ["fullwidth"]),
+            "＋８６　１３８（１２３４）５６７８": (
+                "13812345678",
+                ["fullwidth", "separators", "country_code"],
+            ),
+            "13812345678\n": ("13812345678", ["separators"]),
+            "86138123456": ("86138123456", []),
+        }
+        for phone, expected in cases.items():
+            self.assertEqual(mcp_server.normalize_phone_number(phone), expected, phone)
+
+    def test_detect_reports_normalization(self):
+        """测试检测结果报告原始输入与规范化步骤"""
+        database = TestDatabaseBackends.SAMPLE_DATABASE
+        result = detect_carrier("+86 138 1234 5678", database)
+        self.assertTrue(result["success"])
+        self.assertEqual(result["phone_number"], "13812345678")
+        self.assertEqual(result["prefix"], "1381234")
+        self.assertEqual(result["input"], "+86 138 1234 5678")
+        self.assertEqual(result["normalization"], ["separators", "country_code"])
+
+        result = detect_carrier("0086 139 1234 5678", database)
+        self.assertFalse(result["success"])
+        self.assertIn("1391234 not found", result["error"])
+        self.assertEqual(result["normalization"], ["separators", "country_code"])
+
+    def test_plain_input_skips_normalization(self):
+        """测试标准号码不经过规范化且结果不含规范化字段"""
+        database = TestDatabaseBackends.SAMPLE_DATABASE
+        with patch.object(mcp_server, "normalize_phone_number") as normalize:
+            result = detect_carrier("13812345678", database)
+            batch = mcp_server.lookup_phone_numbers(["13312345678"], database)
+        normalize.assert_not_called()
+        self.assertNotIn("normalization", result)
+        self.assertNotIn("input", batch[0])
+
+
 class TestRequestHandling(unittest.TestCase):
     """请求处理测试"""
 
@@ -152,8 +268,7 @@ class TestRequestHandling(unittest.TestCase):
     def test_handle_initialize_request(self):
         """测试初始化请求处理"""
         request = {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}}
-        self.server.request_id = request["id"]
-        response = self.server.get_capabilities()
+        response = self.server.get_capabilities(request["id"])
         self.assertEqual(response["jsonrpc"], "2.0")
         self.assertEqual(response["id"], 1)
         self.assertIn("result", response)
@@ -161,8 +276,7 @@ class TestRequestHandling(unittest.TestCase):
     def test_handle_tools_list_request(self):
         """测试工具列表请求处理"""
         request = {"jsonrpc": "2.0", "id": 2, "method": "tools/list", "params": {}}
-        self.server.request_id = request["id"]
-        response = self.server.list_tools()
+        response = self.server.list_tools(request["id"])
         self.assertEqual(response["jsonrpc"], "2.0")
         self.assertEqual(response["id"], 2)
         self.assertIn("result", response)
@@ -193,5 +307,1279 @@ class TestRequestHandling(unittest.TestCase):
         self.assertEqual(response["error"]["code"], -32601)
 
 
+class TestBatchLookup(unittest.TestCase):
+    """向量化批量查询测试"""
+
+    PHONE_NUMBERS = [
+        "13812345678",
+        "13312345678",
+        "18687654321",
+        "13812345678\n",
+        "１３８１２３４５６７８",
+        "1381234567",
+        "138123456789",
+        "23812345678",
+        "12012345678",
+        "138-1234-5678",
+        "",
+        123,
+        None,
+    ] * 30
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def backends(self):
+        sample = TestDatabaseBackends.SAMPLE_DATABASE
+        yield sample
+        yield DirectIndexDatabase.from_mapping(sample)
+        for intervals in (False, True):
+            filename = os.path.join(self.tmpdir.name, f"db{intervals}.bin")
+            with open(filename, "wb") as f:
+                f.write(encode_database(sample, intervals=intervals))
+            yield CompiledPhoneDatabase(filename)
+
+    def expected(self, database):
+        return [
+            (
+                detect_carrier(phone, database)
+                if isinstance(phone, str)
+                else {
+                    "success": False,
+                    "error": f"Invalid phone number type: {type(phone)}",
+                }
+            )
+            for phone in self.PHONE_NUMBERS
+        ]
+
+    def test_batch_matches_single_lookup(self):
+        """测试批量查询与逐个查询结果一致（numpy 与纯 Python 路径）"""
+        for database in self.backends():
+            expected = self.expected(database)
+            with patch.object(phone_index, "NUMPY_MIN_BATCH", 0):
+                vectorized = mcp_server.lookup_phone_numbers(
+                    self.PHONE_NUMBERS, database
+                )
+            with patch.object(phone_index, "np", None):
+                fallback = mcp_server.lookup_phone_numbers(self.PHONE_NUMBERS, database)
+            self.assertEqual(vectorized, expected)
+            self.assertEqual(fallback, expected)
+            self.assertTrue(expected[0]["success"])
+
+
+class CountingDatabase(dict):
+    """记录每个前缀被查询次数的字典后端"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lookups = {}
+
+    def get(self, prefix, default=None):
+        self.lookups[prefix] = self.lookups.get(prefix, 0) + 1
+        return super().get(prefix, default)
+
+
+class TestPrefixGrouping(unittest.TestCase):
+    """批量查询按前缀分组测试"""
+
+    PHONE_NUMBERS = [
+        "13812345678",
+        "13812340000",
+        "13812345678",
+        "+86 138 1234 0001",
+        "13912345678",
+        "13912345678",
+        "13312345678",
+        "123",
+        "123",
+        None,
+    ]
+
+    def test_each_prefix_resolved_once(self):
+        """测试每个不同前缀只查询一次，结果与逐个查询一致"""
+        database = CountingDatabase(TestDatabaseBackends.SAMPLE_DATABASE)
+        stats = {}
+        results = mcp_server.lookup_phone_numbers(self.PHONE_NUMBERS, database, stats)
+        self.assertEqual(database.lookups, {"1381234": 1, "1391234": 1, "1331234": 1})
+        self.assertEqual(stats, {"unique_prefixes": 3, "duplicates": 3, "invalid": 3})
+
+        expected = TestDatabaseBackends.SAMPLE_DATABASE
+        for phone, result in zip(self.PHONE_NUMBERS, results):
+            if isinstance(phone, str):
+                self.assertEqual(result, detect_carrier(phone, expected))
+        self.assertIs(results[0], results[2])
+        self.assertIs(results[4], results[5])
+        self.assertEqual(results[3]["input"], "+86 138 1234 0001")
+
+    def test_grouping_with_numpy(self):
+        """测试 numpy 路径的分组结果与纯 Python 路径一致"""
+        database = TestDatabaseBackends.SAMPLE_DATABASE
+        phone_numbers = self.PHONE_NUMBERS * 30
+        vectorized_stats, fallback_stats = {}, {}
+        with patch.object(phone_index, "NUMPY_MIN_BATCH", 0):
+            vectorized = mcp_server.lookup_phone_numbers(
+                phone_numbers, database, vectorized_stats
+            )
+        with patch.object(phone_index, "np", None):
+            fallback = mcp_server.lookup_phone_numbers(
+                phone_numbers, database, fallback_stats
+            )
+        self.assertEqual(vectorized, fallback)
+        self.assertEqual(vectorized_stats, fallback_stats)
+        # 6 个不同的字符串号码，非字符串输入不计为重复
+        self.assertEqual(vectorized_stats["duplicates"], 9 * 30 - 6)
+
+    def test_batch_summary(self):
+        """测试批量检测结果包含分组摘要"""
+        with patch.object(
+            mcp_server,
+            "get_phone_database",
+            return_value=TestDatabaseBackends.SAMPLE_DATABASE,
+        ):
+            rows = batch_detect_carriers(self.PHONE_NUMBERS)
+            columnar = batch_detect_carriers(self.PHONE_NUMBERS, layout="columnar")
+        self.assertEqual(
+            rows["summary"], {"unique_prefixes": 3, "duplicates": 3, "invalid": 3}
+        )
+        self.assertEqual(columnar["summary"], rows["summary"])
+
+
+class TestFindPrefixes(unittest.TestCase):
+    """按运营商、省份、城市查询前缀区间测试"""
+
+    DATABASE = {
+        f"13{i:05d}": {
+            "province": "四川",
+            "city": "成都" if i % 20 < 10 else "绵阳",
+            "carrier": "China Telecom",
+            "carrier_cn": "电信",
+        }
+        for i in range(100)
+    }
+    DATABASE.update(TestDatabaseBackends.SAMPLE_DATABASE)
+
+    def setUp(self):
+        database = self.database = self.DATABASE
+        patcher = patch.object(mcp_server, "get_phone_database", return_value=database)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_paginates_ranges(self):
+        """测试分页遍历所有区间"""
+        ranges, cursor = [], None
+        while True:
+            page = mcp_server.find_prefixes(
+                carrier="电信", city="成都", cursor=cursor, limit=2
+            )
+            self.assertTrue(page["success"])
+            self.assertLessEqual(len(page["ranges"]), 2)
+            ranges.extend(page["ranges"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        # 5 个模拟区间加上样例中的 1331234
+        self.assertEqual(page["total_ranges"], 6)
+        self.assertEqual(page["total_prefixes"], 51)
+        self.assertEqual(len(ranges), 6)
+        self.assertEqual(ranges[0]["first"], "1300000")
+        self.assertEqual(ranges[0]["last"], "1300009")
+        self.assertEqual(ranges[1]["first"], "1300020")
+        expected = sorted(
+            prefix for prefix, info in self.database.items() if info["city"] == "成都"
+        )
+        found = [
+            str(prefix)
+            for entry in ranges
+            for prefix in range(int(entry["first"]), int(entry["last"]) + 1)
+        ]
+        self.assertEqual(found, expected)
+
+    def test_query_by_province(self):
+        """测试按省份查询包含不同城市的区间"""
+        result = mcp_server.find_prefixes(province="四川")
+        self.assertEqual(result["total_prefixes"], 101)
+        self.assertEqual(len(result["ranges"]), 11)
+        self.assertIsNone(result["next_cursor"])
+        self.assertEqual(result["query"], {"province": "四川"})
+        self.assertEqual(mcp_server.find_prefixes(city="北京")["total_ranges"], 0)
+
+    def test_invalid_arguments(self):
+        """测试缺少查询条件与无效的分页参数"""
+        self.assertFalse(mcp_server.find_prefixes()["success"])
+        self.assertFalse(mcp_server.find_prefixes(city="成都", cursor="abc")["success"])
+        self.assertFalse(mcp_server.find_prefixes(city="成都", limit=0)["success"])
+
+    def test_call_tool(self):
+        """测试通过 MCP 工具调用查询"""
+        response = MCPServer().call_tool(
+            "find_prefixes", {"carrier": "China Mobile", "format": "compact"}
+        )
+        data = json.loads(response["result"]["content"][0]["text"])
+        self.assertEqual(data["ranges"][0]["first"], "1381234")
+        self.assertEqual(data["ranges"][0]["city"], "连云港")
+
+
+class TestListPrefixes(unittest.TestCase):
+    """按号段或前缀范围列出已分配前缀测试"""
+
+    def setUp(self):
+        self.database = dict(TestFindPrefixes.DATABASE)
+        patcher = patch.object(
+            mcp_server, "get_phone_database", return_value=self.database
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_segment_pages(self):
+        """测试分页遍历号段内的所有前缀"""
+        prefixes, cursor = [], None
+        while True:
+            page = mcp_server.list_prefixes(segment="130", cursor=cursor, limit=7)
+            self.assertTrue(page["success"])
+            self.assertLessEqual(len(page["prefixes"]), 7)
+            prefixes.extend(page["prefixes"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(page["first"], "1300000")
+        self.assertEqual(page["last"], "1309999")
+        self.assertEqual(page["total"], 100)
+        self.assertEqual(
+            [entry["prefix"] for entry in prefixes],
+            sorted(prefix for prefix in self.database if prefix.startswith("130")),
+        )
+        self.assertEqual(prefixes[10]["city"], "绵阳")
+        self.assertEqual(prefixes[10]["carrier_cn"], "电信")
+
+    def test_prefix_range(self):
+        """测试闭区间范围、单个前缀与空号段"""
+        result = mcp_server.list_prefixes(start="1300095", end="1381234")
+        self.assertEqual(
+            [entry["prefix"] for entry in result["prefixes"]],
+            [f"13000{i}" for i in range(95, 100)] + ["1331234", "1381234"],
+        )
+        self.assertEqual(result["total"], 7)
+        single = mcp_server.list_prefixes(start="1381234")
+        self.assertEqual(single["prefixes"][0]["city"], "连云港")
+        self.assertEqual(mcp_server.list_prefixes(segment="192")["total"], 0)
+        self.assertEqual(mcp_server.list_prefixes(segment="1381")["total"], 1)
+
+    def test_invalid_arguments(self):
+        """测试无效号段、前缀与分页参数"""
+        for kwargs in (
+            {},
+            {"segment": "19a"},
+            {"segment": ""},
+            {"start": "138123"},
+            {"start": "1381234", "end": "1300000"},
+            {"segment": "138", "cursor": "x"},
+            {"segment": "138", "limit": 0},
+        ):
+            with self.subTest(kwargs=kwargs):
+                self.assertFalse(mcp_server.list_prefixes(**kwargs)["success"])
+
+    def test_call_tool(self):
+        """测试通过 MCP 工具调用查询"""
+        response = MCPServer().call_tool(
+            "list_prefixes", {"segment": "138", "format": "compact"}
+        )
+        data = json.loads(response["result"]["content"][0]["text"])
+        self.assertEqual(data["prefixes"][0]["prefix"], "1381234")
+        self.assertIsNone(data["next_cursor"])
+
+
+class TestResponseRendering(unittest.TestCase):
+    """工具响应渲染测试"""
+
+    def setUp(self):
+        self.database = TestDatabaseBackends.SAMPLE_DATABASE
+        self.results = mcp_server.lookup_phone_numbers(
+            ["13812345678", "13312345678", "13812340000", "+86 13812345678", "1"],
+            self.database,
+        )
+
+    def test_renderers_match_json_dumps(self):
+        """测试各格式渲染结果与 json.dumps 逐字节一致"""
+        payloads = [
+            self.results[0],
+            {"success": True, "results": self.results, "total": len(self.results)},
+            {"success": True, "results": [], "total": 0, "extra": {"a": [1, 2.5]}},
+            {"success": False, "error": 'bad "input"\n'},
+            mcp_server.columnar_results([None] * len(self.results), self.results),
+        ]
+        renderers = mcp_server.RESPONSE_RENDERERS
+        for payload in payloads:
+            self.assertEqual(
+                renderers["pretty"].render(payload),
+                json.dumps(payload, ensure_ascii=False, indent=2),
+            )
+            self.assertEqual(
+                renderers["compact"].render(payload),
+                json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+            )
+            self.assertEqual(
+                mcp_server.JSONL_RENDERER.render(payload),
+                json.dumps(payload, ensure_ascii=False),
+            )
+
+    def test_region_fragments_are_cached(self):
+        """测试相同归属地在同一层级共享片段"""
+        renderer = mcp_server.ResultRenderer(indent=2)
+        renderer.render(self.results[0])
+        renderer.render(self.results[2])
+        self.assertEqual(len(renderer._fragments), 1)
+        renderer.render([self.results[0]])
+        self.assertEqual(len(renderer._fragments), 2)
+
+    def test_call_tool_format_argument(self):
+        """测试工具调用的 format 参数"""
+        server = MCPServer()
+        database = patch.object(
+            mcp_server, "get_phone_database", return_value=self.database
+        )
+        with database:
+            pretty = server.call_tool("detect_carrier", {"phone_number": "13812345678"})
+            compact = server.call_tool(
+                "batch_detect_carriers",
+                {"phone_numbers": ["13812345678"], "format": "compact"},
+            )
+            invalid = server.call_tool(
+                "detect_carrier", {"phone_number": "13812345678", "format": "xml"}
+            )
+        pretty_text = pretty["result"]["content"][0]["text"]
+        self.assertIn("\n  ", pretty_text)
+        self.assertEqual(json.loads(pretty_text), self.results[0])
+        compact_text = compact["result"]["content"][0]["text"]
+        self.assertNotIn("\n", compact_text)
+        self.assertNotIn('", "', compact_text)
+        self.assertEqual(json.loads(compact_text)["results"][0], self.results[0])
+        self.assertEqual(invalid["error"]["code"], -32602)
+
+        server = MCPServer(response_format="compact")
+        with database:
+            response = server.call_tool(
+                "detect_carrier", {"phone_number": "13812345678"}
+            )
+        self.assertNotIn("\n", response["result"]["content"][0]["text"])
+
+    def test_encode_message(self):
+        """测试响应信封编码为单行 UTF-8 且不转义中文"""
+        line = mcp_server.encode_message({"id": 1, "text": "移动\n"})
+        self.assertTrue(line.endswith(b"\n"))
+        self.assertEqual(line.count(b"\n"), 1)
+        self.assertIn("移动".encode(), line)
+        self.assertEqual(json.loads(line), {"id": 1, "text": "移动\n"})
+
+        # 单独的代理字符无法编码为 UTF-8，退回转义编码
+        line = mcp_server.encode_message({"id": 1, "text": "\ud800移动"})
+        self.assertTrue(line.isascii())
+        self.assertEqual(json.loads(line), {"id": 1, "text": "\ud800移动"})
+
+
+class TestColumnarLayout(unittest.TestCase):
+    """列式批量结果测试"""
+
+    PHONE_NUMBERS = [
+        "13812345678",
+        "13812340000",
+        "13312345678",
+        "+86 138 1234 5678",
+        "18687654321",
+        "123",
+        None,
+    ]
+
+    def setUp(self):
+        patcher = patch.object(
+            mcp_server,
+            "get_phone_database",
+            return_value=TestDatabaseBackends.SAMPLE_DATABASE,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def decode(columnar):
+        """按列式布局还原逐条结果"""
+        rows = []
+        for i in range(columnar["total"]):
+            row = {"phone_number": columnar["phone_number"][i]}
+            if columnar["region"][i] is None:
+                row["error"] = columnar["errors"][columnar["error"][i]]
+            else:
+                region = columnar["regions"][columnar["region"][i]]
+                row.update(zip(columnar["region_fields"], region))
+                row["prefix"] = columnar["prefix"][i]
+            rows.append(row)
+        return rows
+
+    def test_round_trip(self):
+        """测试列式结果可还原为逐条结果"""
+        rows = batch_detect_carriers(self.PHONE_NUMBERS)["results"]
+        columnar = batch_detect_carriers(self.PHONE_NUMBERS, layout="columnar")
+        self.assertEqual(columnar["layout"], "columnar")
+        self.assertEqual(len(columnar["regions"]), 2)
+        self.assertEqual(columnar["region"][:4], [0, 0, 1, 0])
+        self.assertEqual(
+            columnar["normalization"],
+            [None, None, None, ["separators", "country_code"], None, None, None],
+        )
+        for phone, row, decoded in zip(self.PHONE_NUMBERS, rows, self.decode(columnar)):
+            expected = {key: row[key] for key in decoded if key in row}
+            expected.setdefault("phone_number", phone)
+            self.assertEqual(decoded, expected)
+
+    def test_repeated_prefixes_shrink_response(self):
+        """测试重复归属地的批量结果体积显著减小"""
+        phone_numbers = [f"1381234{i:04d}" for i in range(100)]
+        renderer = mcp_server.RESPONSE_RENDERERS["compact"]
+        rows = renderer.render(batch_detect_carriers(phone_numbers))
+        columnar = renderer.render(
+            batch_detect_carriers(phone_numbers, layout="columnar")
+        )
+        self.assertLess(len(columnar.encode()) * 3, len(rows.encode()))
+
+    def test_invalid_layout(self):
+        """测试无效的布局参数"""
+        result = batch_detect_carriers(["13812345678"], layout="table")
+        self.assertFalse(result["success"])
+        self.assertIn("Invalid layout", result["error"])
+
+
+class TestAggregation(unittest.TestCase):
+    """运营商与归属地分布统计测试"""
+
+    PHONE_NUMBERS = TestBatchLookup.PHONE_NUMBERS + ["13٨١٢٣٤٥٦٧٨"]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def expected(self, database):
+        """由逐条结果统计得到的分布"""
+        carriers, provinces, cities = {}, {}, {}
+        invalid = dict.fromkeys(mcp_server.INVALID_REASONS, 0)
+        for phone in self.PHONE_NUMBERS:
+            if not isinstance(phone, str):
+                invalid["invalid_type"] += 1
+                continue
+            result = detect_carrier(phone, database)
+            if result["success"]:
+                for counter, key in (
+                    (carriers, (result["carrier"], result["carrier_cn"])),
+                    (provinces, (result["province"],)),
+                    (cities, (result["province"], result["city"])),
+                ):
+                    counter[key] = counter.get(key, 0) + 1
+            elif "not found" in result["error"]:
+                invalid["prefix_not_found"] += 1
+            else:
+                invalid["invalid_format"] += 1
+        return {
+            "carriers": mcp_server.ranked(carriers, ("carrier", "carrier_cn")),
+            "provinces": mcp_server.ranked(provinces, ("province",)),
+            "cities": mcp_server.ranked(cities, ("province", "city")),
+            "invalid": invalid,
+        }
+
+    def test_matches_per_number_results(self):
+        """测试各后端、numpy 与纯 Python 路径的统计与逐条结果一致"""
+        for database in TestBatchLookup.backends(self):
+            expected = self.expected(database)
+            with patch.object(mcp_server, "get_phone_database", return_value=database):
+                with patch.object(phone_index, "NUMPY_MIN_BATCH", 0):
+                    vectorized = mcp_server.aggregate_carriers(
+                        self.PHONE_NUMBERS, chunk_size=100
+                    )
+                with patch.object(phone_index, "np", None):
+                    fallback = mcp_server.aggregate_carriers(self.PHONE_NUMBERS)
+            self.assertEqual(vectorized, fallback)
+            self.assertEqual(json.loads(json.dumps(vectorized)), vectorized)
+            for key, value in expected.items():
+                self.assertEqual(vectorized[key], value, key)
+            self.assertEqual(vectorized["total"], len(self.PHONE_NUMBERS))
+            self.assertEqual(vectorized["failed"], sum(expected["invalid"].values()))
+            self.assertEqual(vectorized["normalized"], 90)
+
+        self.assertEqual(
+            vectorized["carriers"][0],
+            {"carrier": "China Mobile", "carrier_cn": "移动", "count": 120},
+        )
+        self.assertEqual(vectorized["invalid"]["invalid_type"], 60)
+
+    def test_file_input_and_tool_call(self):
+        """测试从文件流式读取统计以及通过 MCP 工具调用"""
+        input_file = os.path.join(self.tmpdir.name, "numbers.txt")
+        with open(input_file, "w", encoding="utf-8") as f:
+            f.write("13812345678\n13312345678\n123\n\n" * 100)
+        notifications = []
+        server = MCPServer()
+        server.notify = notifications.append
+        with patch.object(
+            mcp_server,
+            "get_phone_database",
+            return_value=TestDatabaseBackends.SAMPLE_DATABASE,
+        ), patch.object(mcp_server, "BULK_FILE_DIR", self.tmpdir.name):
+            response = server.call_tool(
+                "aggregate_carriers",
+                {"input_file": input_file, "chunk_size": 100},
+                progress_token="aggregate-1",
+            )
+            missing = server.call_tool("aggregate_carriers", {})
+        data = json.loads(response["result"]["content"][0]["text"])
+        self.assertEqual(data["total"], 300)
+        self.assertEqual(data["succeeded"], 200)
+        self.assertEqual(data["invalid"]["invalid_format"], 100)
+        self.assertEqual(
+            data["cities"],
+            [
+                {"province": "四川", "city": "成都", "count": 100},
+                {"province": "江苏", "city": "连云港", "count": 100},
+            ],
+        )
+        self.assertNotIn("results", data)
+        self.assertEqual(len(notifications), 3)
+        self.assertEqual(missing["error"]["code"], -32602)
+        self.assertFalse(mcp_server.aggregate_carriers(["1"], chunk_size=0)["success"])
+
+
+class TestDatabaseStatistics(unittest.TestCase):
+    """数据库前缀分布测试"""
+
+    def test_statistics(self):
+        """测试按运营商、省份、城市汇总以及 top 限制"""
+        with patch.object(
+            mcp_server, "get_phone_database", return_value=TestFindPrefixes.DATABASE
+        ):
+            result = mcp_server.database_statistics()
+            top = MCPServer().call_tool("database_stats", {"top": 1})
+            invalid = mcp_server.database_statistics(top=0)
+        self.assertEqual(result["records"], 102)
+        self.assertEqual(result["regions"], 3)
+        self.assertEqual(
+            result["carriers"],
+            [
+                {"carrier": "China Telecom", "carrier_cn": "电信", "count": 101},
+                {"carrier": "China Mobile", "carrier_cn": "移动", "count": 1},
+            ],
+        )
+        self.assertEqual(result["provinces"][0], {"province": "四川", "count": 101})
+        self.assertEqual(
+            result["cities"][0], {"province": "四川", "city": "成都", "count": 51}
+        )
+        data = json.loads(top["result"]["content"][0]["text"])
+        self.assertEqual(len(data["cities"]), 1)
+        self.assertEqual(len(data["carriers"]), 2)
+        self.assertFalse(invalid["success"])
+
+
+class TestBulkDetection(unittest.TestCase):
+    """流式批量检测测试"""
+
+    def setUp(self):
+        self.server = MCPServer()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        ready = threading.Event()
+        ready.set()
+        patchers = [
+            patch.object(mcp_server, "DATABASE_READY", ready),
+            patch.object(
+                mcp_server, "PHONE_DATABASE", TestDatabaseBackends.SAMPLE_DATABASE
+            ),
+            patch.object(mcp_server, "BULK_FILE_DIR", self.tmpdir.name),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_file_to_jsonl(self):
+        """测试从文件读取并逐行写出 JSONL 结果"""
+        input_file = os.path.join(self.tmpdir.name, "numbers.txt")
+        output_file = os.path.join(self.tmpdir.name, "results.jsonl")
+        with open(input_file, "w", encoding="utf-8") as f:
+            f.write("13812345678\n\n13312345678\n123\n" * 250)
+
+        result = mcp_server.bulk_detect_carriers(
+            input_file=input_file, output_file=output_file, chunk_size=64
+        )
+
+        self.assertTrue(result["success"])
+        self.assertEqual(result["total"], 750)
+        self.assertEqual(result["succeeded"], 500)
+        self.assertEqual(result["failed"], 250)
+        self.assertNotIn("results", result)
+        with open(output_file, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 750)
+        self.assertEqual(rows[0]["city"], "连云港")
+        self.assertNotIn("phone_number", rows[2])
+        self.assertFalse(rows[2]["success"])
+
+    def test_file_paths_confined(self):
+        """测试输入输出文件只能位于 PHONE_BULK_DIR 下"""
+        outside = tempfile.TemporaryDirectory()
+        self.addCleanup(outside.cleanup)
+        secret = os.path.join(outside.name, "secret.txt")
+        with open(secret, "w", encoding="utf-8") as f:
+            f.write("root:x:0:0:root:/root:/bin/bash\n")
+        os.symlink(secret, os.path.join(self.tmpdir.name, "link.txt"))
+
+        for path in (secret, "../secret.txt", "link.txt", "."):
+            result = mcp_server.bulk_detect_carriers(
+                input_file=path, output_file="results.jsonl"
+            )
+            self.assertFalse(result["success"], path)
+            result = mcp_server.aggregate_carriers(input_file=path)
+            self.assertFalse(result["success"], path)
+        result = mcp_server.bulk_detect_carriers(["123"], output_file=secret)
+        self.assertFalse(result["success"])
+        with open(secret, "r", encoding="utf-8") as f:
+            self.assertTrue(f.read())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmpdir.name, "results.jsonl"))
+        )
+
+        # 相对路径相对于 PHONE_BULK_DIR
+        with open(
+            os.path.join(self.tmpdir.name, "numbers.txt"), "w", encoding="utf-8"
+        ) as f:
+            f.write("13812345678\n")
+        result = mcp_server.bulk_detect_carriers(
+            input_file="numbers.txt", output_file="results.jsonl"
+        )
+        self.assertEqual(result["succeeded"], 1)
+
+        with patch.object(mcp_server, "BULK_FILE_DIR", None):
+            result = mcp_server.bulk_detect_carriers(
+                input_file="numbers.txt", output_file="results.jsonl"
+            )
+        self.assertIn("PHONE_BULK_DIR", result["error"])
+
+    def test_file_input_requires_output_file(self):
+        """测试从文件读取时必须写出到文件，参数中的无效号码仍然回显"""
+        input_file = os.path.join(self.tmpdir.name, "numbers.txt")
+        output_file = os.path.join(self.tmpdir.name, "results.jsonl")
+        with open(input_file, "w", encoding="utf-8") as f:
+            f.write("13812345678\nroot:x:0:0\n")
+
+        result = mcp_server.bulk_detect_carriers(input_file=input_file)
+        self.assertFalse(result["success"])
+        self.assertIn("output_file", result["error"])
+
+        result = mcp_server.bulk_detect_carriers(
+            ["bad"], input_file=input_file, output_file=output_file
+        )
+        self.assertEqual(result["failed"], 2)
+        with open(output_file, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0]["phone_number"], "bad")
+        self.assertEqual(rows[1]["phone_number"], "13812345678")
+        self.assertNotIn("phone_number", rows[2])
+        self.assertNotIn("root", json.dumps(rows))
+
+    def test_csv_output(self):
+        """测试 CSV 输出"""
+        output_file = os.path.join(self.tmpdir.name, "results.csv")
+        result = mcp_server.bulk_detect_carriers(
+            ["13812345678", "18687654321"],
+            output_file=output_file,
+            output_format="csv",
+        )
+        self.assertTrue(result["success"])
+        with open(output_file, "r", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0]["province"], "江苏")
+        self.assertEqual(rows[1]["success"], "False")
+        self.assertIn("not found", rows[1]["error"])
+
+    def test_chunked_arguments_with_progress(self):
+        """测试分块参数输入与进度通知"""
+        notifications = []
+        self.server.notify = notifications.append
+        chunks = [["13812345678"] * 100, ["13312345678"] * 100, ["123"] * 50]
+
+        response = self.server.call_tool(
+            "bulk_detect_carriers",
+            {"phone_numbers": chunks, "chunk_size": 100},
+            progress_token="bulk-1",
+        )
+
+        data = json.loads(response["result"]["content"][0]["text"])
+        self.assertEqual(data["total"], 250)
+        self.assertEqual(len(data["results"]), 250)
+        self.assertEqual(
+            [n["params"]["progress"] for n in notifications], [100, 200, 250]
+        )
+        for notification in notifications:
+            self.assertEqual(notification["method"], "notifications/progress")
+            self.assertEqual(notification["params"]["progressToken"], "bulk-1")
+            self.assertEqual(notification["params"]["total"], 250)
+
+    def test_missing_input(self):
+        """测试缺少输入参数"""
+        response = self.server.call_tool("bulk_detect_carriers", {})
+        self.assertEqual(response["error"]["code"], -32602)
+
+        result = mcp_server.bulk_detect_carriers(
+            input_file=os.path.join(self.tmpdir.name, "missing.txt")
+        )
+        self.assertFalse(result["success"])
+
+
+class TestBackgroundLoading(unittest.TestCase):
+    """后台加载数据库测试"""
+
+    def setUp(self):
+        self.server = MCPServer()
+        self.ready = threading.Event()
+        patchers = [
+            patch.object(mcp_server, "DATABASE_READY", self.ready),
+            patch.object(mcp_server, "start_database_loading"),
+            patch.object(
+                mcp_server, "PHONE_DATABASE", TestDatabaseBackends.SAMPLE_DATABASE
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_handshake_does_not_wait(self):
+        """测试数据库未就绪时握手请求立即响应"""
+        for request_id, method in enumerate(["initialize", "tools/list"], 1):
+            request = {"jsonrpc": "2.0", "id": request_id, "method": method}
+            response = asyncio.run(self.server.handle_request(request))
+            self.assertEqual(response["id"], request_id)
+            self.assertIn("result", response)
+
+    def test_database_status(self):
+        """测试数据库状态包含就绪标志与加载耗时"""
+        request = {"jsonrpc": "2.0", "id": 7, "method": "database/status"}
+        response = asyncio.run(self.server.handle_request(request))
+        self.assertEqual(response["id"], 7)
+        self.assertIn("ready", response["result"])
+        self.assertIn("load_seconds", response["result"])
+
+    def test_tool_call_waits_for_database(self):
+        """测试工具调用等待数据库就绪后再执行"""
+        request = {
+            "jsonrpc": "2.0",
+            "id": 8,
+            "method": "tools/call",
+            "params": {
+                "name": "detect_carrier",
+                "arguments": {"phone_number": "13812345678"},
+            },
+        }
+
+        async def run_test():
+            task = asyncio.ensure_future(self.server.handle_request(request))
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            self.ready.set()
+            return await asyncio.wait_for(task, timeout=5)
+
+        response = asyncio.run(run_test())
+        self.assertEqual(response["id"], 8)
+        data = json.loads(response["result"]["content"][0]["text"])
+        self.assertTrue(data["success"])
+        self.assertEqual(data["city"], "连云港")
+
+
+class TestHotReload(unittest.TestCase):
+    """数据库热加载测试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.compiled_file = os.path.join(self.tmpdir.name, "phone_database.bin")
+        ready = threading.Event()
+        ready.set()
+        patchers = [
+            patch.object(mcp_server, "COMPILED_DATABASE_FILE", self.compiled_file),
+            patch.object(mcp_server, "INTERVAL_DATABASE_FILE", self.compiled_file),
+            patch.object(mcp_server, "SHARD_DIRECTORY", self.tmpdir.name),
+            patch.object(mcp_server, "DATABASE_BACKEND", "auto"),
+            patch.object(mcp_server, "DATABASE_READY", ready),
+            patch.object(mcp_server, "PHONE_DATABASE", {}),
+            patch.object(
+                mcp_server, "DATABASE_STATUS", dict(mcp_server.DATABASE_STATUS)
+            ),
+            patch("builtins.print"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_database(self, city):
+        database = {
+            "1381234": {
+                "province": "江苏",
+                "city": city,
+                "carrier": "China Mobile",
+                "carrier_cn": "移动",
+            }
+        }
+        tmp_file = self.compiled_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(encode_database(database))
+        os.replace(tmp_file, self.compiled_file)
+
+    def test_reload_swaps_database(self):
+        """测试新版本数据库被原子替换，旧快照保持一致"""
+        self.write_database("连云港")
+        self.assertTrue(mcp_server.reload_phone_database())
+        snapshot = mcp_server.get_phone_database()
+        self.assertEqual(detect_carrier("13812345678")["city"], "连云港")
+
+        self.write_database("南京")
+        signature = mcp_server.database_signature()
+        self.assertNotEqual(signature, mcp_server._loaded_signature)
+        self.assertTrue(mcp_server.reload_phone_database())
+        self.assertEqual(signature, mcp_server._loaded_signature)
+
+        self.assertEqual(detect_carrier("13812345678")["city"], "南京")
+        self.assertEqual(detect_carrier("13812345678", snapshot)["city"], "连云港")
+        self.assertEqual(mcp_server.find_prefixes(city="南京")["total_prefixes"], 1)
+        self.assertEqual(mcp_server.find_prefixes(city="连云港")["total_prefixes"], 0)
+        self.assertEqual(
+            mcp_server.database_statistics()["cities"],
+            [{"province": "江苏", "city": "南京", "count": 1}],
+        )
+        self.assertEqual(mcp_server.DATABASE_STATUS["reloads"], 2)
+        self.assertEqual(mcp_server.DATABASE_STATUS["records"], 1)
+
+    def test_failed_reload_keeps_database(self):
+        """测试加载失败时保留当前数据库"""
+        self.write_database("连云港")
+        mcp_server.reload_phone_database()
+        with patch.object(
+            mcp_server, "load_phone_database", side_effect=ValueError("broken")
+        ):
+            self.assertFalse(mcp_server.reload_phone_database())
+        self.assertEqual(detect_carrier("13812345678")["city"], "连云港")
+        self.assertEqual(mcp_server.DATABASE_STATUS["last_reload_error"], "broken")
+
+    def test_sharded_stats_are_lazy(self):
+        """测试旧版 manifest 没有计数时，加载与热加载不会读取全部分片"""
+        from parse_phone_data import save_sharded_database
+
+        sample = TestDatabaseBackends.SAMPLE_DATABASE
+        with patch.object(mcp_server, "DATABASE_BACKEND", "sharded"):
+            save_sharded_database(sample, self.tmpdir.name)
+            mcp_server._load_database_in_background()
+            self.assertEqual(mcp_server.PHONE_DATABASE.loaded_segments(), [])
+            self.assertTrue(mcp_server.reload_phone_database())
+            database = mcp_server.get_phone_database()
+            self.assertEqual(database.loaded_segments(), [])
+
+            stats = mcp_server.database_statistics()
+        self.assertEqual(stats["records"], len(database))
+        self.assertGreater(len(database.loaded_segments()), 0)
+
+    def test_missing_files_keep_database(self):
+        """测试数据库文件被删除时重新加载不会替换为空数据库"""
+        self.write_database("连云港")
+        mcp_server.reload_phone_database()
+        os.remove(self.compiled_file)
+        missing = os.path.join(self.tmpdir.name, "missing.json")
+        with patch.object(mcp_server, "DATABASE_FILE", missing):
+            self.assertFalse(mcp_server.reload_phone_database())
+        self.assertEqual(detect_carrier("13812345678")["city"], "连云港")
+        self.assertEqual(mcp_server.DATABASE_STATUS["records"], 1)
+        self.assertEqual(mcp_server.DATABASE_STATUS["reloads"], 1)
+
+
+class TestMessageWriter(unittest.TestCase):
+    """合并写出与背压测试"""
+
+    class FakeStreamWriter:
+        """记录每次写入，drain 在放行前一直等待"""
+
+        def __init__(self):
+            self.chunks = []
+            self.released = asyncio.Event()
+            self.released.set()
+
+        def write(self, data):
+            self.chunks.append(data)
+
+        async def drain(self):
+            await self.released.wait()
+
+        def close(self):
+            pass
+
+    def test_coalesces_ready_messages(self):
+        """测试同一轮事件循环中就绪的消息合并为一次写入"""
+        stream = self.FakeStreamWriter()
+
+        async def run():
+            writer = mcp_server.MessageWriter(stream)
+            await asyncio.gather(*(writer.write({"id": i}) for i in range(5)))
+            await asyncio.sleep(0)
+            writer.send({"id": 5})
+            await writer.close()
+
+        asyncio.run(run())
+        self.assertEqual(len(stream.chunks), 2)
+        lines = b"".join(stream.chunks).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], list(range(6)))
+
+    def test_backpressure_suspends_writer_only(self):
+        """测试客户端读取缓慢时 write 等待，事件循环继续运行"""
+        stream = self.FakeStreamWriter()
+        stream.released.clear()
+        ticks = []
+
+        async def run():
+            writer = mcp_server.MessageWriter(stream)
+            pending = asyncio.ensure_future(writer.write({"id": 1}))
+            for i in range(3):
+                await asyncio.sleep(0)
+                ticks.append(i)
+            self.assertFalse(pending.done())
+            stream.released.set()
+            await pending
+
+        asyncio.run(run())
+        self.assertEqual(ticks, [0, 1, 2])
+        self.assertEqual(stream.chunks, [b'{"id":1}\n'])
+
+    def test_pipe_transport(self):
+        """测试通过管道传输写出超过管道缓冲的大量消息"""
+        read_fd, write_fd = os.pipe()
+        message = {"id": 1, "text": "号码" * 50000}
+        received = []
+
+        def drain_pipe():
+            with os.fdopen(read_fd, "rb") as pipe:
+                time.sleep(0.1)
+                received.append(pipe.read())
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            with os.fdopen(write_fd, "wb", buffering=0) as pipe:
+                transport, protocol = await loop.connect_write_pipe(
+                    asyncio.streams.FlowControlMixin, pipe
+                )
+                writer = mcp_server.MessageWriter(
+                    asyncio.StreamWriter(transport, protocol, None, loop)
+                )
+                for _ in range(5):
+                    await writer.write(message)
+                await writer.close()
+
+        reader = threading.Thread(target=drain_pipe)
+        reader.start()
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+        reader.join(5)
+        lines = received[0].splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[-1]), message)
+
+
+class TestServeLoop(unittest.TestCase):
+    """标准输入输出请求循环测试"""
+
+    def serve(self, requests, limit=mcp_server.MAX_CONCURRENT_REQUESTS, on_write=None):
+        """把请求逐行送入 serve，按写出顺序返回响应与进度通知"""
+        written = []
+
+        def send(message):
+            written.append(message)
+            if on_write is not None:
+                on_write(message)
+
+        async def write(message):
+            # 与 MessageWriter 一样先编码，编码失败的响应不会被写出
+            send(json.loads(mcp_server.encode_message(message)))
+
+        async def run():
+            reader = asyncio.StreamReader(limit=mcp_server.MAX_MESSAGE_BYTES)
+            for request in requests:
+                if isinstance(request, bytes):
+                    line = request
+                elif isinstance(request, str):
+                    line = request.encode()
+                else:
+                    line = json.dumps(request).encode()
+                reader.feed_data(line + b"\n")
+            reader.feed_eof()
+            server = MCPServer()
+            server.notify = mcp_server.loop_notifier(asyncio.get_running_loop(), send)
+            await mcp_server.serve(server, reader, write, limit)
+
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+        return written
+
+    @staticmethod
+    def call(request_id, name="database_stats"):
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": "tools/call",
+            "params": {"name": name, "arguments": {}},
+        }
+
+    def test_slow_request_does_not_block_later_ones(self):
+        """测试耗时请求处理期间，后面的请求先完成并写出"""
+        gate = threading.Event()
+
+        def slow(top=None):
+            gate.wait(5)
+            return {"success": True}
+
+        def on_write(message):
+            if message["id"] == 2:
+                gate.set()
+
+        with patch.object(mcp_server, "database_statistics", side_effect=slow):
+            written = self.serve(
+                [
+                    self.call(1),
+                    {"jsonrpc": "2.0", "id": 2, "method": "initialize"},
+                    "not json",
+                ],
+                on_write=on_write,
+            )
+        by_id = {message["id"]: message for message in written}
+        self.assertEqual(written[0]["id"], 2)
+        self.assertEqual(len(written), 3)
+        self.assertIn("result", by_id[1])
+        self.assertEqual(by_id[None]["error"]["code"], -32700)
+
+    def test_concurrency_limit(self):
+        """测试同时处理的请求数不超过上限"""
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def tracked(top=None):
+            with lock:
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return {"success": True}
+
+        with patch.object(mcp_server, "database_statistics", side_effect=tracked):
+            written = self.serve([self.call(i) for i in range(12)], limit=2)
+        self.assertEqual(sorted(message["id"] for message in written), list(range(12)))
+        self.assertLessEqual(active[1], 2)
+
+    def test_undecodable_lines(self):
+        """测试无效 UTF-8 与嵌套过深的数组返回解析错误，之后继续服务"""
+        written = self.serve(
+            [
+                b'{"jsonrpc": "2.0", "id": "\xff", "method": "tools/list"}',
+                "[" * 100000 + "]" * 100000,
+                {"jsonrpc": "2.0", "id": 3, "method": "tools/list"},
+            ]
+        )
+        errors = [message for message in written if message["id"] is None]
+        self.assertEqual([error["error"]["code"] for error in errors], [-32700] * 2)
+        self.assertIn("tools", next(m for m in written if m["id"] == 3)["result"])
+
+    def test_lone_surrogates_echoed(self):
+        """测试回显请求中单独代理字符的响应仍能写出"""
+        bulk = {
+            "jsonrpc": "2.0",
+            "id": 2,
+            "method": "tools/call",
+            "params": {
+                "name": "bulk_detect_carriers",
+                "arguments": {"phone_numbers": ["\ud800"]},
+            },
+        }
+        written = self.serve([self.call(1, "\ud800x"), bulk])
+        responses = {message["id"]: message for message in written}
+        self.assertIn("\ud800x", responses[1]["error"]["message"])
+        text = responses[2]["result"]["content"][0]["text"]
+        self.assertEqual(json.loads(text)["results"][0]["phone_number"], "\ud800")
+
+    def test_failed_task_still_responds(self):
+        """测试处理一行请求时出现未预期异常，客户端仍收到错误响应"""
+        with patch.object(
+            mcp_server, "process_request", side_effect=RuntimeError("boom")
+        ):
+            written = self.serve([{"jsonrpc": "2.0", "id": 1, "method": "tools/list"}])
+        self.assertEqual(written[0]["error"]["code"], -32603)
+        self.assertIn("boom", written[0]["error"]["message"])
+
+    def test_unwritable_response_becomes_error(self):
+        """测试响应无法写出时返回同一 id 的错误，批量响应逐项替换"""
+        unwritable = {"jsonrpc": "2.0", "id": 1, "result": object()}
+
+        async def process(server, request):
+            return dict(unwritable, id=request["id"])
+
+        with patch.object(mcp_server, "process_request", side_effect=process):
+            written = self.serve(
+                [
+                    {"jsonrpc": "2.0", "id": 1, "method": "tools/list"},
+                    [{"jsonrpc": "2.0", "id": "b", "method": "tools/list"}],
+                ]
+            )
+        single = next(message for message in written if isinstance(message, dict))
+        batch = next(message for message in written if isinstance(message, list))
+        self.assertEqual(single["id"], 1)
+        self.assertEqual(single["error"]["code"], -32603)
+        self.assertEqual([item["id"] for item in batch], ["b"])
+        self.assertEqual(batch[0]["error"]["code"], -32603)
+
+    def test_progress_written_from_loop_thread(self):
+        """测试工作线程发出的进度通知在事件循环线程写出，且先于对应的响应"""
+        threads = set()
+        request = {
+            "jsonrpc": "2.0",
+            "id": "bulk",
+            "method": "tools/call",
+            "params": {
+                "name": "bulk_detect_carriers",
+                "arguments": {"phone_numbers": ["123"] * 250, "chunk_size": 100},
+                "_meta": {"progressToken": "bulk-1"},
+            },
+        }
+
+        written = self.serve(
+            [request], on_write=lambda message: threads.add(threading.get_ident())
+        )
+
+        self.assertEqual(threads, {threading.get_ident()})
+        self.assertEqual(
+            [message.get("method") for message in written],
+            ["notifications/progress"] * 3 + [None],
+        )
+        self.assertEqual(written[-1]["id"], "bulk")
+
+    def test_batch_request(self):
+        """测试批量请求：一次写出按请求顺序排列的响应数组，通知没有响应"""
+        batch = [
+            self.call(1, "detect_carrier"),
+            {"jsonrpc": "2.0", "method": "notifications/initialized"},
+            {"jsonrpc": "2.0", "id": "b", "method": "tools/list"},
+            42,
+            {"jsonrpc": "2.0", "method": "tools/list"},
+        ]
+        written = self.serve(
+            [
+                batch,
+                [],
+                [{"jsonrpc": "2.0", "method": "notifications/initialized"}],
+                {"jsonrpc": "2.0", "method": "notifications/initialized"},
+                "[1, 2",
+            ]
+        )
+        self.assertEqual(len(written), 3)
+        responses = next(message for message in written if isinstance(message, list))
+        self.assertEqual([response["id"] for response in responses], [1, "b", None])
+        self.assertEqual(responses[0]["error"]["code"], -32602)
+        self.assertIn("tools", responses[1]["result"])
+        self.assertEqual(responses[2]["error"]["code"], -32600)
+        codes = sorted(
+            message["error"]["code"] for message in written if isinstance(message, dict)
+        )
+        self.assertEqual(codes, [-32700, -32600])
+
+    def test_large_messages(self):
+        """测试上限以内的大请求正常处理，超长请求返回错误后继续服务"""
+        phones = [f"1381234{i % 10000:04d}" for i in range(200000)]
+        large = {
+            "jsonrpc": "2.0",
+            "id": "large",
+            "method": "tools/call",
+            "params": {
+                "name": "aggregate_carriers",
+                "arguments": {"phone_numbers": phones},
+            },
+        }
+        oversized = dict(large, id="oversized", params={"padding": "x" * 5000000})
+        database = TestDatabaseBackends.SAMPLE_DATABASE
+        limit = 4 * 1024 * 1024
+        with patch.object(mcp_server, "MAX_MESSAGE_BYTES", limit), patch.object(
+            mcp_server, "get_phone_database", return_value=database
+        ):
+            written = self.serve(
+                [large, oversized, {"jsonrpc": "2.0", "id": 3, "method": "tools/list"}]
+            )
+        self.assertGreater(len(json.dumps(large)), 2 * 1024 * 1024)
+        by_id = {message["id"]: message for message in written}
+        self.assertEqual(set(by_id), {"large", None, 3})
+        data = json.loads(by_id["large"]["result"]["content"][0]["text"])
+        self.assertEqual(data["total"], len(phones))
+        self.assertEqual(by_id[None]["error"]["code"], -32600)
+        self.assertIn("tools", by_id[3]["result"])
+
+    def test_oversized_message(self):
+        """测试超过上限的行被整行丢弃，不会被拆成多个请求"""
+        with patch.object(mcp_server, "MAX_MESSAGE_BYTES", 1024):
+            written = self.serve(
+                [
+                    {"jsonrpc": "2.0", "id": 1, "method": "x" * 5000},
+                    {"jsonrpc": "2.0", "id": 2, "method": "tools/list"},
+                    "[" + "1," * 3000,
+                ]
+            )
+        self.assertEqual(len(written), 3)
+        errors = [message for message in written if message["id"] is None]
+        self.assertEqual(len(errors), 2)
+        self.assertIn("tools", next(m for m in written if m["id"] == 2)["result"])
+        for message in errors:
+            self.assertEqual(message["error"]["code"], -32600)
+            self.assertIn("1024 bytes", message["error"]["message"])
+
+    def test_interleaved_ids_stress(self):
+        """测试数千个交错的并发请求，每个响应都对应自己的请求"""
+        requests, expected = [], {}
+        for i in range(3000):
+            if i % 10 == 0:
+                request_id = f"list-{i}"
+                requests.append(
+                    {"jsonrpc": "2.0", "id": request_id, "method": "tools/list"}
+                )
+                expected[request_id] = None
+                continue
+            phone = f"1381234{i % 10000:04d}"
+            requests.append(
+                {
+                    "jsonrpc": "2.0",
+                    "id": i,
+                    "method": "tools/call",
+                    "params": {
+                        "name": "detect_carrier",
+                        "arguments": {"phone_number": phone, "format": "compact"},
+                    },
+                }
+            )
+            expected[i] = phone
+
+        # 每次查询随机延迟，使请求在线程池中乱序完成
+        rng = random.Random(0)
+        lookup = mcp_server.detect_carrier
+
+        def jittered(phone_number):
+            time.sleep(rng.random() / 1000)
+            return lookup(phone_number, TestDatabaseBackends.SAMPLE_DATABASE)
+
+        with patch.object(mcp_server, "detect_carrier", side_effect=jittered):
+            written = self.serve(requests, limit=64)
+
+        self.assertEqual(len(written), len(requests))
+        self.assertNotEqual(
+            [message["id"] for message in written],
+            [request["id"] for request in requests],
+        )
+        self.assertEqual({message["id"] for message in written}, set(expected))
+        for message in written:
+            phone = expected[message["id"]]
+            if phone is None:
+                self.assertIn("tools", message["result"])
+            else:
+                data = json.loads(message["result"]["content"][0]["text"])
+                self.assertEqual(data["phone_number"], phone)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+二进制数据库与查询索引测试
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from array import array
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import phone_index
+from phone_index import (
+    CompiledPhoneDatabase,
+    DatabaseStats,
+    DirectIndexDatabase,
+    PhoneRecord,
+    PrefixIndex,
+    RecordInterner,
+    ShardedPhoneDatabase,
+    database_stats,
+    encode_database,
+    lookup_record,
+    merge_intervals,
+    prefix_of,
+    prefixes_of,
+    tally_codes,
+)
+
+SAMPLE_DATABASE = {
+    "1300000": {
+        "province": "山东",
+        "city": "济南",
+        "carrier": "China Unicom",
+        "carrier_cn": "联通",
+    },
+    "1300001": {
+        "province": "江苏",
+        "city": "常州",
+        "carrier": "China Unicom",
+        "carrier_cn": "联通",
+    },
+    "1300005": {
+        "province": "山东",
+        "city": "济南",
+        "carrier": "China Unicom",
+        "carrier_cn": "联通",
+    },
+    "1381234": {
+        "province": "江苏",
+        "city": "连云港",
+        "carrier": "China Mobile",
+        "carrier_cn": "移动",
+    },
+    "1921000": {
+        "province": "山东",
+        "city": "济南",
+        "carrier": "China Broadcasting",
+        "carrier_cn": "广电",
+    },
+}
+
+
+class TestPhoneRecord(unittest.TestCase):
+    """驻留记录测试"""
+
+    def test_record_behaves_like_dict(self):
+        """测试记录与原字典记录的访问方式一致"""
+        record = PhoneRecord("山东", "济南", "China Unicom", "联通")
+        self.assertEqual(record["city"], "济南")
+        self.assertIn("carrier_cn", record)
+        self.assertNotIn("phone_number", record)
+        self.assertEqual(record, SAMPLE_DATABASE["1300000"])
+        self.assertEqual(json.loads(json.dumps(record, default=dict)), dict(record))
+        with self.assertRaises(KeyError):
+            record["prefix"]
+        with self.assertRaises(AttributeError):
+            record.extra = 1
+
+    def test_interner_shares_records(self):
+        """测试相同归属地共享同一个记录对象"""
+        interner = RecordInterner()
+        database = json.loads(
+            json.dumps(SAMPLE_DATABASE, ensure_ascii=False),
+            object_hook=interner.object_hook,
+        )
+        self.assertEqual(database, SAMPLE_DATABASE)
+        self.assertIsInstance(database["1300000"], PhoneRecord)
+        self.assertIs(database["1300000"], database["1300005"])
+        self.assertIs(database["1300000"].city, database["1921000"].city)
+
+    def test_result_template_is_cached(self):
+        """测试结果模板按记录缓存且不属于记录字段"""
+        record = PhoneRecord("山东", "济南", "China Unicom", "联通")
+        template = record.result_template()
+        self.assertIs(record.result_template(), template)
+        self.assertEqual(template["carrier_cn"], "联通")
+        self.assertIsNone(template["phone_number"])
+        self.assertEqual(len(record), 4)
+        self.assertNotIn("_result", record)
+
+
+class TestPrefixLookup(unittest.TestCase):
+    """整数前缀提取与查找测试"""
+
+    def test_prefix_of(self):
+        """测试号码校验与前缀提取"""
+        self.assertEqual(prefix_of("13812345678"), 1381234)
+        self.assertEqual(prefix_of("19210001234"), 1921000)
+        invalid = [
+            "",
+            "1381234567",
+            "138123456789",
+            "12812345678",
+            "23812345678",
+            "138-1234-567",
+            "１３８１２３４５６７８",
+        ]
+        for phone in invalid:
+            self.assertEqual(prefix_of(phone), -1, phone)
+
+    def test_prefixes_of(self):
+        """测试批量转换与逐个转换结果一致，超长输入不放大定长数组"""
+        numbers = [
+            "13812345678",
+            "19210001234",
+            "1381234567",
+            "138123456789",
+            "12812345678",
+            "１３８１２３４５６７８",
+            "",
+            "1" * 20000,
+        ] * 40
+        expected = [prefix_of(phone) for phone in numbers]
+        with patch.object(phone_index, "np", None):
+            self.assertEqual(list(prefixes_of(numbers)), expected)
+        if phone_index.np is not None:
+            with patch.object(phone_index, "NUMPY_MIN_BATCH", 0):
+                self.assertEqual(list(prefixes_of(numbers)), expected)
+                self.assertEqual(list(prefixes_of(["1" * 30])), [-1])
+
+    def test_lookup_record_backends(self):
+        """测试各后端按整数前缀查找结果一致"""
+        backends = [SAMPLE_DATABASE, DirectIndexDatabase.from_mapping(SAMPLE_DATABASE)]
+        for backend in backends:
+            self.assertEqual(
+                lookup_record(backend, 1381234), SAMPLE_DATABASE["1381234"]
+            )
+            self.assertIsNone(lookup_record(backend, 1399999))
+
+    def test_tally_codes(self):
+        """测试归属地编码计数（numpy 与纯 Python 路径）并累加到已有计数"""
+        codes = [0, 2, -1, 2, 2, -1] * 100
+        with patch.object(phone_index, "np", None):
+            counts = tally_codes(codes, 3)
+            self.assertEqual(counts, [200, 100, 0, 300])
+            self.assertEqual(tally_codes([1], 3, counts), [200, 100, 1, 300])
+        if phone_index.np is not None:
+            self.assertEqual(list(tally_codes(codes, 3)), [200, 100, 0, 300])
+            self.assertEqual(
+                list(tally_codes(codes, 3, [1, 1, 1, 1])), [201, 101, 1, 301]
+            )
+
+
+class TestCompiledDatabase(unittest.TestCase):
+    """编译后二进制数据库测试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "phone_database.bin")
+        with open(self.filename, "wb") as f:
+            f.write(encode_database(SAMPLE_DATABASE))
+        self.database = CompiledPhoneDatabase(self.filename)
+
+    def tearDown(self):
+        del self.database
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        """测试编码后读取结果与原始数据一致"""
+        self.assertEqual(len(self.database), len(SAMPLE_DATABASE))
+        self.assertEqual(list(self.database), sorted(SAMPLE_DATABASE))
+        for prefix, info in SAMPLE_DATABASE.items():
+            self.assertIn(prefix, self.database)
+            self.assertEqual(self.database[prefix], info)
+
+    def test_missing_prefix(self):
+        """测试不存在的前缀"""
+        self.assertNotIn("1399999", self.database)
+        self.assertNotIn("abc", self.database)
+        self.assertNotIn("１３８１２３４", self.database)
+        self.assertEqual(self.database.code_of(1000000), -1)
+        self.assertEqual(self.database.code_of(1999999), -1)
+
+    def test_regions_are_shared(self):
+        """测试相同归属地共享同一条记录"""
+        self.assertEqual(len(self.database.regions), 4)
+        self.assertIs(self.database["1300000"], self.database["1300005"])
+
+    def test_invalid_file(self):
+        """测试无效文件"""
+        bad_file = os.path.join(self.tmpdir.name, "bad.bin")
+        with open(bad_file, "wb") as f:
+            f.write(b"not a database" * 4)
+        with self.assertRaises(ValueError):
+            CompiledPhoneDatabase(bad_file)
+
+    def test_truncated_file(self):
+        """测试截断的文件被拒绝，而不是返回不完整的数据"""
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        truncated = os.path.join(self.tmpdir.name, "truncated.bin")
+        for size in (len(data) // 2, len(data) - 1, 10):
+            with open(truncated, "wb") as f:
+                f.write(data[:size])
+            with self.assertRaises(ValueError):
+                CompiledPhoneDatabase(truncated)
+
+
+class TestIntervalDatabase(unittest.TestCase):
+    """区间压缩数据库测试"""
+
+    def test_merge_intervals(self):
+        """测试连续且归属地相同的前缀被合并"""
+        prefixes = array("I", [1300000, 1300001, 1300002, 1300004, 1300005])
+        codes = array("H", [0, 0, 1, 1, 1])
+        starts, ends, interval_codes = merge_intervals(prefixes, codes)
+        self.assertEqual(list(starts), [1300000, 1300002, 1300004])
+        self.assertEqual(list(ends), [1300002, 1300003, 1300006])
+        self.assertEqual(list(interval_codes), [0, 1, 1])
+
+    def test_interval_round_trip(self):
+        """测试区间格式读取结果与原始数据一致"""
+        database = {f"13{i:05d}": dict(SAMPLE_DATABASE["1300000"]) for i in range(100)}
+        database.update(SAMPLE_DATABASE)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "phone_intervals.bin")
+            with open(filename, "wb") as f:
+                f.write(encode_database(database, intervals=True))
+            compiled = CompiledPhoneDatabase(filename)
+
+            self.assertEqual(len(compiled), len(database))
+            self.assertEqual(dict(compiled), database)
+            self.assertNotIn("1300100", compiled)
+            self.assertNotIn("1299999", compiled)
+            self.assertEqual(len(compiled._starts), 5)
+            del compiled
+
+
+class TestDirectIndexDatabase(unittest.TestCase):
+    """直接寻址前缀表测试"""
+
+    def setUp(self):
+        self.database = DirectIndexDatabase.from_mapping(SAMPLE_DATABASE)
+
+    def test_matches_dict(self):
+        """测试与字典后端结果一致"""
+        self.assertEqual(len(self.database), len(SAMPLE_DATABASE))
+        self.assertEqual(dict(self.database), SAMPLE_DATABASE)
+        for prefix in ["1300002", "1299999", "2000000", "0130000", "abc"]:
+            self.assertEqual(prefix in self.database, prefix in SAMPLE_DATABASE)
+
+    def test_code_bounds(self):
+        """测试前缀空间边界"""
+        self.assertEqual(self.database.code_of(1299999), -1)
+        self.assertEqual(self.database.code_of(2000000), -1)
+        self.assertEqual(self.database.code_of(1999999), -1)
+        self.assertGreaterEqual(self.database.code_of(1300000), 0)
+        self.assertEqual(self.database.code_of(1300000), self.database.code_of(1300005))
+
+
+class TestShardedDatabase(unittest.TestCase):
+    """按号段分片数据库测试"""
+
+    def setUp(self):
+        from parse_phone_data import save_sharded_database
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with patch("builtins.print"):
+            save_sharded_database(SAMPLE_DATABASE, self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup_loads_shard_on_demand(self):
+        """测试首次命中号段时才加载分片"""
+        database = ShardedPhoneDatabase(self.tmpdir.name)
+        self.assertEqual(sorted(database.segments), ["130", "138", "192"])
+        self.assertEqual(len(database), len(SAMPLE_DATABASE))
+        self.assertEqual(database.loaded_segments(), [])
+
+        self.assertEqual(database["1381234"], SAMPLE_DATABASE["1381234"])
+        self.assertEqual(database.loaded_segments(), ["138"])
+        self.assertNotIn("1391234", database)
+        self.assertEqual(dict(database), SAMPLE_DATABASE)
+
+    def test_lru_eviction(self):
+        """测试超过分片上限时淘汰最久未使用的分片"""
+        database = ShardedPhoneDatabase(self.tmpdir.name, max_shards=2)
+        database["1300000"]
+        database["1381234"]
+        database["1300001"]
+        database["1921000"]
+        self.assertEqual(database.loaded_segments(), ["130", "192"])
+
+
+class TestPrefixIndex(unittest.TestCase):
+    """有序前缀索引与倒排表测试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def backends(self):
+        yield SAMPLE_DATABASE
+        yield DirectIndexDatabase.from_mapping(SAMPLE_DATABASE)
+        for intervals in (False, True):
+            filename = os.path.join(self.tmpdir.name, f"db{intervals}.bin")
+            with open(filename, "wb") as f:
+                f.write(encode_database(SAMPLE_DATABASE, intervals=intervals))
+            yield CompiledPhoneDatabase(filename)
+
+    def test_backends_build_same_index(self):
+        """测试各后端构建的有序前缀数组一致"""
+        for database in self.backends():
+            index = PrefixIndex.from_database(database)
+            self.assertEqual(list(index.prefixes), sorted(map(int, SAMPLE_DATABASE)))
+            self.assertEqual(
+                [dict(index.regions[code]) for code in index.codes],
+                [SAMPLE_DATABASE[prefix] for prefix in sorted(SAMPLE_DATABASE)],
+            )
+            self.assertEqual(index.span(1300000, 1309999), (0, 3))
+
+    def test_match_regions(self):
+        """测试按字段组合匹配归属地"""
+        index = PrefixIndex.from_database(SAMPLE_DATABASE)
+        unicom = index.match_regions(carrier="China Unicom")
+        self.assertEqual(index.match_regions(carrier="联通"), unicom)
+        self.assertEqual(len(unicom), 2)
+        jinan = index.match_regions(carrier="联通", city="济南")
+        self.assertEqual(len(jinan), 1)
+        self.assertEqual(index.match_regions(carrier="联通", province="四川"), [])
+        self.assertEqual(index.range_totals(jinan), (2, 2))
+        self.assertIn("连云港", index.values("city"))
+
+    def test_iter_ranges_from_cursor(self):
+        """测试区间按起始前缀归并输出，并可从游标处继续"""
+        index = PrefixIndex.from_database(SAMPLE_DATABASE)
+        unicom = index.match_regions(carrier="联通")
+        ranges = list(index.iter_ranges(unicom))
+        self.assertEqual(
+            [(start, end) for start, end, _ in ranges],
+            [(1300000, 1300001), (1300001, 1300002), (1300005, 1300006)],
+        )
+        self.assertEqual(list(index.iter_ranges(unicom, 1300001)), ranges[1:])
+
+
+class TestDatabaseStats(unittest.TestCase):
+    """前缀分布统计测试"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def compiled(self, intervals: bool, legacy: bool = False) -> CompiledPhoneDatabase:
+        data = encode_database(SAMPLE_DATABASE, intervals=intervals)
+        if legacy:
+            # 不含末尾归属地计数段的旧文件
+            data = data[: -4 * 4]
+        filename = os.path.join(self.tmpdir.name, f"db{intervals}{legacy}.bin")
+        with open(filename, "wb") as f:
+            f.write(data)
+        return CompiledPhoneDatabase(filename)
+
+    def test_backends_report_same_stats(self):
+        """测试各后端（含旧格式文件）得到的分布一致"""
+        expected = DatabaseStats.from_mapping(SAMPLE_DATABASE)
+        self.assertEqual(expected.records, 5)
+        self.assertEqual(expected.counts[("山东", "济南", "China Unicom", "联通")], 2)
+        backends = [DirectIndexDatabase.from_mapping(SAMPLE_DATABASE)]
+        for intervals in (False, True):
+            backends.append(self.compiled(intervals))
+            backends.append(self.compiled(intervals, legacy=True))
+        with patch.object(phone_index, "np", None):
+            self.assertEqual(database_stats(backends[0]).counts, expected.counts)
+        for backend in backends:
+            self.assertEqual(database_stats(backend).counts, expected.counts)
+        self.assertIsNotNone(backends[1]._region_counts)
+        self.assertIsNone(backends[2]._region_counts)
+
+    def test_totals_and_delta(self):
+        """测试按字段汇总以及增量更新与重新统计一致"""
+        stats = DatabaseStats.from_mapping(SAMPLE_DATABASE)
+        self.assertEqual(stats.totals(["province"]), {("山东",): 3, ("江苏",): 2})
+        self.assertEqual(stats.totals(["carrier_cn"])[("联通",)], 3)
+
+        new = dict(SAMPLE_DATABASE)
+        del new["1300001"]
+        new["1381234"] = dict(new["1381234"], city="南京")
+        new["1921001"] = new["1921000"]
+        delta = {"added": ["1921001"], "removed": ["1300001"], "modified": ["1381234"]}
+        stats.apply_delta(SAMPLE_DATABASE, new, delta)
+        self.assertEqual(stats.counts, DatabaseStats.from_mapping(new).counts)
+        self.assertNotIn(("江苏", "常州", "China Unicom", "联通"), stats.counts)
+
+        restored = DatabaseStats.from_json(json.loads(json.dumps(stats.to_json())))
+        self.assertEqual(restored.counts, stats.counts)
+
+    def test_sharded_stats_from_manifest(self):
+        """测试分片后端从 manifest 读取分布而不加载分片"""
+        from parse_phone_data import save_sharded_database
+
+        stats = DatabaseStats.from_mapping(SAMPLE_DATABASE)
+        with patch("builtins.print"):
+            save_sharded_database(SAMPLE_DATABASE, self.tmpdir.name, stats=stats)
+        database = ShardedPhoneDatabase(self.tmpdir.name)
+        self.assertEqual(database_stats(database).counts, stats.counts)
+        self.assertEqual(database.loaded_segments(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()